@@ -249,15 +249,15 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     data['ExNMDA']['Beta'] = Beta
     data['ExNMDA']['Cdur'] = Cdur
 
-    data['recording']['time'] = list(t_vec)
-    data['recording']['soma']['voltage'] = list(v_vec_soma)
-    data['recording']['basal_34']['voltage_0.8'] = list(v_vec_dend1)
-    data['recording']['basal_34']['voltage_0.5'] = list(v_vec_dend2)
-    data['recording']['basal_34']['voltage_0.3'] = list(v_vec_dend3)
-    data['recording']['soma']['ica'] = list(cai_soma)
-    data['recording']['basal_34']['ica_0.3'] = list(cai_dend)
-
-    savejson(data, title, directory, ext = "json", verbose = False)
+    data['recording']['time'] = pack_time(t_vec)
+    data['recording']['soma']['voltage'] = vec2np(v_vec_soma)
+    data['recording']['basal_34']['voltage_0.8'] = vec2np(v_vec_dend1)
+    data['recording']['basal_34']['voltage_0.5'] = vec2np(v_vec_dend2)
+    data['recording']['basal_34']['voltage_0.3'] = vec2np(v_vec_dend3)
+    data['recording']['soma']['ica'] = vec2np(cai_soma)
+    data['recording']['basal_34']['ica_0.3'] = vec2np(cai_dend)
+
+    saverun(data, title, directory, verbose = False)
 
 
 ######################################################
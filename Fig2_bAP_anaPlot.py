@@ -23,145 +23,180 @@ import pandas as pd
 import analysis_utils as ana
 from analysis_utils import tableau #from analysis_utils import *
 import utils as ut #from utils import *
+import runindex as ri
+import analysis_runner as runner
+import featurecache as fc
 import seaborn as sns
 import itertools
 import time
 
 #################################
 # Analysis all the json files with recording to get AP peak time and peak Amplitude against dist to soma
-# Save the analysed results
+# (one shard of files per worker process, see analysis_runner.py)
 #################################
-new_data = pd.DataFrame(columns = ['Bnum', 'condition', 'dist', 'Peak_amp', 'Peak_t', 'Soma_v'])
-path_to_json = 'Fig2/'
-start_time = time.time()
-json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
-
-i = 0
-for index, js in enumerate(json_files):
-    with open(os.path.join(path_to_json, js)) as json_file:
-        data = json.load(json_file)
-        if 'TTX' in js:
+def dend_traces(data):
+    """Distances to soma (um) and the dendritic voltage traces of a run,
+    one row per recording site, in the order of the sites on the branch."""
+    dend = data['recording']['dend']
+    if 'voltage' in dend:
+        # The distances were measured on the cell (h.distance) in Fig2_bAP_exp.py
+        return np.asarray(data['dist'], dtype = float), np.asarray(dend['voltage'])
+    # Runs saved before: one trace per site, keyed by the distance as a string
+    keys = sorted(dend, key = float)
+    return np.array([float(key) for key in keys]), np.array([dend[key] for key in keys])
+
+def analysis_runs(json_files):
+    """AP peak amplitude and delay at every recorded location of the runs."""
+    columns = ['Bnum', 'condition', 'dist', 'Peak_amp', 'Peak_t', 'Soma_v', 'run']
+    # One list of arrays per column; the table is built once at the end
+    table = dict((name, []) for name in columns)
+    cache = fc.FeatureCache()
+    for js in json_files:
+        data = ut.loadrun(js)
+        if 'TTX' in os.path.basename(js):
             condition = 'TTX'
-        elif '4AP' in js:
+        elif '4AP' in os.path.basename(js):
             condition = '4AP'
         else:
             condition = 'Control'
-        Bnum = data['Bnum']
-        soma_v, soma_t = ana.single_spike(data['recording']['soma']['voltage'])
-
-        for key, value in data['recording']['dend'].iteritems():
-            dist = key
-            dend_v, dend_t = ana.single_spike(value)
-            peak_del = dend_t - soma_t
-            i += 1
-            new_data.loc[i] = [Bnum, condition, dist, dend_v, peak_del, soma_v]
-
-df = new_data.sort_values(by = ['dist'])
-savepath = path_to_json + 'bAP_total_results.csv'
-df.to_csv(savepath)
+        dt = ut.get_dt(data)
+        dist, dend = dend_traces(data)
+        soma_v, soma_t = cache.call(ana.batch_single_spike, data['recording']['soma']['voltage'], dt)
+        # All the recording sites of the branch at once
+        dend_v, dend_t = cache.call(ana.batch_single_spike, dend, dt)
+        n = len(dist)
+        table['Bnum'].append(np.repeat(data['Bnum'], n))
+        table['condition'].append(np.repeat(condition, n))
+        table['dist'].append(dist)
+        table['Peak_amp'].append(dend_v)
+        table['Peak_t'].append(dend_t - soma_t)
+        table['Soma_v'].append(np.repeat(soma_v, n))
+        table['run'].append(np.repeat(js, n))
+    cache.close()
+    new_data = pd.DataFrame(dict((name, np.concatenate(values) if values else [])
+                                 for name, values in table.items()), columns = columns)
+    return new_data
 
 #################################
-# Combine data and plot
+# Bin the data
 #################################
-path = path_to_json + 'bAP_total_results.csv'
-df = pd.read_csv(path, index_col = 0)
-df.set_index(['Bnum'], inplace=True)
-df_con = df[df['condition'] == 'Control'].sort_values(by = ['dist'],ascending=True)
-df_TTX = df[df['condition'] == 'TTX'].sort_values(by = ['dist'],ascending=True)
-df_4AP = df[df['condition'] == '4AP'].sort_values(by = ['dist'],ascending=True)
-
-##### Bin the data
-def map_bin(x, bins):
+def bin_means(df, bins, n_bins = 12):
     """
-    Map the data in each bin
-        x: data value
-        bins: numpy array of bin frequency
+    Mean of the measurements in each distance bin, for every condition
+        df: the results table (one row per recording site)
+        bins: numpy array of the bin edges (um)
+        n_bins: number of bins kept (closest to soma first)
     Return
-        [low_limit, upper_limit] of the bin where the x belongs
+        table with one row per condition and bin: the lower edge of the bin
+        ('bin') and the means of dist, Peak_amp, Peak_t and Soma_v
     """
-    kwargs = {}
-    if x == max(bins):
-        kwargs['right'] = True
-    bin = bins[np.digitize([x], bins, **kwargs)[0]]
-    bin_lower = bins[np.digitize([x], bins, **kwargs)[0]-1]
-    return '[{0}-{1}]'.format(bin_lower, bin)
-
-
-freq_bins = np.arange(0, 300, 20)
-df_con['Binned'] = df_con['dist'].apply(map_bin, bins=freq_bins)
-df_TTX['Binned'] = df_TTX['dist'].apply(map_bin, bins=freq_bins)
-df_4AP['Binned'] = df_4AP['dist'].apply(map_bin, bins=freq_bins)
-
-df_con_group = df_con.groupby(['Binned'], sort=True).mean()
-df_con_group = df_con_group.sort_values(by = ['dist']).iloc[0:12]
-df_TTX_group = df_TTX.groupby('Binned').mean()
-df_TTX_group = df_TTX_group.sort_values(by = ['dist']).iloc[0:12]
-df_4AP_group = df_4AP.groupby('Binned').mean()
-df_4AP_group = df_4AP_group.sort_values(by = ['dist']).iloc[0:12]
-
+    dist = df['dist'].values
+    # bins[i-1] <= dist < bins[i]; the last edge is part of the last bin
+    idx = np.digitize(dist, bins)
+    idx[dist == bins[-1]] = len(bins) - 1
+    inside = (idx > 0) & (idx < len(bins))
+    binned = df[inside].assign(bin = bins[idx[inside] - 1])
+    means = binned.groupby(['condition', 'bin'])[['dist', 'Peak_amp', 'Peak_t', 'Soma_v']]\
+        .mean().reset_index()
+    # The groups are sorted by bin, so the first n_bins of each condition
+    # are the ones closest to the soma
+    return means.groupby('condition').head(n_bins)
 
 #################################
-# Plot and save the figures
-path_to_figure = path_to_json + 'New_Figs/'
-plt.close()
-plt.clf()
-plt.figure(figsize = (9,6), dpi = 300)
-plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
-ax = plt.gca()
-plt.style.use("ggplot")
-plt.rcParams['axes.edgecolor'] = "black"
-plt.rcParams['axes.facecolor'] = "white"
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-ax.yaxis.set_ticks_position('left')
-ax.xaxis.set_ticks_position('bottom')
-df_con.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(15), linewidth = 1, alpha = 0.3)
-df_con_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(20), linewidth = 2, alpha = 1)
-df_TTX.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(7), linewidth = 1, alpha = 0.3)
-df_TTX_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(6), linewidth = 2, alpha = 1)
-df_4AP.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(5), linewidth = 1, alpha = 0.3)
-df_4AP_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(4), linewidth = 2, alpha = 1)
-plt.xlabel("Distance to soma (um)", size = 22, color = "black")
-plt.ylabel("Peak Amplitude (mV)", size = 22, color = "black")
-plt.tick_params(labelsize=22, pad = 12, colors = "black")
-# plt.xticks([])
-plt.title("AP Amplitude vs. Distance", size = 20)
-plt.ylim([20, 110])
-plt.yticks(np.arange(20, 110, 20))
-# ax.grid(False)
-ax.set_facecolor('white')
-title1 = "bAP_Amplitude"
-# ut.save(title1, path_to_figure, ext="pdf", close=False, verbose=True)
-ut.save(title1, path_to_figure, ext="png", close=True, verbose=True)
-
-
-plt.close()
-plt.clf()
-plt.figure(figsize = (9,6), dpi = 300)
-plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
-ax = plt.gca()
-plt.style.use("ggplot")
-plt.rcParams['axes.edgecolor'] = "black"
-plt.rcParams['axes.facecolor'] = "white"
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-ax.yaxis.set_ticks_position('left')
-ax.xaxis.set_ticks_position('bottom')
-df_con.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(15), linewidth = 1, alpha = 0.3)
-df_con_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(20), linewidth = 2, alpha = 1)
-df_TTX.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(7), linewidth = 1, alpha = 0.3)
-df_TTX_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(6), linewidth = 2, alpha = 1)
-df_4AP.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(5), linewidth = 1, alpha = 0.3)
-df_4AP_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(4), linewidth = 2, alpha = 1)
-plt.xlabel("Distance to soma (um)", size = 22, color = "black")
-plt.ylabel("Latency (ms)", size = 22, color = "black")
-plt.tick_params(labelsize=22, pad = 12, colors = "black")
-# plt.xticks([])
-plt.title("AP Latency vs. Distance", size = 20)
-plt.ylim([0, 1.5])
-# plt.yticks(np.arange(20, 110, 20))
-# ax.grid(False)
-ax.set_facecolor('white')
-title2 = "bAP_Latency"
-# save(title2, path_to_figure, ext="pdf", close=False, verbose=True)
-ut.save(title2, path_to_figure, ext="png", close=True, verbose=True)
+if __name__ == "__main__":
+    # Save the analysed results
+    path_to_json = 'Fig2/'
+    start_time = time.time()
+    # Runs registered in the run index (see runindex.py) under this directory
+    json_files = ri.saved_runs(path_to_json)
+    savepath = path_to_json + 'bAP_total_results.parquet'
+    # Only the runs added or changed since the last analysis are analysed
+    new_data = runner.run_incremental(analysis_runs, json_files, savepath)
+
+    df = new_data.sort_values(by = ['dist'])
+    ut.savetable(df, savepath)
+
+    #################################
+    # Combine data and plot
+    #################################
+    path = path_to_json + 'bAP_total_results.parquet'
+    df = ut.loadtable(path).sort_values(by = ['dist'])
+
+    ##### Bin the data (all the conditions at once)
+    freq_bins = np.arange(0, 300, 20)
+    groups = bin_means(df, freq_bins)
+
+    df.set_index(['Bnum'], inplace=True)
+    df_con = df[df['condition'] == 'Control']
+    df_TTX = df[df['condition'] == 'TTX']
+    df_4AP = df[df['condition'] == '4AP']
+    df_con_group = groups[groups['condition'] == 'Control']
+    df_TTX_group = groups[groups['condition'] == 'TTX']
+    df_4AP_group = groups[groups['condition'] == '4AP']
+
+
+    #################################
+    # Plot and save the figures
+    path_to_figure = path_to_json + 'New_Figs/'
+    plt.close()
+    plt.clf()
+    plt.figure(figsize = (9,6), dpi = 300)
+    plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
+    ax = plt.gca()
+    plt.style.use("ggplot")
+    plt.rcParams['axes.edgecolor'] = "black"
+    plt.rcParams['axes.facecolor'] = "white"
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('bottom')
+    df_con.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(15), linewidth = 1, alpha = 0.3)
+    df_con_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(20), linewidth = 2, alpha = 1)
+    df_TTX.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(7), linewidth = 1, alpha = 0.3)
+    df_TTX_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(6), linewidth = 2, alpha = 1)
+    df_4AP.groupby('Bnum').plot(x='dist', y='Peak_amp', ax=ax, legend = False, color = tableau(5), linewidth = 1, alpha = 0.3)
+    df_4AP_group.plot(x = 'dist', y = 'Peak_amp', ax = ax, legend = False, markersize = 5, color = tableau(4), linewidth = 2, alpha = 1)
+    plt.xlabel("Distance to soma (um)", size = 22, color = "black")
+    plt.ylabel("Peak Amplitude (mV)", size = 22, color = "black")
+    plt.tick_params(labelsize=22, pad = 12, colors = "black")
+    # plt.xticks([])
+    plt.title("AP Amplitude vs. Distance", size = 20)
+    plt.ylim([20, 110])
+    plt.yticks(np.arange(20, 110, 20))
+    # ax.grid(False)
+    ax.set_facecolor('white')
+    title1 = "bAP_Amplitude"
+    # ut.save(title1, path_to_figure, ext="pdf", close=False, verbose=True)
+    ut.save(title1, path_to_figure, ext="png", close=True, verbose=True)
+
+
+    plt.close()
+    plt.clf()
+    plt.figure(figsize = (9,6), dpi = 300)
+    plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
+    ax = plt.gca()
+    plt.style.use("ggplot")
+    plt.rcParams['axes.edgecolor'] = "black"
+    plt.rcParams['axes.facecolor'] = "white"
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('bottom')
+    df_con.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(15), linewidth = 1, alpha = 0.3)
+    df_con_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(20), linewidth = 2, alpha = 1)
+    df_TTX.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(7), linewidth = 1, alpha = 0.3)
+    df_TTX_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(6), linewidth = 2, alpha = 1)
+    df_4AP.groupby('Bnum').plot(x='dist', y='Peak_t', ax=ax, legend = False, color = tableau(5), linewidth = 1, alpha = 0.3)
+    df_4AP_group.plot(x = 'dist', y = 'Peak_t', ax = ax, legend = False, markersize = 5, color = tableau(4), linewidth = 2, alpha = 1)
+    plt.xlabel("Distance to soma (um)", size = 22, color = "black")
+    plt.ylabel("Latency (ms)", size = 22, color = "black")
+    plt.tick_params(labelsize=22, pad = 12, colors = "black")
+    # plt.xticks([])
+    plt.title("AP Latency vs. Distance", size = 20)
+    plt.ylim([0, 1.5])
+    # plt.yticks(np.arange(20, 110, 20))
+    # ax.grid(False)
+    ax.set_facecolor('white')
+    title2 = "bAP_Latency"
+    # save(title2, path_to_figure, ext="pdf", close=False, verbose=True)
+    ut.save(title2, path_to_figure, ext="png", close=True, verbose=True)
@@ -9,13 +9,16 @@ Modified by : Peng Penny Gao <penggao.1987@gmail.com>
 Run simulation with NMDA.mod file - DMS model
 """
 import CA229 as de # from CA229 import *
-import matplotlib.pyplot as plt
 from neuron import h
 import numpy as np
 import utils as ut #from utils import *
+import runindex as ri
 import json
 import itertools
 import time
+import sys
+import jobqueue
+import threshold
 # import pdb     # For python debugging
 #from random import *
 
@@ -38,10 +41,24 @@ def random_beta(low, high, size):
     time_random = (high - low)*time_random + low
     return time_random
 
+######################################################
+# Save one run and add it to the run index
+def save_run(data, title, directory, TTX, runtime):
+    savepath = ut.saverun(data, title, directory, verbose = False)
+    ri.register(data, savepath, script = 'Fig3_exp_dms',
+        condition = 'TTX' if TTX else 'N', runtime = runtime)
+
+# Arguments of Glu_Stim for input weight w: the pool sizes and Cdur grow
+# with the weight as in the sweep below (threshold.py searches on w)
+def weight_input(args, w):
+    Pool_num = 8 + int(20*w)
+    return (args[0], Pool_num, Pool_num, args[3], 50 + int(100*w), w, w) + tuple(args[7:])
+
 ################### Test the ratio of different repceptors
 class Glu_Stim:
  def __init__(self, TTX = False, Pool1_num = 9, Pool2_num = 9, Beta = 0.067,
-Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
+Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], saver = None,
+save = True):
     """
     Model the Glumate Stimulation.
     Model the Receptors in 2 pools:
@@ -61,6 +78,9 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     Syn_w1: the syanptic weight of AMPA/NMDA receptors in pool1
     Syn_w2: the syanptic weight of AMPA/NMDA receptors in pool2
     Loc: the stimulation location
+    saver: utils.AsyncSaver to save the run in the background
+           (default: None, save before returning)
+    save: False to only return the run (see threshold.py)
     -----------
     Outputs:
         Figures: recording from soma and 3 different locations from basal dendrites
@@ -179,9 +199,11 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     ###########################################
     h.celsius = 32
     h.v_init =  -73.6927850677
+    run_start = time.time()
     h.init()
     h.tstop = 1000
     h.run()
+    runtime = time.time() - run_start
 
 #    pdb.set_trace()   #Debugging
     # print v_vec_soma[-1]
@@ -233,16 +255,20 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     data['ExNMDA']['Beta'] = Beta
     data['ExNMDA']['Cdur'] = Cdur
 
-    data['recording']['time'] = list(t_vec)
-    data['recording']['soma']['voltage'] = list(v_vec_soma)
-    data['recording']['basal_34']['voltage_0.8'] = list(v_vec_dend1)
-    data['recording']['basal_34']['voltage_0.5'] = list(v_vec_dend2)
-    data['recording']['basal_34']['voltage_0.3'] = list(v_vec_dend3)
-    data['recording']['soma']['ica'] = list(cai_soma)
-    data['recording']['basal_34']['ica_0.3'] = list(cai_dend)
+    data['recording']['time'] = ut.pack_time(t_vec)
+    data['recording']['soma']['voltage'] = ut.vec2np(v_vec_soma)
+    data['recording']['basal_34']['voltage_0.8'] = ut.vec2np(v_vec_dend1)
+    data['recording']['basal_34']['voltage_0.5'] = ut.vec2np(v_vec_dend2)
+    data['recording']['basal_34']['voltage_0.3'] = ut.vec2np(v_vec_dend3)
+    data['recording']['soma']['ica'] = ut.vec2np(cai_soma)
+    data['recording']['basal_34']['ica_0.3'] = ut.vec2np(cai_dend)
 
-
-    ut.savejson(data, title, directory, ext = "json", verbose = False)
+    if save and saver is None:
+        save_run(data, title, directory, TTX, runtime)
+    elif save:
+        # Saved in the writer process while the next run is simulated
+        saver.put(save_run, data, title, directory, TTX, runtime)
+    self.data = data
 
 ######################################################
 if __name__ == "__main__":
@@ -256,9 +282,28 @@ if __name__ == "__main__":
     # weight = [0.1, 0.2, 0.21, 0.22, 0.23, 0.24, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
 
     # z = Glu_Stim(True, Pool_num, Pool_num, 0.02, 50 + int(100*1), 1, 1, loc)
-    for w in weight:
-        Pool_num = 8 + int(20*w)
-        gs = Glu_Stim(False, Pool_num, Pool_num, 0.02, 50 + int(100*w), w, w, loc)
-        # Glu_Stim(True, Pool_num, Pool_num, 0.02, 50 + int(100*w), w, w, loc)
+    jobs = [(False, 8 + int(20*w), 8 + int(20*w), 0.02, 50 + int(100*w), w, w, loc)
+            for w in weight]
+    # jobs += [(True, 8 + int(20*w), 8 + int(20*w), 0.02, 50 + int(100*w), w, w, loc)
+    #          for w in weight]
+
+    if "--threshold" in sys.argv:
+        # Search the plateau threshold in weight instead of running the
+        # grid: a handful of runs per condition, both conditions in parallel
+        # (criterion 'plateau': 10 mV above baseline for 50 ms, in N and TTX)
+        grid = [(TTX, 0, 0, 0.02, 0, 0.0, 0.0, loc) for TTX in [False, True]]
+        table = threshold.search('Fig3_exp_dms', grid, input = weight_input,
+                                 low = 0.1, high = 0.9, tol = 0.01)
+        print(table[['args', 'threshold', 'n_runs']])
+        ut.savetable(table, "Fig3/DMS/thresholds.parquet")
+    elif "--submit" in sys.argv:
+        # Only queue the runs, for workers on any node (see jobqueue.py)
+        queue = jobqueue.submit_grid(sys.argv[sys.argv.index("--submit") + 1],
+                                     'Fig3_exp_dms', 'Glu_Stim', jobs)
+        print(queue.counts())
+    else:
+        with ut.AsyncSaver() as saver:
+            for args in jobs:
+                gs = Glu_Stim(*args, saver = saver)
     print("Finished.")
     print("--- %s seconds ---" % (time.time() - start_time))
@@ -19,181 +19,223 @@ import analysis_utils as ana
 #from analysis_utils import *
 from analysis_utils import tableau
 import utils as ut #from utils import *
+import runindex as ri
+import analysis_runner as runner
+import featurecache as fc
+import summarystats as st
 import seaborn as sns
 import time
 
 ######################################################
-# Analysis for Model 1
-DMS_data = pd.DataFrame(columns = ['AMPA_num', 'AMPA_locs', 'AMPA_weight',
+# Analysis of the saved runs (one shard of runs per worker process,
+# see analysis_runner.py)
+######################################################
+DMS_COLUMNS = ['AMPA_num', 'AMPA_locs', 'AMPA_weight',
 'NMDA_num', 'NMDA_locs', 'NMDA_weight', 'NMDA_Beta', 'NMDA_Cdur',
-'spike_num','platamp', 'ISI', 'platdur'])
-
-path_to_json = 'Fig3/DMS/Analysis/'
-start_time = time.time()
-json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
-
-for index, js in enumerate(json_files):
-    with open(os.path.join(path_to_json, js)) as json_file:
-        data = json.load(json_file)
-        filename = json_files[index]
-        AMPA_num = data['SynAMPA']['num']
-        AMPA_locs = data['SynAMPA']['locs']
-        AMPA_weight = data['SynAMPA']['weight']
-        NMDA_num = data['SynNMDA']['num']
-        NMDA_locs = data['SynNMDA']['locs']
-        NMDA_weight = data['SynNMDA']['weight']
-        NMDA_Beta = data['SynNMDA']['Beta']
-        NMDA_Cdur = data['SynNMDA']['Cdur']
-        spike_num = ana.spike_count(data['recording']['soma']['voltage'])
-        ISI, platamp = ana.meas_platamp(data['recording']['soma']['voltage'])
-        platdur = ana.meas_platdur(data['recording']['soma']['voltage'])
-        # For TTX
-        # platamp = TTX_platamp(data['recording']['soma']['voltage'])
-        # ISI = 0
-        DMS_data.loc[index] = [AMPA_num, AMPA_locs, AMPA_weight,
-        NMDA_num, NMDA_locs, NMDA_weight, NMDA_Beta, NMDA_Cdur,
-        spike_num, platamp, ISI, platdur]
-
-print("--- %s seconds ---" % (time.time() - start_time))
-DMS_data = DMS_data.sort_values(by = ['NMDA_weight'])
-# Add the correct saving path here:
-savepath = path_to_json + '/total_results.csv'
-DMS_data.to_csv(savepath)
+'spike_num','platamp', 'ISI', 'platdur', 'run']
 
-######################################################
-# Analysis for Model2
-Major_data = pd.DataFrame(columns = ['AMPA_num', 'AMPA_locs', 'AMPA_weight',
+MAJOR_COLUMNS = ['AMPA_num', 'AMPA_locs', 'AMPA_weight',
 'NMDA_num', 'NMDA_locs', 'NMDA_weight',
-'spike_num','platamp', 'ISI', 'platdur'])
-
-path_to_json = 'Fig3/Major/Analysis/'
-start_time = time.time()
-json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
-
-for index, js in enumerate(json_files):
-    with open(os.path.join(path_to_json, js)) as json_file:
-        data = json.load(json_file)
-        filename = json_files[index]
-        AMPA_num = data['SynAMPA']['num']
-        AMPA_locs = data['SynAMPA']['locs']
-        AMPA_weight = data['SynAMPA']['weight']
-        NMDA_num = data['SynNMDA']['num']
-        NMDA_locs = data['SynNMDA']['locs']
-        NMDA_weight = data['SynNMDA']['weight']
-        # NMDA_Beta = data['SynNMDA']['Beta']
-        # NMDA_Cdur = data['SynNMDA']['Cdur']
-        spike_num = ana.spike_count(data['recording']['soma']['voltage'])
-        ISI, platamp = ana.meas_platamp(data['recording']['soma']['voltage'])
-        platdur = ana.meas_platdur(data['recording']['soma']['voltage'])
-        # For TTX
-        # platamp = TTX_platamp(data['recording']['soma']['voltage'])
-        # ISI = 0
-        Major_data.loc[index] = [AMPA_num, AMPA_locs, AMPA_weight,
-        NMDA_num, NMDA_locs, NMDA_weight,
-        spike_num, platamp, ISI, platdur]
-
-print("--- %s seconds ---" % (time.time() - start_time))
-Major_data = Major_data.sort_values(by = ['NMDA_weight'])
-# Add the correct saving path here:
-savepath = path_to_json + '/total_results.csv'
-Major_data.to_csv(savepath)
-
-
-# ##### Plotting
-File1 = 'Fig3/DMS/Analysis/total_results.csv'
-File2 = 'Fig3/Major/Analysis/total_results.csv'
-
-df1 = pd.read_csv(File1, index_col = 0)
-df2 = pd.read_csv(File2, index_col = 0)
-
-savepath = 'Fig3/'
-plt.close()
-plt.clf()
-plt.figure(figsize = (9,6), dpi = 100)
-plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
-ax = plt.gca()
-plt.style.use("ggplot")
-plt.rcParams['axes.edgecolor'] = "black"
-plt.rcParams['axes.facecolor'] = "white"
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-ax.grid(False)
-# ax.spines['bottom'].set_visible(False)
-ax.yaxis.set_ticks_position('left')
-ax.xaxis.set_ticks_position('bottom')
-plt.plot(df1['NMDA_weight'], df1['platamp'],linestyle = '--', marker = 'o',
-markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
-plt.plot(df2['NMDA_weight'], df2['platamp'],linestyle = '-', marker = '^',
-markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
-plt.xlabel("NMDA weight", size = 22, color = 'black')
-plt.ylabel("Plateau Amp (mV)", size = 22, color = 'black')
-ax.tick_params(labelsize=22, pad = 12, colors = "black")
-ax.set_facecolor('white')
-plt.xlim([0,1])
-plt.ylim([0,25])
-ax.set_facecolor('white')
-plt.legend(loc = 'best', fontsize = 22)
-title = "Platamp_Model_B&W"
-# save(title, savepath, ext="pdf", close=False, verbose=True)
-ut.save(title, savepath, ext="png", close=True, verbose=True)
-###################################################
-plt.close()
-plt.clf()
-plt.figure(figsize = (9,6), dpi = 100)
-plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
-ax = plt.gca()
-plt.style.use("ggplot")
-plt.rcParams['axes.edgecolor'] = "black"
-plt.rcParams['axes.facecolor'] = "white"
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-ax.grid(False)
-# ax.spines['bottom'].set_visible(False)
-ax.yaxis.set_ticks_position('left')
-ax.xaxis.set_ticks_position('bottom')
-plt.plot(df1['NMDA_weight'], df1['platdur'],linestyle = '--', marker = 'o',
-markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
-plt.plot(df2['NMDA_weight'], df2['platdur'],linestyle = '-', marker = '^',
-markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
-plt.xlabel("NMDA weight", size = 22, color = 'black')
-plt.ylabel("Plateau Duration (ms)", size = 22, color = 'black')
-ax.tick_params(labelsize=22, pad = 12, colors = "black")
-ax.set_facecolor('white')
-plt.xlim([0,1])
-plt.ylim([-10,330])
-ax.set_facecolor('white')
-plt.legend(loc = 'best', fontsize = 22)
-title = "Platdur_Model_B&W"
-# save(title, savepath, ext="pdf", close=False, verbose=True)
-ut.save(title, savepath, ext="png", close=True, verbose=True)
-
-###################################################
-plt.close()
-plt.clf()
-plt.figure(figsize = (9,6), dpi = 100)
-plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
-ax = plt.gca()
-plt.style.use("ggplot")
-plt.rcParams['axes.edgecolor'] = "black"
-plt.rcParams['axes.facecolor'] = "white"
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-ax.grid(False)
-# ax.spines['bottom'].set_visible(False)
-ax.yaxis.set_ticks_position('left')
-ax.xaxis.set_ticks_position('bottom')
-plt.plot(df1['NMDA_weight'], df1['spike_num'],linestyle = '--', marker = 'o',
-markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
-plt.plot(df2['NMDA_weight'], df2['spike_num'],linestyle = '-', marker = '^',
-markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
-plt.xlabel("NMDA weight", size = 22, color = 'black')
-plt.ylabel("Spike Numbers", size = 22, color = 'black')
-ax.tick_params(labelsize=22, pad = 12, colors = "black")
-ax.set_facecolor('white')
-plt.xlim([0,1])
-plt.ylim([-0.5,11.5])
-plt.legend(loc = 'best', fontsize = 22)
-ax.set_facecolor('white')
-title = "SpikeNum_Model_B&W"
-# save(title, savepath, ext="pdf", close=False, verbose=True)
-ut.save(title, savepath, ext="png", close=True, verbose=True)
+'spike_num','platamp', 'ISI', 'platdur', 'run']
+
+# Columns of the features from analysis_utils.batch_features
+FEATURES = [('spike_num', 'spike_num'), ('platamp', 'soma_platamp'),
+            ('ISI', 'ISI'), ('platdur', 'soma_platdur')]
+
+def analysis_runs(json_files, columns):
+    """Parameters and features of the saved runs in json_files."""
+    # One list per column; the table is built once at the end
+    table = dict((name, []) for name in columns)
+    soma = []
+    grids = []
+    for js in json_files:
+        data = ut.loadrun(js)
+        table['AMPA_num'].append(data['SynAMPA']['num'])
+        table['AMPA_locs'].append(data['SynAMPA']['locs'])
+        table['AMPA_weight'].append(data['SynAMPA']['weight'])
+        table['NMDA_num'].append(data['SynNMDA']['num'])
+        table['NMDA_locs'].append(data['SynNMDA']['locs'])
+        table['NMDA_weight'].append(data['SynNMDA']['weight'])
+        if 'NMDA_Beta' in columns:
+            table['NMDA_Beta'].append(data['SynNMDA']['Beta'])
+            table['NMDA_Cdur'].append(data['SynNMDA']['Cdur'])
+        table['run'].append(js)
+        soma.append(data['recording']['soma']['voltage'])
+        # The sampling interval and number of samples (see utils.pack_time)
+        grids.append((ut.get_dt(data), len(soma[-1])))
+
+    # Features of all the runs on the same time grid at once (one run per
+    # row); runs measured before are read from the feature cache.
+    # For TTX: cache.batch_features(soma, TTX = True)
+    if soma:
+        for column, feature in FEATURES:
+            table[column] = [None] * len(soma)
+        cache = fc.FeatureCache()
+        for dt, n in sorted(set(grids)):
+            rows = [i for i, grid in enumerate(grids) if grid == (dt, n)]
+            features = cache.batch_features(np.array([soma[i] for i in rows]), dt = dt)
+            for column, feature in FEATURES:
+                for i, row in enumerate(rows):
+                    table[column][row] = features[feature][i]
+        cache.close()
+    new_data = pd.DataFrame(table, columns = columns)
+    return new_data
+
+def analysis_DMS(json_files):
+    return analysis_runs(json_files, DMS_COLUMNS)
+
+def analysis_Major(json_files):
+    return analysis_runs(json_files, MAJOR_COLUMNS)
+
+# Mean and bootstrap CI of the features per NMDA weight, for the plots
+SUMMARY_COLUMNS = ['spike_num', 'platamp', 'ISI', 'platdur']
+
+def save_summary(table, savepath):
+    summary = st.summarize(table, ['NMDA_weight'], SUMMARY_COLUMNS)
+    ut.savetable(summary, st.summary_path(savepath))
+    return summary
+
+######################################################
+if __name__ == "__main__":
+    ######################################################
+    # Analysis for Model 1
+    path_to_json = 'Fig3/DMS/Analysis/'
+    start_time = time.time()
+    # Runs registered in the run index (see runindex.py) under this directory
+    json_files = ri.saved_runs(path_to_json)
+    # Add the correct saving path here:
+    savepath = path_to_json + '/total_results.parquet'
+    # Only the runs added or changed since the last analysis are analysed
+    DMS_data = runner.run_incremental(analysis_DMS, json_files, savepath)
+
+    print("--- %s seconds ---" % (time.time() - start_time))
+    DMS_data = DMS_data.sort_values(by = ['NMDA_weight'])
+    ut.savetable(DMS_data, savepath)
+    save_summary(DMS_data, savepath)
+
+    ######################################################
+    # Analysis for Model2
+    path_to_json = 'Fig3/Major/Analysis/'
+    start_time = time.time()
+    # Runs registered in the run index (see runindex.py) under this directory
+    json_files = ri.saved_runs(path_to_json)
+    # Add the correct saving path here:
+    savepath = path_to_json + '/total_results.parquet'
+    Major_data = runner.run_incremental(analysis_Major, json_files, savepath)
+
+    print("--- %s seconds ---" % (time.time() - start_time))
+    Major_data = Major_data.sort_values(by = ['NMDA_weight'])
+    ut.savetable(Major_data, savepath)
+    save_summary(Major_data, savepath)
+
+
+    # ##### Plotting (mean and 95% CI per NMDA weight, see summarystats.py)
+    File1 = 'Fig3/DMS/Analysis/total_summary.parquet'
+    File2 = 'Fig3/Major/Analysis/total_summary.parquet'
+
+    df1 = ut.loadtable(File1)
+    df2 = ut.loadtable(File2)
+
+    savepath = 'Fig3/'
+    plt.close()
+    plt.clf()
+    plt.figure(figsize = (9,6), dpi = 100)
+    plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
+    ax = plt.gca()
+    plt.style.use("ggplot")
+    plt.rcParams['axes.edgecolor'] = "black"
+    plt.rcParams['axes.facecolor'] = "white"
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.grid(False)
+    # ax.spines['bottom'].set_visible(False)
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('bottom')
+    plt.plot(df1['NMDA_weight'], df1['platamp'],linestyle = '--', marker = 'o',
+    markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
+    plt.fill_between(df1['NMDA_weight'], df1['platamp_ci_low'], df1['platamp_ci_high'],
+    color = tableau(20), alpha = 0.2, linewidth = 0)
+    plt.plot(df2['NMDA_weight'], df2['platamp'],linestyle = '-', marker = '^',
+    markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
+    plt.fill_between(df2['NMDA_weight'], df2['platamp_ci_low'], df2['platamp_ci_high'],
+    color = tableau(14), alpha = 0.2, linewidth = 0)
+    plt.xlabel("NMDA weight", size = 22, color = 'black')
+    plt.ylabel("Plateau Amp (mV)", size = 22, color = 'black')
+    ax.tick_params(labelsize=22, pad = 12, colors = "black")
+    ax.set_facecolor('white')
+    plt.xlim([0,1])
+    plt.ylim([0,25])
+    ax.set_facecolor('white')
+    plt.legend(loc = 'best', fontsize = 22)
+    title = "Platamp_Model_B&W"
+    # save(title, savepath, ext="pdf", close=False, verbose=True)
+    ut.save(title, savepath, ext="png", close=True, verbose=True)
+    ###################################################
+    plt.close()
+    plt.clf()
+    plt.figure(figsize = (9,6), dpi = 100)
+    plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
+    ax = plt.gca()
+    plt.style.use("ggplot")
+    plt.rcParams['axes.edgecolor'] = "black"
+    plt.rcParams['axes.facecolor'] = "white"
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.grid(False)
+    # ax.spines['bottom'].set_visible(False)
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('bottom')
+    plt.plot(df1['NMDA_weight'], df1['platdur'],linestyle = '--', marker = 'o',
+    markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
+    plt.fill_between(df1['NMDA_weight'], df1['platdur_ci_low'], df1['platdur_ci_high'],
+    color = tableau(20), alpha = 0.2, linewidth = 0)
+    plt.plot(df2['NMDA_weight'], df2['platdur'],linestyle = '-', marker = '^',
+    markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
+    plt.fill_between(df2['NMDA_weight'], df2['platdur_ci_low'], df2['platdur_ci_high'],
+    color = tableau(14), alpha = 0.2, linewidth = 0)
+    plt.xlabel("NMDA weight", size = 22, color = 'black')
+    plt.ylabel("Plateau Duration (ms)", size = 22, color = 'black')
+    ax.tick_params(labelsize=22, pad = 12, colors = "black")
+    ax.set_facecolor('white')
+    plt.xlim([0,1])
+    plt.ylim([-10,330])
+    ax.set_facecolor('white')
+    plt.legend(loc = 'best', fontsize = 22)
+    title = "Platdur_Model_B&W"
+    # save(title, savepath, ext="pdf", close=False, verbose=True)
+    ut.save(title, savepath, ext="png", close=True, verbose=True)
+
+    ###################################################
+    plt.close()
+    plt.clf()
+    plt.figure(figsize = (9,6), dpi = 100)
+    plt.subplots_adjust(left=0.15, right=0.9, top=0.85, bottom=0.15)
+    ax = plt.gca()
+    plt.style.use("ggplot")
+    plt.rcParams['axes.edgecolor'] = "black"
+    plt.rcParams['axes.facecolor'] = "white"
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.grid(False)
+    # ax.spines['bottom'].set_visible(False)
+    ax.yaxis.set_ticks_position('left')
+    ax.xaxis.set_ticks_position('bottom')
+    plt.plot(df1['NMDA_weight'], df1['spike_num'],linestyle = '--', marker = 'o',
+    markersize = 15, c = tableau(20), linewidth = 2, label = 'Model 1')
+    plt.fill_between(df1['NMDA_weight'], df1['spike_num_ci_low'], df1['spike_num_ci_high'],
+    color = tableau(20), alpha = 0.2, linewidth = 0)
+    plt.plot(df2['NMDA_weight'], df2['spike_num'],linestyle = '-', marker = '^',
+    markersize = 15, c = tableau(14), linewidth = 2, label = 'Model 2')
+    plt.fill_between(df2['NMDA_weight'], df2['spike_num_ci_low'], df2['spike_num_ci_high'],
+    color = tableau(14), alpha = 0.2, linewidth = 0)
+    plt.xlabel("NMDA weight", size = 22, color = 'black')
+    plt.ylabel("Spike Numbers", size = 22, color = 'black')
+    ax.tick_params(labelsize=22, pad = 12, colors = "black")
+    ax.set_facecolor('white')
+    plt.xlim([0,1])
+    plt.ylim([-0.5,11.5])
+    plt.legend(loc = 'best', fontsize = 22)
+    ax.set_facecolor('white')
+    title = "SpikeNum_Model_B&W"
+    # save(title, savepath, ext="pdf", close=False, verbose=True)
+    ut.save(title, savepath, ext="png", close=True, verbose=True)
@@ -8,17 +8,21 @@ Author: Peng Penny Gao
 
 """
 import CA229 as de # from CA229 import *
-import matplotlib.pyplot as plt
 from neuron import h
 import numpy as np
 import utils as ut #from utils import *
+import runindex as ri
+import sweepstore as ss
+import pipeline
 import json
 import itertools
 import time
-import pdb     # For python debugging
+import sys
+import jobqueue
+import ledger as lg
+import threshold
+# import pdb     # For python debugging
 #from random import *
-import math
-import pandas as pd
 
 h.load_file('stdrun.hoc') # for initialization
 
@@ -27,10 +31,38 @@ def random_2(low, high, size):
     np.random.shuffle(time_random)
     return time_random
 
+######################################################
+# Save one run (to the sweep store if given), add it to the run index
+# and mark its grid point as completed in the ledger (if given)
+def save_run(data, title, directory, TTX, runtime, store = None, ledger = None,
+point = None):
+    if store is None:
+        savepath = ut.saverun(data, title, directory, verbose = False)
+        ri.register(data, savepath, script = 'Fig5_exp_DMS',
+            condition = 'TTX' if TTX else 'N', runtime = runtime)
+        location, row = savepath, None
+    else:
+        run_id = store.append(data)
+        ri.register(data, store.path, script = 'Fig5_exp_DMS',
+            condition = 'TTX' if TTX else 'N', runtime = runtime, row = run_id)
+        location, row = store.path, run_id
+    if ledger is not None:
+        ledger.mark('Fig5_exp_DMS', point, location, row)
+
+# The parameters of one grid point (the arguments of Glu_Stim), its key in
+# the ledger; the run titles carry a timestamp and cannot be used
+def sweep_point(Bnum = 34, TTX = False, Pool1_num = 9, Pool2_num = 9,
+Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc = 0.5,
+**kwargs):
+    return dict(Bnum = Bnum, TTX = bool(TTX), Pool1_num = Pool1_num,
+        Pool2_num = Pool2_num, Beta = Beta, Cdur = Cdur, Syn_w1 = Syn_w1,
+        Syn_w2 = Syn_w2, Loc = list(Loc), DenLoc = DenLoc)
+
 ################### Test the ratio of different repceptors
 
 def Glu_Stim(Bnum = 34, TTX = False, Pool1_num = 9, Pool2_num = 9,
-Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc = 0.5):
+Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc = 0.5,
+store = None, saver = None, save = True, Cell = None, ledger = None):
 
     """
     Model the Glumate Stimulation.
@@ -52,12 +84,25 @@ Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc =
     Syn_w2: the syanptic weight of AMPA/NMDA receptors in pool2
     Loc: the stimulation location
     DenLoc: the targeted recording location on dendrite
+    store: sweepstore.SweepStore to append the run to (default: None, save
+           one file per run in the result tree)
+    saver: utils.AsyncSaver to save the run in the background
+           (default: None, save before returning)
+    save: False to keep the traces only in the returned data
+          (see pipeline.py)
+    Cell: a CA229 cell to reuse (default: None, build a new one). TTX
+          changes its sodium channels; see simworker.py for restoring them.
+    ledger: ledger.Ledger to mark the grid point as completed once the run
+            is saved (default: None)
     -----------
     Outputs:
         Figures: recording from soma and 3 different locations from basal dendrites
         json: soma and dendritc voltage recording and parameters info
+        (or one run appended to the sweep store)
+        data: the parameters and recordings of the run
     """
-    Cell = de.CA229()
+    if Cell is None:
+        Cell = de.CA229()
     timestr = time.strftime("%Y%m%d-%H%M")
     data = time.strftime("%m_%d")
     directory_root = "Fig5/DMS/"
@@ -158,9 +203,11 @@ Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc =
     ###########################################
     h.celsius = 32
     h.v_init =  -73.6927850677
+    run_start = time.time()
     h.init()
     h.tstop = 1000
     h.run()
+    runtime = time.time() - run_start
 
 #    pdb.set_trace()   #Debugging
     # plt.figure(figsize = (16, 6), dpi = 100)
@@ -194,14 +241,27 @@ Beta = 0.067, Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6], DenLoc =
     data['ExNMDA']['Beta'] = Beta
     data['ExNMDA']['Cdur'] = Cdur
 
-    data['recording']['time'] = list(t_vec)
-    data['recording']['soma']['voltage'] = list(v_vec_soma)
-    data['recording']['basal']['voltage_0.8'] = list(v_vec_dend1)
-    data['recording']['basal']['voltage_0.5'] = list(v_vec_dend2)
-    data['recording']['basal']['voltage_0.3'] = list(v_vec_dend3)
-    data['recording']['basal']['voltage_input'] = list(v_vec_dend)
+    data['recording']['time'] = ut.pack_time(t_vec)
+    data['recording']['soma']['voltage'] = ut.vec2np(v_vec_soma)
+    data['recording']['basal']['voltage_0.8'] = ut.vec2np(v_vec_dend1)
+    data['recording']['basal']['voltage_0.5'] = ut.vec2np(v_vec_dend2)
+    data['recording']['basal']['voltage_0.3'] = ut.vec2np(v_vec_dend3)
+    data['recording']['basal']['voltage_input'] = ut.vec2np(v_vec_dend)
 
-    ut.savejson(data, title, directory, ext = "json", verbose = False)
+    if store is not None or not save:
+        # The directory levels of the result tree become parameters
+        # (of the sweep store, or of the summary table, see pipeline.py)
+        data['Bnum'] = "B" + str(Bnum)
+        data['Loc'] = "Loc" + L1 + "_" + L2
+        data['title'] = title
+    point = sweep_point(Bnum, TTX, Pool1_num, Pool2_num, Beta, Cdur,
+        Syn_w1, Syn_w2, Loc, DenLoc)
+    if save and saver is None:
+        save_run(data, title, directory, TTX, runtime, store, ledger, point)
+    elif save:
+        # Saved in the writer process while the next run is simulated
+        saver.put(save_run, data, title, directory, TTX, runtime, store, ledger, point)
+    return data
 
 ######################################################
 if __name__ == "__main__":
@@ -213,19 +273,63 @@ if __name__ == "__main__":
     # weight = [0.1, 0.3, 0.5, 0.7]  # For the demo traces
 
     basal_num = [15, 34, 14, 22, 25, 31]
+    # All the runs are appended to one file, see sweepstore.py
+    store = ss.SweepStore("Fig5/DMS/sweep.h5")
     with open('data.json', 'r') as fp:
         data = json.load(fp)
     with open('dend_measure_data.json', 'r') as fp1:
         Ndata = json.load(fp1)
 
-    for b in basal_num:
-        loc = data[str(b)]
-        DenLoc = Ndata[str(b)]
-        for l1, l2 in zip(loc, DenLoc):
-            for w in weight:
-                Glu_Stim(b, False, Pool_num, Pool_num, 0.02, 10, w, w, l1, l2)
-                Glu_Stim(b, True, Pool_num, Pool_num, 0.02, 10, w, w, l1, l2)
+    # Each run is measured as soon as it is simulated and its row appended
+    # to the summary table (see pipeline.py). The traces go to the sweep
+    # store; set keep_traces = False to keep only the summary table.
+    keep_traces = True
+    def jobs():
+        for b in basal_num:
+            loc = data[str(b)]
+            DenLoc = Ndata[str(b)]
+            for l1, l2 in zip(loc, DenLoc):
+                for w in weight:
+                    for TTX in [False, True]:
+                        yield (b, TTX, Pool_num, Pool_num, 0.02, 10, w, w, l1, l2)
+
+    # The grid points saved by an earlier (interrupted) run of the sweep are
+    # skipped; with --verify their saved runs are checked first and the
+    # missing or broken ones run again (see ledger.py).
+    ledger = lg.Ledger("Fig5/DMS/ledger.db")
+    todo = ledger.remaining('Fig5_exp_DMS', jobs(), sweep_point,
+                            verify = "--verify" in sys.argv)
 
+    if "--threshold" in sys.argv:
+        # Search the plateau threshold in weight for every branch and input
+        # location instead of running the grid (see threshold.py); the
+        # searches of the branches run in parallel (criterion 'plateau',
+        # without TTX)
+        grid = [(b, False, Pool_num, Pool_num, 0.02, 10, 0.0, 0.0, l1, l2)
+                for b in basal_num for l1, l2 in zip(data[str(b)], Ndata[str(b)])]
+        table = threshold.search('Fig5_exp_DMS', grid, input = 'weight', low = 0.0,
+                                 high = 1.5, tol = 0.01, point = sweep_point)
+        print(table[['Bnum', 'Loc', 'threshold', 'n_runs']])
+        ut.savetable(table, "Fig5/DMS/thresholds.parquet")
+    elif "--submit" in sys.argv:
+        # Only queue the runs, for workers on any node (see jobqueue.py); the
+        # workers append them to the sweep store.
+        queue = jobqueue.submit_grid(sys.argv[sys.argv.index("--submit") + 1],
+                                     'Fig5_exp_DMS', 'Glu_Stim', todo,
+                                     kwargs = {'save': True}, store = store.path,
+                                     ledger = ledger.path)
+        print(queue.counts())
+    else:
+        with ut.AsyncSaver() as saver:
+            # Rows as in the tables of Fig5_ana_*.py, keyed by the grid point
+            # (a point run again replaces its row)
+            key = lambda *args: lg.point_key('Fig5_exp_DMS', sweep_point(*args))
+            runs = pipeline.simulate(Glu_Stim, todo, key = key, store = store,
+                                     saver = saver, save = keep_traces, ledger = ledger)
+            rows = pipeline.featurize(runs, dend = 'basal/voltage_input',
+                                      columns = pipeline.FIG5_COLUMNS,
+                                      rule = pipeline.fig5_platdur)
+            pipeline.summarize(rows, "Fig5/DMS/results.parquet", key = 'point')
 
     print("Finished.")
     print("--- %s seconds ---" % (time.time() - start_time))
@@ -7,10 +7,10 @@ For Fig 5. D2 - Model 1
 Intrusction:
 1. Run Fig5_exp_major.py to generate recording after stimulation.
 2. Run Fig5_ana_major.py to analyze the somatic recording simulated from 2.
-    - A normal results csv and a TTX results csv files will be saved in the subdirectory
-    of each basal branch.
+    - A normal results table and a TTX results table (.parquet) will be saved in the subdirectory
+    of each basal branch, with their summaries (mean and bootstrap CI per location and weight).
 3. Run this file to plot the ampliude or duration vs. distance
-    - It needs to read the TTX csv file from each basal branch.
+    - It needs to read the TTX summary table from each basal branch.
     - It also needs to read the dist info from dist.json file.
     - Combine the data together and plot.
 
@@ -38,27 +38,27 @@ path = 'Fig5/DMS/'
 basal_num = [15, 34, 14, 22, 25, 31]
 
 #### I perfer to combine all the data mannally without loop
-df1 = pd.read_csv(path + 'B' + str(15) + "/TTX_total_results.csv")
+df1 = ut.loadtable(path + 'B' + str(15) + "/TTX_total_summary.parquet")
 df1_T = df1[df1['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df1_T['dist'] = df_dist['15']
 
-df2 = pd.read_csv(path + 'B' + str(34) + "/TTX_total_results.csv")
+df2 = ut.loadtable(path + 'B' + str(34) + "/TTX_total_summary.parquet")
 df2_T = df2[df2['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df2_T['dist'] = df_dist['34']
 
-df3 = pd.read_csv(path + 'B' + str(14) + "/TTX_total_results.csv")
+df3 = ut.loadtable(path + 'B' + str(14) + "/TTX_total_summary.parquet")
 df3_T = df3[df3['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df3_T['dist'] = df_dist['14']
 
-df4 = pd.read_csv(path + 'B' + str(22) + "/TTX_total_results.csv")
+df4 = ut.loadtable(path + 'B' + str(22) + "/TTX_total_summary.parquet")
 df4_T = df4[df4['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df4_T['dist'] = df_dist['22']
 
-df5 = pd.read_csv(path + 'B' + str(25) + "/TTX_total_results.csv")
+df5 = ut.loadtable(path + 'B' + str(25) + "/TTX_total_summary.parquet")
 df5_T = df5[df5['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df5_T['dist'] = df_dist['25']
 
-df6 = pd.read_csv(path + 'B' + str(31) + "/TTX_total_results.csv")
+df6 = ut.loadtable(path + 'B' + str(31) + "/TTX_total_summary.parquet")
 df6_T = df6[df6['NMDA_weight'] == 0.9][['Bnum', 'Loc', 'NMDA_weight', 'soma_platamp', 'dend_platamp', 'dend_platdur']].sort_values(by = ['Loc'])
 df6_T['dist'] = df_dist['31']
 
@@ -10,9 +10,10 @@ Run simulation with NMDA.mod file - DMS model
 """
 import CA229 as de # from CA229 import *
 import matplotlib.pyplot as plt
-from neuron import h
+from neuron import h, gui
 import numpy as np
 import utils as ut #from utils import *
+import runindex as ri
 import json
 import itertools
 import time
@@ -181,9 +182,11 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     ###########################################
     h.celsius = 32
     h.v_init =  -73.6927850677
+    run_start = time.time()
     h.init()
     h.tstop = 1000
     h.run()
+    runtime = time.time() - run_start
 
 #    pdb.set_trace()   #Debugging
     # print v_vec_soma[-1]
@@ -235,16 +238,18 @@ Cdur = 1, Syn_w1 = 0.01, Syn_w2 = 0.01, Loc = [0.2, 0.6]):
     data['ExNMDA']['Beta'] = Beta
     data['ExNMDA']['Cdur'] = Cdur
 
-    data['recording']['time'] = list(t_vec)
-    data['recording']['soma']['voltage'] = list(v_vec_soma)
-    data['recording']['basal_34']['voltage_0.8'] = list(v_vec_dend1)
-    data['recording']['basal_34']['voltage_0.5'] = list(v_vec_dend2)
-    data['recording']['basal_34']['voltage_0.3'] = list(v_vec_dend3)
-    data['recording']['soma']['ica'] = list(cai_soma)
-    data['recording']['basal_34']['ica_0.3'] = list(cai_dend)
+    data['recording']['time'] = ut.pack_time(t_vec)
+    data['recording']['soma']['voltage'] = ut.vec2np(v_vec_soma)
+    data['recording']['basal_34']['voltage_0.8'] = ut.vec2np(v_vec_dend1)
+    data['recording']['basal_34']['voltage_0.5'] = ut.vec2np(v_vec_dend2)
+    data['recording']['basal_34']['voltage_0.3'] = ut.vec2np(v_vec_dend3)
+    data['recording']['soma']['ica'] = ut.vec2np(cai_soma)
+    data['recording']['basal_34']['ica_0.3'] = ut.vec2np(cai_dend)
 
 
-    ut.savejson(data, title, directory, ext = "json", verbose = False)
+    savepath = ut.saverun(data, title, directory, verbose = False)
+    ri.register(data, savepath, script = 'GUI_Fig3_exp_dms',
+        condition = 'TTX' if TTX else 'N', runtime = runtime)
 
 ######################################################
 if __name__ == "__main__":
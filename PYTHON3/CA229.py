@@ -36,10 +36,12 @@ https://senselab.med.yale.edu/ModelDB/ShowModel.cshtml?model=168148&file=/stadle
 
 """
 import sys
-from neuron import h, gui
-from matplotlib import pyplot
+from neuron import h
 from math import sqrt, pi, log, exp
 
+# The run control of the NEURON GUI, without the GUI (from neuron import gui)
+h.load_file('stdrun.hoc')
+
 #########################################
 # Parameters
 #########################################
@@ -500,6 +502,39 @@ class CA229:
         for sec in self.basals:
             sec.gbar_na = 0
 
+#########################################
+# Block the A-type potassium channels (4-AP)
+#########################################
+    def no_KA(self):
+        """Same A-type channel densities as CA229(KA_ratio = 0.0)"""
+        for sec in self.basals:
+            sec.gkabar_kap = 0
+            sec.gkabar_kad = 0
+        for sec in self.apical:
+            sec.gkabar_kap = 0
+            sec.gkabar_kad = 0
+
+#########################################
+# Save and restore channel densities, to reuse one cell for many runs
+# (eg. TTX, then control again)
+#########################################
+    def snapshot(self, names = ['gbar_na']):
+        """Values of the range variables in names (eg. 'gbar_na') in every
+        segment of the sections that have the mechanism, see restore."""
+        values = []
+        for name in names:
+            mech = name.rsplit('_', 1)[1]
+            for sec in self.all:
+                if sec.has_membrane(mech):
+                    values.append((sec, name, [getattr(seg, name) for seg in sec]))
+        return values
+
+    def restore(self, values):
+        """Set the range variables back to the values of a snapshot."""
+        for sec, name, vals in values:
+            for seg, val in zip(sec, vals):
+                setattr(seg, name, val)
+
 #########################################
 # No calcium
 #########################################
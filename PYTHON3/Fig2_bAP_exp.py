@@ -8,10 +8,10 @@ Modified by : Peng Penny Gao <penggao.1987@gmail.com>
 2. Run on all basal branches
 """
 import CA229 as de # detailed cell model
-import matplotlib.pyplot as plt
 from neuron import h
 import numpy as np
 import utils as ut
+import runindex as ri
 import json
 import itertools
 import time
@@ -19,19 +19,36 @@ import time
 
 h.load_file('stdrun.hoc') # for initialization
 
+######################################################
+# Save one run and add it to the run index
+def save_run(data, title, directory, runtime):
+    savepath = ut.saverun(data, title, directory, verbose = False)
+    ri.register(data, savepath, script = 'Fig2_bAP_exp',
+        condition = title.split('_')[0], runtime = runtime)
+
 ################### Test the ratio of different repceptors
-def bAP(Bnum = 34, TTX = False, Atype = False, vec = []):
+def bAP(Bnum = 34, TTX = False, Atype = False, vec = [], saver = None, save = True,
+Cell = None):
     """
     Bnum: the recording branch
+    vec: somatic voltage of the control run (h.Vector or array), played
+         into the voltage clamp for TTX
+    saver: utils.AsyncSaver to save the run in the background
+           (default: None, save before returning)
+    save: False to keep the traces only in the returned data
+    Cell: a CA229 cell to reuse (default: None, build a new one). TTX and
+          4AP change its channels; see simworker.py for restoring them.
     -----------
     Outputs:
         json: soma and dendritc voltage recording and parameters info
+        data: the parameters and recordings of the run
     """
     timestr = time.strftime("%H%M")
     data = time.strftime("%m_%d")
     directory = 'Fig2/'
     # directory = 'Data_' + data +'/'
-    Cell = de.CA229()
+    if Cell is None:
+        Cell = de.CA229(KA_ratio = 0.0) if Atype else de.CA229()
     ###########################################
     if (TTX == False and Atype == False):
         title = "Control_" + "Bnum_" + str(Bnum) + "_" + timestr
@@ -47,10 +64,13 @@ def bAP(Bnum = 34, TTX = False, Atype = False, vec = []):
         Vstim = h.SEClamp(Cell.soma[2](0.5))
         Vstim.rs= 0.01
         Vstim.dur1 = 1e9
+        if not isinstance(vec, type(h.Vector())):
+            vec = h.Vector(np.asarray(vec))
         vec.play(Vstim._ref_amp1, h.dt)
         title = "TTX_" + "Bnum_" + str(Bnum) + "_" + timestr
     else:
-        Cell = de.CA229(KA_ratio = 0.0)
+        if Cell.KA_ratio != 0.0:
+            Cell.no_KA()
         ic = h.IClamp(Cell.soma[2](0.5))
         ic.dur = 1.75
         ic.delay = 150
@@ -81,9 +101,11 @@ def bAP(Bnum = 34, TTX = False, Atype = False, vec = []):
     ###########################################
     h.celsius = 32 # 32
     h.v_init =  -73.6927850677
+    run_start = time.time()
     h.init()
     h.tstop = 300
     h.run()
+    runtime = time.time() - run_start
 
 #    pdb.set_trace()   #Debugging
     # print v_vec_soma[-1]
@@ -106,24 +128,28 @@ def bAP(Bnum = 34, TTX = False, Atype = False, vec = []):
     data['Bnum'] = Bnum
     data['Loc'] = Loc
     data['dist'] = dist
-    data['recording']['time'] = list(t_vec)
-    data['recording']['soma']['voltage'] = list(v_vec_soma)
-    for index, dist in enumerate(dist):
-        data['recording']['dend']["{0:.2f}".format(dist)] = list(v_vec_dend[index])
-    ut.savejson(data, title, directory, ext = "json", verbose = False)
-
-    if (TTX == False and Atype == False):
-        return v_vec_soma
+    data['recording']['time'] = ut.pack_time(t_vec)
+    data['recording']['soma']['voltage'] = ut.vec2np(v_vec_soma)
+    # One row per recording site, in the order of data['Loc'] and data['dist']
+    data['recording']['dend']['voltage'] = np.array([ut.vec2np(vec) for vec in v_vec_dend])
+    if save and saver is None:
+        save_run(data, title, directory, runtime)
+    elif save:
+        # Saved in the writer process while the next run is simulated
+        saver.put(save_run, data, title, directory, runtime)
+    return data
 
 ######################################################
 if __name__ == "__main__":
     print("Running the model")
     start_time = time.time()
-    for i in range(0,36):
-        if i != 16:
-            V = bAP(Bnum = i, TTX = False, Atype = False)
-            bAP(Bnum = i, TTX = True, Atype = False, vec = V)
-            bAP(Bnum = i, TTX = False, Atype = True)
+    with ut.AsyncSaver() as saver:
+        for i in range(0,36):
+            if i != 16:
+                data = bAP(Bnum = i, TTX = False, Atype = False, saver = saver)
+                V = data['recording']['soma']['voltage']
+                bAP(Bnum = i, TTX = True, Atype = False, vec = V, saver = saver)
+                bAP(Bnum = i, TTX = False, Atype = True, saver = saver)
 
     print("Finished.")
     print("--- %s seconds ---" % (time.time() - start_time))
@@ -13,31 +13,35 @@ import os
 import numpy as np
 import pandas as pd
 #from analysis_utils import *
+import analysis_utils as ana
 from analysis_utils import tableau
 import utils as ut #from utils import *
+import runindex as ri
 import seaborn as sns
 
 
 ###### Load DATA
 ## Add the correct analysis path here:
 path_to_json = 'Fig3/Major/Plot/'
-json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
+# Runs registered in the run index (see runindex.py) under this directory
+json_files = ri.saved_runs(path_to_json)
 nfile = len(json_files)
 
 df = pd.DataFrame(columns = ['soma_trace','dend1_trace','dend2_trace','dend3_trace','labels'])
 
 for index, js in enumerate(json_files):
-    with open(os.path.join(path_to_json, js)) as json_file:
-        data = json.load(json_file)
-        filename = json_files[index]
-        time = data['recording']['time'][4000:]
-        new_time = [x-100.0 for x in time]
-        soma_trace = data['recording']['soma']['voltage'][4000:]
-        dend1_trace = data['recording']['basal_34']['voltage_0.8'][4000:]
-        dend2_trace = data['recording']['basal_34']['voltage_0.5'][4000:]
-        dend3_trace = data['recording']['basal_34']['voltage_0.3'][4000:]
-        labels = data['ExNMDA']['weight']
-        df.loc[index] = [soma_trace, dend1_trace, dend2_trace, dend3_trace, labels]
+    data = ut.loadrun(js)
+    filename = json_files[index]
+    # Plot from 100 ms on
+    first = ana.time_index(100, ut.get_dt(data))
+    time = ut.get_time(data)[first:]
+    new_time = [x-100.0 for x in time]
+    soma_trace = data['recording']['soma']['voltage'][first:]
+    dend1_trace = data['recording']['basal_34']['voltage_0.8'][first:]
+    dend2_trace = data['recording']['basal_34']['voltage_0.5'][first:]
+    dend3_trace = data['recording']['basal_34']['voltage_0.3'][first:]
+    labels = data['ExNMDA']['weight']
+    df.loc[index] = [soma_trace, dend1_trace, dend2_trace, dend3_trace, labels]
 
 df = df.sort_values(by = ['labels'])
 
@@ -6,99 +6,151 @@ Author: Peng Penny Gao
 penggao.1987@gmail.com
 """
 
-import json
-import matplotlib.pyplot as plt
+import functools
 import os
 import numpy as np
 import pandas as pd
-import analysis_utils as ana # from analysis_utils import *
-# import utils as ut # from utils import *
-import seaborn as sns
+import utils as ut # from utils import *
+import sweepstore as ss
+import analysis_runner as runner
+import featurecache as fc
+import summarystats as st
+import pipeline
 import time
 
+######################################################
+# Columns of the parameter table in the sweep store (see sweepstore.py)
+PARAMS = ['TTX', 'Bnum', 'Loc', 'SynAMPA/num', 'SynAMPA/locs', 'SynAMPA/weight',
+'SynNMDA/num', 'SynNMDA/locs', 'SynNMDA/weight']
+
+def sweep_store(path):
+    """The sweep store of the runs under path (see sweepstore.py)."""
+    store = ss.SweepStore(path + 'sweep.h5')
+    if not os.path.exists(store.path):
+        raise IOError("No sweep store %s. Runs saved one file per run by older versions "
+                      "(%sB*/Loc*/N|TTX/) are read from the store: pack them first with "
+                      "python sweepstore.py %s" % (store.path, path, path))
+    return store
+
+def branch_rows(store, Bnum, TTX):
+    """Run ids (rows of the store) of the runs on one branch and condition."""
+    table = store.params(['Bnum', 'TTX'])
+    return [int(r) for r in np.flatnonzero((table['Bnum'] == Bnum) & (table['TTX'] == TTX))]
+
+def load_runs(store, rows):
+    """Parameters and traces of the runs in rows.
+
+    Return:
+    -----------
+    params: dict of the PARAMS columns for the selected runs
+    soma, dend: (n_runs x n_samples) somatic and input-site voltage traces
+    """
+    table = store.params(PARAMS)
+    params = {}
+    for name, values in table.items():
+        params[name] = [values[r] for r in rows]
+    # One contiguous read per trace instead of one file per run
+    soma = store.traces('soma/voltage', rows)
+    dend = store.traces('basal/voltage_input', rows)
+    return params, soma, dend
+
+######################################################
+COLUMNS = ['TTX', 'Bnum', 'Loc', 'AMPA_num', 'AMPA_locs', 'AMPA_weight',
+'NMDA_num', 'NMDA_locs', 'NMDA_weight',
+'spike_num','soma_platamp', 'soma_platdur', 'dend_platamp', 'dend_platdur', 'run']
+
+def results_table(params, Bnum, features, rows):
+    """One row per run: the parameters and the features from analysis_utils."""
+    new_data = pd.DataFrame({'TTX': params['TTX'], 'Bnum': Bnum,
+        'Loc': params['Loc'],
+        'AMPA_num': params['SynAMPA/num'], 'AMPA_locs': params['SynAMPA/locs'],
+        'AMPA_weight': params['SynAMPA/weight'],
+        'NMDA_num': params['SynNMDA/num'], 'NMDA_locs': params['SynNMDA/locs'],
+        'NMDA_weight': params['SynNMDA/weight'],
+        'spike_num': features['spike_num'],
+        'soma_platamp': features['soma_platamp'],
+        'soma_platdur': features['soma_platdur'],
+        'dend_platamp': features['dend_platamp'],
+        'dend_platdur': features['dend_platdur'],
+        'run': rows}, columns = COLUMNS)
+    return new_data
+
+######################################################
+def analysis_rows(path, Bnum, TTX, rows):
+    """Features of the runs in rows (run ids of one branch and condition)."""
+    store = ss.SweepStore(path + 'sweep.h5')
+    params, soma, dend = load_runs(store, rows)
+    # All the runs at once, one run per row; runs measured before are
+    # read from the feature cache
+    cache = fc.FeatureCache()
+    features = cache.batch_features(soma, dend, TTX = TTX, dt = store.dt())
+    cache.close()
+    # Same rule as the summary table of the sweeps (see pipeline.py)
+    features = pipeline.fig5_platdur(features, TTX)
+    return results_table(params, Bnum, features, rows)
+
+# Mean and bootstrap CI of the features per location and weight, for the plots
+SUMMARY_GROUPS = ['TTX', 'Bnum', 'Loc', 'NMDA_weight']
+SUMMARY_COLUMNS = ['spike_num', 'soma_platamp', 'soma_platdur', 'dend_platamp', 'dend_platdur']
+
+def analysis_incremental(Bnum, TTX, path, savepath):
+    """Update the results table of one branch and condition.
+
+    Only the runs appended to the store since the table was saved are
+    analysed (see analysis_runner.run_incremental); the run id is the
+    'run' column of the table. The summary for the plots is saved next to
+    it (see summarystats.py).
+    """
+    store = sweep_store(path)
+    rows = branch_rows(store, Bnum, TTX)
+    # The rows of a store never change, but a new store has new rows
+    store_id = store.store_id()
+    new_data = runner.run_incremental(functools.partial(analysis_rows, path, Bnum, TTX),
+        rows, savepath, stamp = lambda row: store_id, processes = 1)
+    summary = st.summarize(new_data, SUMMARY_GROUPS, SUMMARY_COLUMNS)
+    ut.savetable(summary, st.summary_path(savepath))
+    return new_data
+
 ######################################################
 def analysis_N(Bnum = 'B34', path = "Fig5/Major/"):
-    level2 = level[Bnum]
-    new_data = pd.DataFrame(columns = ['TTX', 'Bnum', 'Loc', 'AMPA_num', 'AMPA_locs', 'AMPA_weight',
-    'NMDA_num', 'NMDA_locs', 'NMDA_weight',
-    'spike_num','soma_platamp', 'soma_platdur', 'dend_platamp', 'dend_platdur'])
-    i = 0 # initialization
-    for l2 in level2:
-        path_to_json = path + str(Bnum) + "/"+ str(l2) + "/N"
-        json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
-        num = len(json_files)
-        for index, js in enumerate(json_files):
-            with open(os.path.join(path_to_json, js)) as json_file:
-                data = json.load(json_file)
-                filename = json_files[index]
-                TTX = data['TTX']
-                Loc = str(l2)
-                AMPA_num = data['SynAMPA']['num']
-                AMPA_locs = data['SynAMPA']['locs']
-                AMPA_weight = data['SynAMPA']['weight']
-                NMDA_num = data['SynNMDA']['num']
-                NMDA_locs = data['SynNMDA']['locs']
-                NMDA_weight = data['SynNMDA']['weight']
-                spike_num = ana.spike_count(data['recording']['soma']['voltage'])
-                idx, soma_platamp = ana.soma_plat(data['recording']['soma']['voltage'])
-                dend_platamp, dend_platdur = ana.dend_plat(data['recording']['basal']['voltage_input'], idx)
-                soma_platdur = dend_platdur
-
-                new_data.loc[index + i*num] = [TTX, Bnum, Loc, AMPA_num, AMPA_locs, AMPA_weight,
-                    NMDA_num, NMDA_locs, NMDA_weight, spike_num, soma_platamp, soma_platdur, dend_platamp, dend_platdur]
-        i = i + 1
-    savepath = path + str(Bnum) +'/total_results.csv'
-    new_data.to_csv(savepath)
+    savepath = path + str(Bnum) +'/total_results.parquet'
+    return analysis_incremental(Bnum, False, path, savepath)
 
 
 ######################################################
 def analysis_TTX(Bnum = 'B34', path = "Fig5/Major/"):
-    level2 = level[Bnum]
-    new_data = pd.DataFrame(columns = ['TTX', 'Bnum', 'Loc', 'AMPA_num', 'AMPA_locs', 'AMPA_weight',
-    'NMDA_num', 'NMDA_locs', 'NMDA_weight',
-    'spike_num', 'soma_platamp','soma_platdur', 'dend_platamp', 'dend_platdur'])
-    i = 0 # initialization
-    for l2 in level2:
-        path_to_json = path + str(Bnum) + "/"+ str(l2) + "/TTX"
-        json_files = [pos_json for pos_json in os.listdir(path_to_json) if pos_json.endswith('.json')]
-        num = len(json_files)
-        for index, js in enumerate(json_files):
-            with open(os.path.join(path_to_json, js)) as json_file:
-                data = json.load(json_file)
-                filename = json_files[index]
-                TTX = data['TTX']
-                Loc = str(l2)
-                AMPA_num = data['SynAMPA']['num']
-                AMPA_locs = data['SynAMPA']['locs']
-                AMPA_weight = data['SynAMPA']['weight']
-                NMDA_num = data['SynNMDA']['num']
-                NMDA_locs = data['SynNMDA']['locs']
-                NMDA_weight = data['SynNMDA']['weight']
-                spike_num = 0
-                idx, soma_platamp = ana.soma_platamp_TTX(data['recording']['soma']['voltage'])
-                soma_platdur = ana.soma_platdur_TTX(data['recording']['soma']['voltage'])
-                dend_platamp, dend_platdur =  ana.TTX_dend_plat(data['recording']['basal']['voltage_input'], idx)
-
-                new_data.loc[index + i*num] = [TTX, Bnum, Loc, AMPA_num, AMPA_locs, AMPA_weight, NMDA_num, NMDA_locs, NMDA_weight,  spike_num, soma_platamp, soma_platdur, dend_platamp, dend_platdur]
-        i = i + 1
-    savepath = path + str(Bnum) +'/TTX_total_results.csv'
-    new_data.to_csv(savepath)
+    savepath = path + str(Bnum) +'/TTX_total_results.parquet'
+    return analysis_incremental(Bnum, True, path, savepath)
+
+def analysis_branches(jobs):
+    """Run analysis_N / analysis_TTX for a shard of (Bnum, TTX, path) jobs."""
+    tables = []
+    for Bnum, TTX, path in jobs:
+        if TTX:
+            tables.append(analysis_TTX(Bnum, path))
+        else:
+            tables.append(analysis_N(Bnum, path))
+    if not tables:
+        return pd.DataFrame(columns = COLUMNS)
+    return pd.concat(tables, ignore_index = True)
 
 ######################################################
 if __name__ == "__main__":
     start_time = time.time()
     path = "Fig5/Major/"
-    level1 = [item for item in os.listdir(path) if not item.startswith('.')]
-
-    # The loc sites vary from different basal branch
-    # Use a dictionary to store each of seperately
-    level = {}
-    for l1 in level1:
-        level[l1] = [item for item in os.listdir(path + str(l1)) if not (item.endswith('.csv') or item.endswith('.DS_Store'))]
+    # Runs saved as a result tree by older versions have to be packed first:
+    # python sweepstore.py Fig5/Major/
+    store = sweep_store(path)
+    level1 = sorted(set(store.params(['Bnum'])['Bnum']))
 
+    jobs = []
     for l1 in level1:
-        analysis_N(l1, path)
-        analysis_TTX(l1, path)
+        if not os.path.exists(path + str(l1)):
+            os.makedirs(path + str(l1))
+        jobs += [(l1, False, path), (l1, True, path)]
+    # Branches and conditions are analysed in parallel (see analysis_runner.py)
+    results = runner.run(analysis_branches, jobs, shards_per_process = 1)
+    print("Analysed %d runs." % len(results))
 
     print("Finished.")
     print("--- %s seconds ---" % (time.time() - start_time))
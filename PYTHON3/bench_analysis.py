@@ -0,0 +1,177 @@
+"""
+Benchmark of the feature kernels in analysis_utils on saved traces.
+
+Runs the numpy kernels of analysis_utils and the original loop versions
+(kept below for reference) on the somatic and dendritic traces of the saved
+Fig 3 runs and Fig 5 sweeps, checks that they give the same results and
+prints the time of both, and of the batch version over all the runs.
+
+    python bench_analysis.py [Fig3/DMS/Plot/ Fig5/DMS/sweep.h5 ...]
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import sys
+import time
+import numpy as np
+import analysis_utils as ana
+import utils as ut
+import runindex as ri
+
+######################################################
+# The loop versions of the kernels (before vectorization)
+######################################################
+def loop_meas_platdur(data, thresh = 10, dt = 0.025):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    above = [val for val in stable if val > (baseline + thresh)]
+    return dt * len(above)
+
+def loop_spike_count(data, thresh = 0):
+    spike_flag = False
+    count = 0
+    for idx, val in enumerate(data[:-1]):
+        if spike_flag == False and val < thresh and data[idx+1] >= thresh:
+            spike_flag = True
+        elif spike_flag == True and val >= thresh and data[idx+1] < thresh:
+            count += 1
+            spike_flag = False
+    return count
+
+def loop_get_EPSPs(data, thresh = 2, dt = 0.025):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    EPSPs = []
+    for idx, val in enumerate(stable[:-1]):
+        if (val >= (baseline + thresh)) and (val > stable[idx-1]) and (val >= stable[idx+1]):
+            EPSPs.append(((idx + 6000) * dt, val))
+    return EPSPs
+
+def loop_IST_spikes(data, dt = 0.025):
+    spikes = loop_get_EPSPs(data, 60, dt)
+    IST = []
+    spike_mvalue = []
+    spike_midx = []
+    if len(spikes) <= 1:
+        return 0, spike_mvalue, spike_midx
+    for i in range(len(spikes)-1):
+        IST.append(spikes[i+1][0]-spikes[i][0])
+        idx1 = int(round((spikes[i][0])/dt))
+        idx2 = int(round((spikes[i+1][0])/dt))
+        spike_mvalue.append(np.min(data[idx1:idx2]))
+        spike_midx.append(np.argmin(data[idx1:idx2]) + idx1)
+    return np.mean(IST), spike_mvalue, spike_midx
+
+def loop_soma_plat(data, dt = 0.025):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    spike_num = loop_spike_count(stable)
+    if spike_num == 0:
+        platamp = max(stable) - baseline
+        idx = int(np.argmax(data))
+    elif spike_num == 1:
+        idx = int(np.argmax(data)) + int(5/dt)
+        platamp = data[idx] - baseline
+    else:
+        ISI, spike_mvalue, spike_midx = loop_IST_spikes(data, dt)
+        platamp = spike_mvalue[-1] - baseline
+        idx = spike_midx[-1]
+    return idx, platamp
+
+def loop_soma_platamp_TTX(data):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    above = [idx for idx, val in enumerate(stable) if val > (baseline+15)]
+    if len(above) <= 15:
+        platamp = np.max(stable) - baseline
+        idx = np.argmax(stable)
+    else:
+        idx = int(0.75*above[-1] + 0.25*above[0])
+        platamp = stable[idx] - baseline
+    return idx+6000, platamp
+
+def loop_soma_platdur_TTX(data, dt = 0.025):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    idx, amp = loop_soma_platamp_TTX(data)
+    above = [idx for idx, val in enumerate(stable) if val > (baseline+amp/2.0)]
+    return dt * len(above)
+
+def loop_dend_plat(data, idx, dt = 0.025):
+    baseline = np.mean(data[4000:6000])
+    stable = data[6000:]
+    platamp = data[idx] - baseline
+    above = [val for val in stable if val > (baseline + platamp*0.5)]
+    return platamp, dt * len(above)
+
+######################################################
+# Features of one run, as in Fig3_trace_analysis.py and Fig5_ana_*.py
+######################################################
+def features(module, prefix, soma, dend):
+    get = lambda name: getattr(module, prefix + name)
+    results = [get('spike_count')(soma), get('meas_platdur')(soma)]
+    idx, platamp = get('soma_plat')(soma)
+    results += [idx, platamp, get('dend_plat')(dend, idx)]
+    idx, platamp = get('soma_platamp_TTX')(soma)
+    results += [idx, platamp, get('soma_platdur_TTX')(soma),
+                get('dend_plat')(dend, idx), get('get_EPSPs')(soma)]
+    return results
+
+def load_traces(paths):
+    """(soma, dend) voltage arrays of the saved runs in paths."""
+    traces = []
+    for path in paths:
+        if path.endswith('.h5'):
+            import sweepstore as ss
+            store = ss.SweepStore(path)
+            soma = store.traces('soma/voltage')
+            dend = store.traces('basal/voltage_input')
+            traces += list(zip(soma, dend))
+            continue
+        for js in ri.saved_runs(path):
+            recording = ut.loadrun(js)['recording']
+            soma = np.asarray(recording['soma']['voltage'])
+            if 'basal' in recording:
+                dend = np.asarray(recording['basal']['voltage_input'])
+            else:
+                dend = soma
+            traces.append((soma, dend))
+    return traces
+
+######################################################
+if __name__ == "__main__":
+    paths = sys.argv[1:] or ['Fig3/DMS/Plot/', 'Fig3/Major/Plot/',
+                             'Fig5/DMS/sweep.h5', 'Fig5/Major/sweep.h5']
+    paths = [path for path in paths if os.path.exists(path)]
+    traces = load_traces(paths)
+    print("%d runs from %s" % (len(traces), ', '.join(paths)))
+
+    # Json runs give the traces as lists, .npz runs and sweeps as arrays
+    lists = [(soma.tolist(), dend.tolist()) for soma, dend in traces]
+    for name, runs in [('lists', lists), ('arrays', traces)]:
+        start_time = time.time()
+        loop = [features(sys.modules[__name__], 'loop_', soma, dend)
+                for soma, dend in runs]
+        loop_time = time.time() - start_time
+
+        start_time = time.time()
+        vectorized = [features(ana, '', soma, dend) for soma, dend in runs]
+        vectorized_time = time.time() - start_time
+
+        if loop != vectorized:
+            raise AssertionError("The vectorized kernels do not match the loops")
+        print("%s -- loops: %.3f s, vectorized: %.3f s (%.2f ms per run), "
+              "speedup: %.1fx" % (name, loop_time, vectorized_time,
+              1000 * vectorized_time / max(len(runs), 1),
+              loop_time / max(vectorized_time, 1e-9)))
+
+    if len(set(len(soma) for soma, dend in traces)) == 1:
+        soma = np.array([soma for soma, dend in traces])
+        dend = np.array([dend for soma, dend in traces])
+        start_time = time.time()
+        ana.batch_features(soma, dend)
+        ana.batch_features(soma, dend, TTX = True)
+        batch_time = time.time() - start_time
+        print("batch -- %.3f s (%.2f ms per run)"
+              % (batch_time, 1000 * batch_time / len(traces)))
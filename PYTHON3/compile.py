@@ -2,50 +2,115 @@
 authors:
 Salvador Dura <salvadordura@gmail.com>
 Joe Graham <joe.w.graham@gmail.com>
+
+The mod files are only compiled when they (or the NEURON version) changed:
+the build is stamped with a hash of the mod sources, the NEURON version,
+the compiler and the platform, and compile() does nothing when the
+existing build has the same stamp.
+
+A shared build cache directory (compile(cache=...) or the EEE_MOD_CACHE
+environment variable) keeps one build per hash in <cache>/<hash>/x86_64;
+workers with a matching build in the cache only symlink it, without
+compiling. The cache can be read-only for the workers.
+
+    python compile.py [--force] [--cache DIR]
 """
 import os
 import sys
 from inspect import getsourcefile
 import shutil
 import subprocess
+import hashlib
+import platform
+import tempfile
 
 #h.load_file('stdrun.hoc')
 # Get the current path
 eeedir = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
 # Get into the folder that containing all the mod files
 moddir = os.path.abspath(os.path.join(eeedir, "mod"))
+# Stamp of the mod sources a build was compiled from
+STAMP = ".modhash"
+
+def neuron_version():
+	"""Version string of the NEURON installation ('unknown' if nrniv is not found)."""
+	try:
+		output = subprocess.check_output(["nrniv", "--version"], stderr=subprocess.STDOUT)
+		return output.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+def mod_hash(compiler="nrnivmodl", comppath=moddir):
+	"""Hash of the mod sources, the NEURON version, the compiler and the platform."""
+	sha = hashlib.sha1()
+	for name in sorted(os.listdir(comppath)):
+		if name.endswith(".mod"):
+			sha.update(name.encode())
+			with open(os.path.join(comppath, name), "rb") as f:
+				sha.update(f.read())
+	for item in [neuron_version(), compiler, sys.platform, platform.machine()]:
+		sha.update(item.encode())
+	return sha.hexdigest()
 
-def compile(compiler="nrnivmodl", recompile=True):
+def build_stamp(path):
+	"""Hash stamped in the build at path ('' if there is none)."""
+	try:
+		with open(os.path.join(path, STAMP), "r") as f:
+			return f.read().strip()
+	except (IOError, OSError):
+		return ""
 
-	"""Removes any existing x86_64/i386 dirs, compiles using mkmod, and creates a symlink from sim dir to x86_64"""
+def compile(compiler="nrnivmodl", recompile=False, cache=None):
+
+	"""Compiles the mod files if they changed since the last build, and creates a symlink from sim dir to x86_64
+
+	recompile: compile even if the build is up to date
+	cache: shared build cache directory (default: $EEE_MOD_CACHE); a matching
+	       build there is linked instead of compiled, a new or up-to-date
+	       local build missing from it is added if the directory is writable
+	"""
 
 	def rmcompdir(comppath=moddir):
 		"""Removes x86_64 compiled mod directory from comppath dir."""
 		path = os.path.join(comppath, "x86_64")
-		if os.path.isdir(path):
+		if os.path.islink(path):
+			os.remove(path)
+		elif os.path.isdir(path):
 			print("Removing directory: " + path)
-			if (os.path.realpath(path) != path):
-				os.remove(path)
-			else:
-				shutil.rmtree(path, ignore_errors=True)
+			shutil.rmtree(path, ignore_errors=True)
 
 	def compilemod(compiler=compiler):
 		"""Compiles mod files using command line.
 		Default compiler is 'nrnivmodl' (NeurosimLab-specific script). """
 		print("Compiling mod file for EEE_Penny project using '" + compiler + "'...")
 		compile_output = subprocess.call(compiler, shell=True)
+		return compile_output
 
 
-	def linkmod(mydir):
-		"""Symlinks the NEURON compiler output folder into the given directory."""
-		if not os.path.isdir(os.path.join(moddir, "x86_64")):
+	def linkmod(target):
+		"""Symlinks the NEURON compiler output folder into the sim dir."""
+		if not os.path.isdir(target):
 			print("Compiled folder not found for symlinking...")
 		else:
-		#	if os.path.isdir(os.path.join(moddir, "x86_64")):
-			if not os.path.isdir(os.path.join(mydir, "x86_64")):
-				os.symlink(os.path.join(moddir, "x86_64"), os.path.join(eeedir, "x86_64"))
-	#			if not os.path.isdir(os.path.join(batchdir, "x86_64")):
-#					os.symlink(os.path.join(moddir, "x86_64"), os.path.join(batchdir, "x86_64"))
+			link = os.path.join(eeedir, "x86_64")
+			if os.path.realpath(link) != os.path.realpath(target):
+				rmcompdir(comppath=eeedir)
+				os.symlink(target, link)
+
+	def addtocache(build, cachedir):
+		"""Copies the build into the cache (atomically, under its hash)."""
+		tmp = None
+		try:
+			if not os.path.isdir(cachedir):
+				os.makedirs(cachedir)
+			tmp = tempfile.mkdtemp(dir=cachedir, prefix=".tmp-")
+			shutil.copytree(build, os.path.join(tmp, "x86_64"), symlinks=True)
+			os.rename(tmp, os.path.join(cachedir, digest))
+			print("Added the build to the cache: " + os.path.join(cachedir, digest))
+		except (IOError, OSError):
+			# Read-only cache, or another worker added the same build first
+			if tmp and os.path.isdir(tmp):
+				shutil.rmtree(tmp, ignore_errors=True)
 
 
 	curdir = os.getcwd()
@@ -53,20 +118,43 @@ def compile(compiler="nrnivmodl", recompile=True):
 		print("Moving to " + eeedir + " in order to compile mod files.")
 		os.chdir(eeedir)
 
-	rmcompdir(comppath=moddir)
-	rmcompdir(comppath=eeedir)
+	digest = mod_hash(compiler)
+	build = os.path.join(moddir, "x86_64")
+	if cache is None:
+		cache = os.environ.get("EEE_MOD_CACHE")
+	cached = os.path.join(cache, digest, "x86_64") if cache else None
 
-	os.chdir(moddir)
-	compilemod()
-	linkmod(eeedir)
-	os.chdir(eeedir)
-
-	print("Compiling completed.")
+	if not recompile and build_stamp(build) == digest:
+		print("The mod files are up to date.")
+		linkmod(build)
+		if cached and build_stamp(cached) != digest:
+			addtocache(build, cache)
+	elif not recompile and cached and build_stamp(cached) == digest:
+		print("Using the build in the cache: " + cached)
+		linkmod(cached)
+	else:
+		rmcompdir(comppath=moddir)
+		rmcompdir(comppath=eeedir)
+		os.chdir(moddir)
+		if compilemod() != 0 or not os.path.isdir(build):
+			os.chdir(curdir)
+			raise RuntimeError("Compiling the mod files with '" + compiler + "' failed")
+		with open(os.path.join(build, STAMP), "w") as f:
+			f.write(digest)
+		os.chdir(eeedir)
+		linkmod(build)
+		if cache:
+			addtocache(build, cache)
+		print("Compiling completed.")
+	os.chdir(curdir)
 
 ###########################################
 
 if __name__ == "__main__":
 	print("Compiling the mod files")
 	#make_output_dirs(all_batches)
-	compile()
+	cache = None
+	if "--cache" in sys.argv:
+		cache = sys.argv[sys.argv.index("--cache") + 1]
+	compile(recompile="--force" in sys.argv, cache=cache)
 	print("Finished setting up EEE project.")
@@ -0,0 +1,182 @@
+"""
+Persistent cache of the features measured on the traces.
+
+The analysis and plotting files measure the same plateaus and spikes on the
+same traces every time a figure is made. The cache keeps the results of the
+analysis_utils entry points in a SQLite database, keyed on
+
+    - the content of the traces (SHA-1 of the samples),
+    - the function and its parameters (dt, analysis windows, TTX, ...),
+    - analysis_utils.ANALYSIS_VERSION,
+
+so that a trace is only measured again when it, the windows or the
+measurements change. The database holds at most max_entries results; the
+least recently used ones are dropped first.
+
+    cache = FeatureCache()
+    features = cache.batch_features(soma, dend, dt = dt)   # as ana.batch_features
+    peak, t = cache.call(ana.single_spike, trace, dt)
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import sqlite3
+import numpy as np
+import analysis_utils as ana
+
+MAX_ENTRIES = 200000
+
+######################################################
+
+class FeatureCache:
+    """
+    SQLite-backed, size-bounded LRU cache of trace features.
+
+    Table:
+        features: key (hash of traces, function, parameters and version),
+                  value (pickled result) and the time it was last used
+    """
+
+    def __init__(self, path = 'features.db', max_entries = MAX_ENTRIES,
+                 version = ana.ANALYSIS_VERSION):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout = 60)
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS features (
+                key TEXT PRIMARY KEY, value BLOB, used REAL)""")
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS features_used
+                ON features (used)""")
+
+    #############
+    def get(self, keys):
+        """Cached results of keys as a dict {key: result} (hits only)."""
+        found = {}
+        keys = list(keys)
+        # SQLite limits the number of parameters of a statement
+        for i in range(0, len(keys), 500):
+            block = keys[i:i+500]
+            query = ("SELECT key, value FROM features WHERE key IN (%s)"
+                     % ', '.join('?' * len(block)))
+            for key, value in self.conn.execute(query, block):
+                found[key] = pickle.loads(bytes(value))
+        if found:
+            with self.conn:
+                self.conn.executemany("UPDATE features SET used = ? WHERE key = ?",
+                                      [(time.time(), key) for key in found])
+        return found
+
+    def put(self, results):
+        """Store results ({key: result}) and drop the least recently used
+        entries above max_entries."""
+        if not results:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO features (key, value, used) VALUES (?, ?, ?)",
+                [(key, sqlite3.Binary(pickle.dumps(result, 2)), now)
+                 for key, result in results.items()])
+            count = self.conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute("""DELETE FROM features WHERE key IN
+                    (SELECT key FROM features ORDER BY used LIMIT ?)""",
+                    (count - self.max_entries,))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM features")
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    #############
+    def key(self, func, traces, **params):
+        """Cache key of func applied to traces (list of 1d arrays) with params."""
+        sha = _prefix(func, self.version, params)
+        for trace in traces:
+            sha.update(_trace_bytes(trace))
+        return sha.hexdigest()
+
+    def call(self, func, trace, *args, **kwargs):
+        """func(trace, *args, **kwargs) for a function of one trace,
+        eg. ana.single_spike, measured only if it is not in the cache."""
+        key = self.key(func, [trace], args = args, kwargs = kwargs)
+        found = self.get([key])
+        if key in found:
+            return found[key]
+        result = func(trace, *args, **kwargs)
+        self.put({key: result})
+        return result
+
+    def batch_features(self, soma, dend = None, TTX = False, dt = 0.025,
+                       baseline_win = ana.BASELINE_WIN, start = ana.START):
+        """ana.batch_features with one cache entry per run.
+
+        Only the runs that are not in the cache are measured (in one batch);
+        the arguments and the result are the same as ana.batch_features.
+        """
+        soma = np.asarray(soma)
+        if soma.ndim == 1:
+            soma = soma[np.newaxis, :]
+        if dend is not None:
+            dend = np.asarray(dend)
+            if dend.ndim == 1:
+                dend = dend[np.newaxis, :]
+        params = dict(TTX = bool(TTX), dt = float(dt), dend = dend is not None,
+                      baseline_win = list(baseline_win), start = start)
+        prefix = _prefix(ana.batch_features, self.version, params)
+        keys = []
+        for i in range(len(soma)):
+            sha = prefix.copy()
+            sha.update(_trace_bytes(soma[i]))
+            if dend is not None:
+                sha.update(_trace_bytes(dend[i]))
+            keys.append(sha.hexdigest())
+
+        found = self.get(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            features = ana.batch_features(soma[missing],
+                dend[missing] if dend is not None else None, TTX, dt,
+                baseline_win, start)
+            new = {}
+            for j, i in enumerate(missing):
+                new[keys[i]] = dict((name, values[j].item())
+                                    for name, values in features.items())
+            self.put(new)
+            found.update(new)
+
+        names = ['spike_num', 'ISI', 'soma_platdur', 'soma_idx', 'soma_platamp']
+        if dend is not None:
+            names += ['dend_platamp', 'dend_platdur']
+        return dict((name, np.array([found[key][name] for key in keys]))
+                    for name in names)
+
+######################################################
+# Helpers
+######################################################
+
+def _prefix(func, version, params):
+    """SHA-1 of the function, the analysis version and the parameters."""
+    sha = hashlib.sha1()
+    name = "%s.%s:%s:" % (func.__module__, func.__name__, version)
+    sha.update(name.encode())
+    sha.update(json.dumps(params, sort_keys = True, default = repr).encode())
+    return sha
+
+def _trace_bytes(trace):
+    """The samples of a trace as float64 bytes (lists and arrays alike)."""
+    return np.ascontiguousarray(trace, dtype = np.float64).tobytes()
@@ -0,0 +1,190 @@
+"""
+Completion ledger of the grid points of a sweep.
+
+A long sweep that dies partway used to start from zero when it was run
+again: the run titles carry a timestamp, so the runs already saved could not
+be matched to the grid points. The ledger records every grid point once its
+run is saved, keyed on the canonical parameters of the point (not on the
+title), in a SQLite database next to the results. A restarted sweep skips
+the points in the ledger:
+
+    ledger = Ledger('Fig5/Major/ledger.db')
+    for args in ledger.remaining('Fig5_exp_major', jobs(), point):
+        Glu_Stim(*args, ledger = ledger)       # marks the point when saved
+
+With verify, the saved runs of the points in the ledger are checked first
+(the file, or the row of the sweep store, exists and its traces are
+finite); the points whose run is missing or broken are run again.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import time
+import numpy as np
+
+######################################################
+
+class Ledger:
+    """
+    SQLite-backed set of the completed grid points of the sweeps.
+
+    Table:
+        points: key (hash of the script and the canonical parameters),
+                script, parameters (canonical json), where the run is saved
+                (location, and row of the sweep store) and when
+    """
+
+    def __init__(self, path = 'ledger.db'):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS points (
+                key TEXT PRIMARY KEY, script TEXT, params TEXT,
+                location TEXT, row INTEGER, finished TEXT)""")
+
+    def _connect(self):
+        # One connection per call: points are marked from the writer
+        # process of utils.AsyncSaver
+        return sqlite3.connect(self.path, timeout = 60)
+
+    #############
+    def mark(self, script, params, location, row = None):
+        """Record the grid point params of script as completed.
+
+        Parameters:
+        -----------
+        script: string
+            Name of the simulation file, eg. 'Fig5_exp_major'
+        params: dict
+            The parameters of the grid point (see canonical)
+        location: string
+            Path of the saved run (or of the sweep store holding it)
+        row: int
+            Row of the run in a sweep store (None for one file per run)
+        """
+        with self._connect() as conn:
+            conn.execute("""INSERT OR REPLACE INTO points
+                (key, script, params, location, row, finished)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (point_key(script, params), script, canonical(params),
+                 os.path.normpath(location), row,
+                 time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def done(self, script = None):
+        """Keys of the completed points (of one simulation file)."""
+        query = "SELECT key FROM points"
+        args = []
+        if script is not None:
+            query += " WHERE script = ?"
+            args.append(script)
+        with self._connect() as conn:
+            return set(key for key, in conn.execute(query, args))
+
+    def remaining(self, script, jobs, point, verify = False):
+        """The jobs whose grid point is not completed yet.
+
+        Parameters:
+        -----------
+        script: string
+        jobs: iterable of argument tuples, one per grid point
+        point: function
+            Grid point parameters (dict) of an argument tuple
+        verify: bool
+            Check the saved runs first (see check)
+
+        Return (yield):
+        -----------
+        args: the argument tuples still to run
+        """
+        if verify:
+            self.check(script)
+        done = self.done(script)
+        for args in jobs:
+            if point_key(script, point(*args)) not in done:
+                yield args
+
+    def check(self, script = None):
+        """Forget the points whose saved run is missing or broken.
+
+        Return:
+        -----------
+        n_bad: int
+            The number of points to run again.
+        """
+        query = "SELECT key, location, row FROM points"
+        args = []
+        if script is not None:
+            query += " WHERE script = ?"
+            args.append(script)
+        with self._connect() as conn:
+            entries = conn.execute(query, args).fetchall()
+        bad = [key for key, location, row in entries
+               if not _saved(location, row)]
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM points WHERE key = ?",
+                             [(key,) for key in bad])
+        return len(bad)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+######################################################
+# Helpers
+######################################################
+
+def canonical(params):
+    """Canonical json of a grid point: sorted keys, tuples as lists, numpy
+    scalars as Python numbers and floats to 10 significant digits (so that
+    0.1 + 0.2 and 0.3 are the same point)."""
+    return json.dumps(_canon(params), sort_keys = True, separators = (',', ':'))
+
+def _canon(value):
+    if isinstance(value, dict):
+        return dict((str(key), _canon(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canon(item) for item in value]
+    if hasattr(value, 'item') and np.ndim(value) == 0:
+        value = value.item()
+    if isinstance(value, float):
+        return float("%.10g" % value)
+    return value
+
+def point_key(script, params):
+    """Ledger key of the grid point params of script."""
+    return hashlib.sha1((script + ':' + canonical(params)).encode()).hexdigest()
+
+def _saved(location, row):
+    """True if the run saved at location (row of a sweep store) is readable
+    and its traces are finite."""
+    if not os.path.exists(location):
+        return False
+    try:
+        if row is None:
+            import utils as ut
+            traces = ut.loadrun(location)['recording']
+            return _finite(traces)
+        import sweepstore as ss
+        store = ss.SweepStore(location)
+        if row >= len(store):
+            return False
+        return bool(np.all(np.isfinite(store.traces('soma/voltage', [row]))))
+    except Exception:
+        return False
+
+def _finite(recording):
+    for key, value in recording.items():
+        if key == 'time':
+            continue
+        if isinstance(value, dict):
+            if not _finite(value):
+                return False
+        elif not np.all(np.isfinite(np.asarray(value, dtype = float))):
+            return False
+    return True
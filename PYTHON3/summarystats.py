@@ -0,0 +1,117 @@
+"""
+Summary statistics of the results tables for the plots.
+
+The plots show the mean of each feature per group of runs (eg. per NMDA
+weight, or per branch, location and condition) with a bootstrap confidence
+interval. Computing them from the full results table on every render gets
+slow as the sweeps grow, so they are computed once, after the analysis, and
+saved next to the results table:
+
+    summary = summarize(table, by = ['NMDA_weight'], columns = ['platamp'])
+    ut.savetable(summary, summary_path(table_path))
+
+The summary has one row per group: the group columns, and for each feature
+its mean (same name as in the results table), the bounds of the confidence
+interval ('<name>_ci_low', '<name>_ci_high') and the number of runs with a
+finite value of the feature ('<name>_n', the runs the bootstrap resamples).
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import numpy as np
+import pandas as pd
+
+N_BOOT = 1000
+CI = 95
+
+######################################################
+
+def bootstrap_ci(values, groups, n_boot = N_BOOT, ci = CI, seed = 0):
+    """Mean and bootstrap confidence interval of values in each group.
+
+    All the groups are resampled at once: each bootstrap sample draws, for
+    every value, a value of the same group, and the group means are summed
+    with np.add.reduceat.
+
+    Parameters:
+    -----------
+    values: 1d array
+    groups: 1d array of group numbers (0 .. n_groups-1), one per value
+    n_boot: number of bootstrap samples
+    ci: width of the confidence interval (%)
+    seed: seed of the random numbers (the same summary on every run)
+
+    Return:
+    -----------
+    mean, low, high: arrays with one entry per group (nan for the groups
+        without finite values)
+    n: number of finite values in each group
+    """
+    values = np.asarray(values, dtype = float)
+    groups = np.asarray(groups)
+    n_groups = groups.max() + 1 if len(groups) else 0
+    mean = np.full(n_groups, np.nan)
+    low = np.full(n_groups, np.nan)
+    high = np.full(n_groups, np.nan)
+    keep = np.isfinite(values)
+    values, groups = values[keep], groups[keep]
+    n = np.bincount(groups, minlength = n_groups)
+    if len(values) == 0:
+        return mean, low, high, n
+
+    order = np.argsort(groups, kind = 'stable')
+    values, groups = values[order], groups[order]
+    present, starts, sizes = np.unique(groups, return_index = True, return_counts = True)
+    mean[present] = np.add.reduceat(values, starts) / sizes
+
+    # Start and size of the group of each value
+    offset = np.repeat(starts, sizes)
+    scale = np.repeat(sizes, sizes)
+    rng = np.random.RandomState(seed)
+    # Bootstrap samples in blocks, to bound the memory of the index array
+    block = max(1, int(1e7 // len(values)))
+    boot = []
+    for i in range(0, n_boot, block):
+        draws = rng.random_sample((min(block, n_boot - i), len(values)))
+        idx = offset + (draws * scale).astype(int)
+        boot.append(np.add.reduceat(values[idx], starts, axis = 1) / sizes)
+    boot = np.concatenate(boot)
+    low[present], high[present] = np.percentile(
+        boot, [(100 - ci) / 2.0, (100 + ci) / 2.0], axis = 0)
+    return mean, low, high, n
+
+def summarize(table, by, columns, n_boot = N_BOOT, ci = CI, seed = 0):
+    """Means and bootstrap confidence intervals of columns per group.
+
+    Parameters:
+    -----------
+    table: pandas.DataFrame
+        A results table, one row per run
+    by: list of the group columns, eg. ['Bnum', 'Loc', 'NMDA_weight']
+    columns: list of the feature columns, eg. ['soma_platamp', 'soma_platdur']
+    n_boot, ci, seed: see bootstrap_ci
+
+    Return:
+    -----------
+    summary: pandas.DataFrame
+        One row per group, sorted by the group columns.
+    """
+    codes, keys = pd.MultiIndex.from_frame(table[by]).factorize(sort = True)
+    summary = pd.DataFrame(list(keys), columns = by)
+    for name in columns:
+        mean, low, high, n = bootstrap_ci(table[name].values, codes, n_boot, ci, seed)
+        summary[name] = mean
+        summary[name + '_ci_low'] = low
+        summary[name + '_ci_high'] = high
+        summary[name + '_n'] = n
+    return summary
+
+def summary_path(table_path):
+    """Path of the summary of a results table, eg.
+    'Fig5/DMS/B34/total_results.parquet' -> 'Fig5/DMS/B34/total_summary.parquet'"""
+    directory, name = os.path.split(table_path)
+    name = os.path.splitext(name)[0]
+    if name.endswith('_results'):
+        name = name[:-len('_results')]
+    return os.path.join(directory, name + '_summary.parquet')
@@ -0,0 +1,320 @@
+"""
+One container for all the runs of a simulation sweep.
+
+Instead of writing one file per run into a deep directory tree
+(eg. Fig5/DMS/B34/Loc0.03_0.17/N/...), every run of a sweep is appended to
+a single HDF5 file:
+
+    params/<name>   the parameter table, one entry per run
+    traces/<name>   one (n_runs x n_samples) array per recorded trace
+    time            the time axis shared by all runs (attributes t0, dt, n
+                    for fixed-step runs)
+
+The run id is the row number in all of them, so the analysis can read the
+parameters of the whole sweep at once and the traces in contiguous blocks.
+
+Parameter and trace names are the '/'-joined keys of the data dict built in
+the simulation files, eg. 'SynAMPA/weight' or 'soma/voltage'.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import json
+import fcntl
+import uuid
+import contextlib
+import numpy as np
+import utils as ut
+
+# Loaded at the first access of a store (see utils.LazyModule)
+h5py = ut.LazyModule('h5py')
+
+######################################################
+
+class SweepStore:
+    """
+    Append-only HDF5 container for the runs of one sweep.
+
+    Appending takes an exclusive lock on '<path>.lock' and reading a shared
+    one, so several worker processes can write into the same store while
+    it is read; the file is only open while a run is written or read. A
+    run is checked completely before anything is written, and the readers
+    only see the first n_runs rows, which are set when a run is complete.
+
+    Example:
+    -----------
+        store = SweepStore('Fig5/DMS/sweep.h5')
+        store.append(data)              # data: dict built by Glu_Stim
+        params = store.params()         # dict of numpy arrays
+        soma = store.traces('soma/voltage', rows)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    #############
+    def append(self, data):
+        """Append one run.
+
+        Parameters:
+        -----------
+        data: dict
+            Nested dict of one run as saved by utils.saverun. Numpy arrays
+            under 'recording' are stored as traces, data['recording']['time']
+            as the time axis, everything else goes to the parameter table.
+            The time axis has to be the one of the runs already stored.
+
+        Return:
+        -----------
+        run_id: int
+            Row of the run in the store.
+        """
+        params = {}
+        traces = {}
+        _flatten(data, '', params, traces)
+        time = params.pop('recording/time', None)
+
+        with self._open('a') as f:
+            run_id = f.attrs.get('n_runs', 0)
+            if run_id == 0:
+                _set_time(f, time)
+                f.attrs['store_id'] = uuid.uuid4().hex
+            else:
+                # Everything is checked before the first row is written
+                if set(params) != set(_dataset_names(f['params'])) or \
+                        set(traces) != set(_dataset_names(f['traces'])):
+                    raise ValueError("Run does not match the parameters and "
+                                     "traces already in %s" % self.path)
+                _check_time(f, time, self.path)
+                _check_traces(f, traces)
+            for name, value in params.items():
+                _append_param(f, name, value, run_id)
+            for name, value in traces.items():
+                _append_trace(f, name, value, run_id)
+            f.attrs['n_runs'] = run_id + 1
+        return int(run_id)
+
+    @contextlib.contextmanager
+    def _open(self, mode = 'r'):
+        """The store file, under a shared (mode 'r') or exclusive lock."""
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if mode == 'r' else fcntl.LOCK_EX)
+            with h5py.File(self.path, mode) as f:
+                yield f
+
+    #############
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        with self._open() as f:
+            return int(f.attrs.get('n_runs', 0))
+
+    def store_id(self):
+        """Random id given to the store when its first run was written;
+        a store that is deleted and written again gets a new one."""
+        if not os.path.exists(self.path):
+            return ''
+        with self._open() as f:
+            return str(f.attrs.get('store_id', ''))
+
+    def params(self, names = None):
+        """The parameter table as a dict of numpy arrays (one entry per run).
+
+        Parameters that were lists (eg. 'SynAMPA/locs') come back as lists.
+        Pass names to read only some of the columns.
+        """
+        table = {}
+        with self._open() as f:
+            n_runs = int(f.attrs.get('n_runs', 0))
+            group = f['params']
+            for name in (names if names is not None else _dataset_names(group)):
+                dset = group[name]
+                values = dset[:n_runs]
+                if dset.dtype.kind in ('O', 'S'):
+                    values = np.array([v.decode() if isinstance(v, bytes) else v
+                                       for v in values], dtype = object)
+                if dset.attrs.get('json', False):
+                    values = [json.loads(v) for v in values]
+                table[name] = values
+        return table
+
+    def traces(self, name, rows = None):
+        """Recorded traces as an (n_runs x n_samples) array.
+
+        Parameters:
+        -----------
+        name: string
+            Trace name, eg. 'soma/voltage'
+        rows: slice, boolean mask or sorted run ids (default: all runs)
+        """
+        with self._open() as f:
+            n_runs = int(f.attrs.get('n_runs', 0))
+            dset = f['traces'][name]
+            if rows is None:
+                return dset[:n_runs]
+            if isinstance(rows, slice):
+                return dset[slice(*rows.indices(n_runs))]
+            rows = np.asarray(rows)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+            if len(rows) == 0:
+                return np.empty((0, dset.shape[1]), dtype = dset.dtype)
+            return dset[rows]
+
+    def time(self):
+        """Time points (ms) shared by all runs of the sweep."""
+        return ut.get_time(self._stored_time())
+
+    def dt(self):
+        """Sampling interval (ms) of the runs, see utils.get_dt."""
+        return ut.get_dt(self._stored_time())
+
+    def _stored_time(self):
+        with self._open() as f:
+            if 'time' in f.attrs:
+                time = json.loads(f.attrs['time'])
+            else:
+                time = f['time'][()]
+        return {'recording': {'time': time}}
+
+######################################################
+# Helpers
+######################################################
+
+def _flatten(data, prefix, params, traces):
+    """Split a nested run dict into '/'-keyed parameters and traces."""
+    for key, value in data.items():
+        name = prefix + str(key)
+        if name == 'recording/time':
+            params[name] = value
+        elif isinstance(value, dict):
+            _flatten(value, name + '/', params, traces)
+        elif isinstance(value, np.ndarray) and name.startswith('recording/'):
+            traces[name[len('recording/'):]] = value
+        else:
+            params[name] = value
+
+def _dataset_names(group, prefix = ''):
+    names = []
+    for key, item in group.items():
+        if isinstance(item, h5py.Group):
+            names += _dataset_names(item, prefix + key + '/')
+        else:
+            names.append(prefix + key)
+    return names
+
+def _set_time(f, time):
+    if 'time' in f:
+        # Left by a first run that failed
+        del f['time']
+    if isinstance(time, dict):
+        f.attrs['time'] = json.dumps(time)
+    elif time is not None:
+        f.create_dataset('time', data = np.asarray(time, dtype = float))
+
+def _check_time(f, time, path):
+    """Raise a ValueError if time is not the time axis stored in f."""
+    if 'time' in f.attrs:
+        stored = json.loads(f.attrs['time'])
+    elif 'time' in f:
+        stored = f['time'][()]
+    else:
+        stored = None
+    if stored is None and time is None:
+        return
+    if stored is not None and time is not None:
+        stored = ut.get_time({'recording': {'time': stored}})
+        time = ut.get_time({'recording': {'time': time}})
+        if len(stored) == len(time) and np.allclose(stored, time, rtol = 0, atol = 1e-6):
+            return
+    raise ValueError("Run does not match the time axis of the runs already in %s" % path)
+
+def _check_traces(f, traces):
+    """Raise a ValueError if a trace does not have the stored length."""
+    for name, value in traces.items():
+        n_samples = f['traces'][name].shape[1]
+        if len(value) != n_samples:
+            raise ValueError("Trace '%s' has %d samples, the store expects %d"
+                             % (name, len(value), n_samples))
+
+def _append_param(f, name, value, run_id):
+    group = f.require_group('params')
+    is_json = isinstance(value, (list, tuple, dict))
+    if is_json:
+        value = json.dumps(value)
+    if name not in group:
+        if isinstance(value, str):
+            dtype = h5py.special_dtype(vlen = str)
+        else:
+            dtype = np.asarray(value).dtype
+        dset = group.create_dataset(name, shape = (0,), maxshape = (None,),
+                                    dtype = dtype, chunks = (256,))
+        dset.attrs['json'] = is_json
+    dset = group[name]
+    dset.resize((run_id + 1,))
+    dset[run_id] = value
+
+def _append_trace(f, name, value, run_id):
+    group = f.require_group('traces')
+    value = np.asarray(value)
+    if name not in group:
+        group.create_dataset(name, shape = (0, len(value)),
+                             maxshape = (None, len(value)), dtype = value.dtype,
+                             chunks = (16, len(value)))
+    dset = group[name]
+    if dset.shape[1] != len(value):
+        raise ValueError("Trace '%s' has %d samples, the store expects %d"
+                         % (name, len(value), dset.shape[1]))
+    dset.resize((run_id + 1, dset.shape[1]))
+    dset[run_id] = value
+
+######################################################
+
+def pack_tree(path, store):
+    """Copy a Fig 5 result tree (B*/Loc*/N|TTX/*.npz|json) into a store.
+
+    The branch and location directory names are added to each run as the
+    'Bnum' and 'Loc' parameters, the file name as 'title'.
+    """
+    for Bnum in sorted(os.listdir(path)):
+        if not os.path.isdir(os.path.join(path, Bnum)):
+            continue
+        for Loc in sorted(os.listdir(os.path.join(path, Bnum))):
+            for cond in ['N', 'TTX']:
+                path_to_json = os.path.join(path, Bnum, Loc, cond)
+                if not os.path.isdir(path_to_json):
+                    continue
+                for js in sorted(ut.list_runs(path_to_json)):
+                    data = ut.loadrun(os.path.join(path_to_json, js))
+                    data['Bnum'] = Bnum
+                    data['Loc'] = Loc
+                    data['title'] = os.path.splitext(js)[0]
+                    recording = data['recording']
+                    _to_arrays(recording)
+                    store.append(data)
+
+def _to_arrays(recording):
+    """Json runs keep traces as lists; the store needs arrays."""
+    for key, value in recording.items():
+        if key == 'time':
+            continue
+        if isinstance(value, dict):
+            _to_arrays(value)
+        elif isinstance(value, list):
+            recording[key] = np.asarray(value, dtype = float)
+
+######################################################
+if __name__ == "__main__":
+    import sys
+    import time
+    # Pack an existing result tree, eg. python sweepstore.py Fig5/DMS/
+    start_time = time.time()
+    path = sys.argv[1] if len(sys.argv) > 1 else "Fig5/DMS/"
+    store = SweepStore(os.path.join(path, 'sweep.h5'))
+    pack_tree(path, store)
+    print("Packed %d runs into %s" % (len(store), store.path))
+    print("--- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,181 @@
+"""
+Parallel analysis of saved runs.
+
+The list of runs (file paths, or branches of a sweep store) is split into
+shards, the shards are analysed by a pool of worker processes and the
+tables returned by the workers are merged into one, in the order of the
+input list:
+
+    def analyse(json_files):
+        # load the runs and extract the features -> pandas.DataFrame
+        ...
+
+    if __name__ == "__main__":
+        table = run(analyse, ri.saved_runs('Fig3/DMS/Analysis/'))
+
+run_incremental does the same but keeps the results table on disk with a
+manifest of the runs already analysed, and only analyses new or changed
+runs the next time.
+
+The analysis function has to be defined at module level (the workers get it
+by name) and the script has to keep its work under
+if __name__ == "__main__", because the workers import the script again on
+platforms without fork.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import json
+import hashlib
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import analysis_utils as ana
+import utils as ut
+
+######################################################
+
+def shards(items, n_shards):
+    """Split items into n_shards contiguous lists of about the same size."""
+    bounds = np.linspace(0, len(items), n_shards + 1).round().astype(int)
+    return [items[bounds[i]:bounds[i+1]] for i in range(n_shards)]
+
+def run(func, items, processes = None, shards_per_process = 4):
+    """Analyse items in parallel and merge the results.
+
+    Parameters:
+    -----------
+    func: function
+        Takes a list of items (one shard) and returns a pandas.DataFrame
+        (or a list of rows). It is called with an empty list when there
+        is nothing to analyse, to get the columns of the table.
+    items: list
+        eg. the saved runs from runindex.saved_runs
+    processes: int
+        Number of worker processes (default: number of cores)
+    shards_per_process: int
+        More shards than processes even out runs of different cost.
+
+    Return:
+    -----------
+    table: pandas.DataFrame
+        The results of all the shards, in the order of items.
+    """
+    items = list(items)
+    if processes is None:
+        processes = mp.cpu_count()
+    n_shards = min(len(items), processes * shards_per_process)
+    if n_shards == 0:
+        return merge([func([])])
+    if processes == 1 or n_shards == 1:
+        return merge([func(shard) for shard in shards(items, n_shards)])
+    pool = mp.Pool(min(processes, n_shards))
+    try:
+        results = pool.map(func, shards(items, n_shards), chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+    return merge(results)
+
+def merge(results):
+    """One table from the results of the shards."""
+    tables = [result if isinstance(result, pd.DataFrame) else pd.DataFrame(result)
+              for result in results]
+    return pd.concat(tables, ignore_index = True)
+
+######################################################
+# Incremental analysis
+######################################################
+
+def file_stamp(path):
+    """Modification time and size of a saved run."""
+    stat = os.stat(path)
+    return "%d:%d" % (stat.st_mtime * 1e6, stat.st_size)
+
+def content_hash(path):
+    """SHA-1 of the content of a saved run (slower than file_stamp, but
+    does not change when a file is only copied or touched)."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class Manifest:
+    """
+    Record of the runs already analysed into a results table.
+
+    Saved as json next to the table: the analysis version and one stamp
+    (eg. file_stamp) per run. A manifest written by another analysis
+    version is ignored, so all the runs are analysed again after the
+    measurements change (see analysis_utils.ANALYSIS_VERSION).
+    """
+
+    def __init__(self, path, version = ana.ANALYSIS_VERSION):
+        self.path = path
+        self.version = version
+        self.runs = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('version') == version:
+                self.runs = saved['runs']
+
+    def stale(self, stamps):
+        """Runs of stamps ({run: stamp}) that are new or have changed."""
+        return [item for item, stamp in stamps.items()
+                if self.runs.get(str(item)) != stamp]
+
+    def save(self, stamps):
+        """Record stamps ({run: stamp}) as the analysed runs."""
+        self.runs = dict((str(item), stamp) for item, stamp in stamps.items())
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.version, 'runs': self.runs}, f)
+        os.rename(tmp, self.path)
+
+def run_incremental(func, items, table_path, key = 'run', stamp = file_stamp,
+                    version = ana.ANALYSIS_VERSION, **kwargs):
+    """Like run, but only analyse the runs that are not in the table yet.
+
+    Parameters:
+    -----------
+    func, items: as for run. The tables returned by func need a column
+        key holding the item each row comes from.
+    table_path: string
+        The results table (see utils.savetable). The manifest is saved
+        as table_path + '.manifest.json'.
+    stamp: function
+        Stamp of an item; the item is analysed again when it changes
+        (file_stamp, content_hash, ...).
+    version: the analysis version recorded in the manifest
+    kwargs: passed to run (processes, shards_per_process)
+
+    Return:
+    -----------
+    table: pandas.DataFrame
+        The rows of the table for all the items (rows of runs that are no
+        longer in items are dropped).
+    """
+    items = list(items)
+    manifest = Manifest(table_path + '.manifest.json', version)
+    stamps = dict((item, stamp(item)) for item in items)
+    old = None
+    if manifest.runs and os.path.exists(table_path):
+        old = ut.loadtable(table_path)
+        if key not in old.columns:
+            old = None
+    todo = set(manifest.stale(stamps)) if old is not None else set(items)
+    if old is not None and not todo and len(manifest.runs) == len(stamps):
+        return old
+    todo = [item for item in items if item in todo]
+    new = run(func, todo, **kwargs)
+    if old is not None:
+        keep = old[key].isin(items) & ~old[key].isin(todo)
+        table = pd.concat([old[keep], new], ignore_index = True)
+    else:
+        table = new
+    ut.savetable(table, table_path)
+    manifest.save(stamps)
+    return table
@@ -17,34 +17,75 @@ salvadordura@gmail.com
 joe.w.graham@gmail.com
 """
 
-import json
-import matplotlib.pyplot as plt
-import os
 import numpy as np
-import pandas as pd
-import seaborn as sns
+
+# Version of the measurements, recorded with the analysed results (see
+# analysis_runner.Manifest). Increase it when a measurement changes, so
+# that saved results are analysed again.
+ANALYSIS_VERSION = 1
+
+########################################
+### Analysis windows (ms): the baseline is the mean voltage in BASELINE_WIN,
+### the measurements use the trace from START on. The sample indices follow
+### from the sampling interval dt, so traces recorded (or saved) at a coarser
+### step than 0.025 ms are measured on the same time windows.
+########################################
+BASELINE_WIN = (100, 150)
+START = 150
+
+def time_index(t, dt = 0.025):
+    """Sample index of time t (ms) in a trace sampled every dt (ms) from 0."""
+    return int(round(t / dt))
+
+def resample(t, data, dt = 0.025):
+    """Voltage trace on a fixed grid of step dt, eg. for variable-step
+    (CVODE) recordings with time points t."""
+    t = np.asarray(t, dtype = float)
+    return np.interp(np.arange(0, t[-1] + dt/2, dt), t, data)
+
+########################################
+### Helpers: the kernels below work on numpy arrays. Recordings loaded from
+### json files are lists, so they are converted once per call here.
+########################################
+def _baseline_stable(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    """Baseline (mean over baseline_win), the trace from start on and the
+    index of start."""
+    data = np.asarray(data)
+    baseline = np.mean(data[time_index(baseline_win[0], dt):time_index(baseline_win[1], dt)])
+    i0 = time_index(start, dt)
+    stable = data[i0:]
+    return data, baseline, stable, i0
+
+def _crossings(data, thresh):
+    """Indices i of upward (data[i] < thresh <= data[i+1]) and downward
+    (data[i] >= thresh > data[i+1]) threshold crossings."""
+    data = np.asarray(data)
+    above = data >= thresh
+    below = data < thresh
+    up = np.flatnonzero(below[:-1] & above[1:])
+    down = np.flatnonzero(above[:-1] & below[1:])
+    return up, down
 
 ########################################
 ### Function: to measure plateau duration
 ########################################
-def meas_platdur(data, thresh = 10, dt = 0.025):
+def meas_platdur(data, thresh = 10, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """Measures plateau duration (ms)
 
     Parameters:
     -----------
         data: voltage trace
         thresh (mV): measure the duration of the plateau which are bigger than baseline + thresh
-        dt: the sampling rate (default is 0.025ms or 40kHz)
+        dt: the sampling interval (default is 0.025ms or 40kHz)
+        baseline_win (ms): time window of the baseline (default 100-150 ms)
+        start (ms): the plateau is measured from start on (default 150 ms)
     Return:
     -----------
         platur (ms): plateau duration in ms
     """
-    # Make sure dt = 0.025 and there is no stimulation for the first 50 ms
-    # If there is anything before 50ms, change the time points for baseline
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
-    above = [val for val in stable if val > (baseline + thresh)]
-    platdur = dt * len(above)
+    # Make sure there is no stimulation in the baseline window
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
+    platdur = dt * int(np.count_nonzero(stable > (baseline + thresh)))
     return platdur
 
 ########################################
@@ -69,20 +110,22 @@ def spike_count(data, thresh = 0):
     count: int
         Number of spikes in the data.
     """
-    spike_flag = False
-    count = 0
-    for idx, val in enumerate(data[:-1]):
-        if spike_flag == False and val < thresh and data[idx+1] >= thresh:
-            spike_flag = True
-        elif spike_flag == True and val >= thresh and data[idx+1] < thresh:
-            count += 1
-            spike_flag = False
+    # A spike is a downward crossing that directly follows an upward crossing
+    # (a downward crossing before the first upward one is not counted).
+    up, down = _crossings(data, thresh)
+    if len(up) == 0 or len(down) == 0:
+        return 0
+    events = np.zeros(len(data), dtype = np.int8)
+    events[up] = 1
+    events[down] = -1
+    events = events[events != 0]
+    count = int(np.count_nonzero((events[:-1] == 1) & (events[1:] == -1)))
     return count
 
 ########################################
 ### Function: to calculate spike interval
 ########################################
-def IST_spikes (data, dt = 0.025):
+def IST_spikes (data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """
     Get the interspike intervals, spike_idx, spike_mvalue and spike_midx
     Return:
@@ -94,7 +137,8 @@ def IST_spikes (data, dt = 0.025):
     ISTs:
         The average time of interspike intervals
     """
-    spikes = get_EPSPs(data, 60, dt)
+    data = np.asarray(data)
+    spikes = get_EPSPs(data, 60, dt, baseline_win, start)
     IST = []
     count = len(spikes)
     spike_mvalue = []
@@ -116,7 +160,7 @@ def IST_spikes (data, dt = 0.025):
 ########################################
 ### Function: to analyze EPSPs
 ########################################
-def get_EPSPs(data, thresh = 2, dt = 0.025):
+def get_EPSPs(data, thresh = 2, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """
     Get the maximum index and value of each EPSP peak
     Return:
@@ -125,19 +169,22 @@ def get_EPSPs(data, thresh = 2, dt = 0.025):
         A list of turple.
         Each turple has the index of max EPSP, and value of max EPSP.
     """
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
-    EPSPs = []
-    for idx, val in enumerate(stable[:-1]):
-        if (val >= (baseline + thresh)) and (val > stable[idx-1]) and (val >= stable[idx+1]):
-            time = (idx + 6000) * dt
-            EPSPs.append((time, val))
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
+    if len(stable) < 2:
+        return []
+    val = stable[:-1]
+    # The point before the first one is the last point of the trace
+    prev = np.roll(stable, 1)[:-1]
+    peaks = np.flatnonzero((val >= (baseline + thresh)) & (val > prev) &
+                           (val >= stable[1:]))
+    times = (peaks + i0) * dt
+    EPSPs = list(zip(times.tolist(), stable[peaks].tolist()))
     return EPSPs
 
 ########################################
 ### Function: to analyze spikes
 ########################################
-def single_spike(data, dt = 0.025):
+def single_spike(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """
     Get the maximum index and value of each EPSP peak
     Return:
@@ -146,10 +193,9 @@ def single_spike(data, dt = 0.025):
         A list of turple.
         Each turple has the index of max EPSP, and value of max EPSP.
     """
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     peak_v = np.amax(stable) - baseline
-    peak_t = (np.argmax(stable) + 6000) * dt
+    peak_t = (np.argmax(stable) + i0) * dt
     return peak_v, peak_t
 
 ######################################
@@ -157,43 +203,46 @@ def single_spike(data, dt = 0.025):
 def get_closest (data, target):
     """Get the index of value in data which is closest to target.
     """
-    t = data.index(min(data, key=lambda x:abs(x-target)))
+    t = int(np.argmin(np.abs(np.asarray(data) - target)))
     return t
 
 ########################################
 ### Function: to measure plateau amplitude
 ########################################
-def meas_platamp(data, dt = 0.025):
+def meas_platamp(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """Measures plateau amplitude (average of voltage - baseline while volt
         trace is above baseline + thresh)"""
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     # above = [val for val in stable if val > (baseline + thresh)]
     spike_num = spike_count(stable)
     if spike_num == 0:
-        platamp = max(stable) - baseline
+        platamp = np.max(stable) - baseline
         platdur = 0
         ISI = 0
     elif spike_num == 1: # Maybe filtering would be better?
         spikegap = 5 # ms to skip after spike
-        idx = data.index(max(data)) + int(spikegap/dt)
+        idx = int(np.argmax(data)) + int(spikegap/dt)
         platamp = data[idx] - baseline
         ISI = 0
     else:
-        ISI, spike_mvalue, spike_midx = IST_spikes(data, dt)
+        ISI, spike_mvalue, spike_midx = IST_spikes(data, dt, baseline_win, start)
         platamp = spike_mvalue[-1] - baseline
     return ISI , platamp
 
 ########################################
 ### Function: to measure plateau amplitude for TTX condition
 ########################################
-def TTX_platamp(data):
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
-    above = [idx for idx, val in enumerate(stable) if val > (baseline+15)]
+def _min_above(dt):
+    """A TTX plateau has to stay more than 0.375 ms (15 samples at 40 kHz)
+    above baseline + 15 mV."""
+    return int(round(0.375 / dt))
+
+def TTX_platamp(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
+    above = np.flatnonzero(stable > (baseline+15))
     # platamp = max(stable) - baseline
-    if len(above) <= 15:
-        platamp = max(stable) - baseline
+    if len(above) <= _min_above(dt):
+        platamp = np.max(stable) - baseline
     else:
         idx1 = above[0]
         idx2 = above[-1]
@@ -206,12 +255,11 @@ def TTX_platamp(data):
 ### Using the time stamp for soma plateau amplitude measurement to determine
 ### the plateau ampltiude in dendrite.
 ########################################
-def soma_platamp_TTX(data):
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
-    above = [idx for idx, val in enumerate(stable) if val > (baseline+15)]
+def soma_platamp_TTX(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
+    above = np.flatnonzero(stable > (baseline+15))
     # platamp = max(stable) - baseline
-    if len(above) <= 15:
+    if len(above) <= _min_above(dt):
         platamp = np.max(stable) - baseline
         idx = np.argmax(stable)
     else:
@@ -219,62 +267,294 @@ def soma_platamp_TTX(data):
         idx2 = above[-1]
         idx = int(0.75*idx2 + 0.25*idx1)
         platamp = stable[idx] - baseline
-    return idx+6000, platamp
-
-def soma_platdur_TTX(data, dt = 0.025):
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
-    idx, amp = soma_platamp_TTX(data)
-    above = [idx for idx, val in enumerate(stable) if val > (baseline+amp/2.0)]
-    platdur = dt * len(above)
+    return idx+i0, platamp
+
+def soma_platdur_TTX(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
+    idx, amp = soma_platamp_TTX(data, dt, baseline_win, start)
+    platdur = dt * int(np.count_nonzero(stable > (baseline+amp/2.0)))
     return platdur
 
-def TTX_dend_plat(data, idx, dt = 0.025):
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+def TTX_dend_plat(data, idx, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     platamp = data[idx] - baseline
     threshold = platamp*0.5
-    above = [val for val in stable if val > (baseline + threshold)]
-    platdur = dt * len(above)
+    platdur = dt * int(np.count_nonzero(stable > (baseline + threshold)))
     return platamp, platdur
 
-def soma_plat(data, dt = 0.025):
+def soma_plat(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """Measures plateau amplitude (average of voltage - baseline while volt
         trace is above baseline + thresh)"""
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     spike_num = spike_count(stable)
     if spike_num == 0:
-        platamp = max(stable) - baseline
+        platamp = np.max(stable) - baseline
         platdur = 0
-        idx = data.index(max(data))
+        idx = int(np.argmax(data))
     elif spike_num == 1: # Maybe filtering would be better?
         spikegap = 5 # ms to skip after spike
-        idx = data.index(max(data)) + int(spikegap/dt)
+        idx = int(np.argmax(data)) + int(spikegap/dt)
         platamp = data[idx] - baseline
     else:
-        ISI, spike_mvalue, spike_midx = IST_spikes(data, dt)
+        ISI, spike_mvalue, spike_midx = IST_spikes(data, dt, baseline_win, start)
         platamp = spike_mvalue[-1] - baseline
         idx = spike_midx[-1]
     return idx, platamp
 
-def dend_plat(data, idx, dt = 0.025):
+def dend_plat(data, idx, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
     """Measures plateau amplitude (average of voltage - baseline while volt
         trace is above baseline + thresh)"""
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     platamp = data[idx] - baseline
     threshold = platamp*0.5
-    above = [val for val in stable if val > (baseline + threshold)]
-    platdur = dt * len(above)
+    platdur = dt * int(np.count_nonzero(stable > (baseline + threshold)))
     return platamp, platdur
 
-def v_curr_inj(data):
-    baseline = np.mean(data[4000:6000])
-    stable = data[6000:]
+def v_curr_inj(data, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    data, baseline, stable, i0 = _baseline_stable(data, dt, baseline_win, start)
     amp = np.max(stable) - baseline
     return amp
 
+########################################
+### Batch versions: the same measurements for a whole sweep at once.
+### traces is an (n_runs x n_samples) array, one run per row; the results
+### are arrays with one entry per run.
+########################################
+def _batch_baseline_stable(traces, dt = 0.025, baseline_win = BASELINE_WIN,
+                           start = START):
+    """Per-run baseline (mean over baseline_win), the traces from start on
+    and the index of start."""
+    traces = np.asarray(traces)
+    if traces.ndim == 1:
+        traces = traces[np.newaxis, :]
+    baseline = np.mean(traces[:, time_index(baseline_win[0], dt):
+                              time_index(baseline_win[1], dt)], axis = 1)
+    i0 = time_index(start, dt)
+    stable = traces[:, i0:]
+    return traces, baseline, stable, i0
+
+def _row_counts(mask):
+    """Number of True values in each row of a 2D mask."""
+    # count_nonzero of a whole row is much faster than counting along an axis
+    return np.array([np.count_nonzero(row) for row in mask], dtype = int)
+
+def _row_nonzero(mask):
+    """Row and column indices of the True values, ordered by row and column."""
+    return np.divmod(np.flatnonzero(mask), mask.shape[1])
+
+def batch_meas_platdur(traces, thresh = 10, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """Plateau duration (ms) of each run, see meas_platdur."""
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    return dt * _row_counts(stable > (baseline + thresh)[:, np.newaxis])
+
+def batch_spike_count(traces, thresh = 0):
+    """Number of spikes of each run, see spike_count."""
+    traces = np.asarray(traces)
+    if traces.ndim == 1:
+        traces = traces[np.newaxis, :]
+    n_runs, n_samples = traces.shape
+    # Crossings in the runs laid end to end; the ones between the last point
+    # of a run and the first point of the next run are dropped.
+    above = (traces >= thresh).ravel()
+    below = (traces < thresh).ravel()
+    up = np.flatnonzero(below[:-1] & above[1:])
+    down = np.flatnonzero(above[:-1] & below[1:])
+    events = np.concatenate((up, down))
+    kinds = np.concatenate((np.ones(len(up), dtype = np.int8),
+                            -np.ones(len(down), dtype = np.int8)))
+    order = np.argsort(events, kind = 'mergesort')
+    events, kinds = events[order], kinds[order]
+    inside = events % n_samples != n_samples - 1
+    events, kinds = events[inside], kinds[inside]
+    rows = events // n_samples
+    # A spike is a downward crossing right after an upward crossing of the
+    # same run.
+    spikes = (kinds[:-1] == 1) & (kinds[1:] == -1) & (rows[:-1] == rows[1:])
+    return np.bincount(rows[1:][spikes], minlength = n_runs)
+
+def batch_get_EPSPs(traces, thresh = 2, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """EPSP peaks of all the runs, see get_EPSPs.
+
+    Return:
+    -----------
+    run, time, value: arrays with one entry per peak (run is the row of
+    the peak in traces), ordered by run and time.
+    """
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    val = stable[:, :-1]
+    peaks = val >= (baseline + thresh)[:, np.newaxis]
+    peaks &= val >= stable[:, 1:]
+    peaks[:, 1:] &= val[:, 1:] > val[:, :-1]
+    # The point before the first one is the last point of the trace
+    peaks[:, 0] &= val[:, 0] > stable[:, -1]
+    run, idx = _row_nonzero(peaks)
+    return run, (idx + i0) * dt, val[run, idx]
+
+def batch_IST_spikes(traces, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """Mean interspike interval and the last minimum between two spikes.
+
+    Return:
+    -----------
+    ISI: mean interspike interval of each run (0 with less than 2 spikes)
+    last_mvalue, last_midx: minimum between the last two spikes and its
+        index (nan and -1 with less than 2 spikes), ie. spike_mvalue[-1]
+        and spike_midx[-1] of IST_spikes.
+    """
+    traces = np.asarray(traces)
+    if traces.ndim == 1:
+        traces = traces[np.newaxis, :]
+    n_runs = len(traces)
+    run, time, value = batch_get_EPSPs(traces, 60, dt, baseline_win, start)
+    count = np.bincount(run, minlength = n_runs)
+    ISI = np.zeros(n_runs)
+    last_mvalue = np.full(n_runs, np.nan)
+    last_midx = np.full(n_runs, -1)
+    multi = np.flatnonzero(count > 1)
+    if len(multi) == 0:
+        return ISI, last_mvalue, last_midx
+    # Intervals between consecutive spikes of the same run
+    same = run[1:] == run[:-1]
+    IST = np.diff(time)[same]
+    ISI[multi] = np.bincount(run[1:][same], weights = IST,
+                             minlength = n_runs)[multi] / (count[multi] - 1)
+    # Window between the last two spikes of each run
+    last = np.cumsum(count)[multi] - 1
+    idx1 = np.round(time[last - 1] / dt).astype(int)
+    idx2 = np.round(time[last] / dt).astype(int)
+    start, stop = idx1.min(), idx2.max()
+    cols = np.arange(start, stop)
+    window = (cols >= idx1[:, np.newaxis]) & (cols < idx2[:, np.newaxis])
+    masked = np.where(window, traces[multi, start:stop], np.inf)
+    last_midx[multi] = np.argmin(masked, axis = 1) + start
+    last_mvalue[multi] = traces[multi, last_midx[multi]]
+    return ISI, last_mvalue, last_midx
+
+def batch_soma_plat(traces, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """Plateau amplitude in soma of each run, see soma_plat and meas_platamp.
+
+    Return:
+    -----------
+    idx: time index of the amplitude measurement, to be handed to
+        batch_dend_plat
+    platamp: plateau amplitude (mV)
+    ISI: mean interspike interval (ms)
+    Runs where the measurement is not defined get idx -1 and platamp nan.
+    """
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    n_runs, n_samples = traces.shape
+    spike_num = batch_spike_count(stable)
+    peak = np.argmax(traces, axis = 1)
+    # 0 spikes: the peak, 1 spike: 5 ms after the spike, more: the last
+    # minimum between two spikes
+    idx = np.where(spike_num == 0, peak, peak + int(5/dt))
+    ISI = np.zeros(n_runs)
+    multi = np.flatnonzero(spike_num > 1)
+    if len(multi):
+        ISI[multi], last_mvalue, idx[multi] = batch_IST_spikes(traces[multi], dt,
+                                                               baseline_win, start)
+    idx[(idx < 0) | (idx >= n_samples)] = -1
+    platamp = traces[np.arange(n_runs), idx] - baseline
+    none = spike_num == 0
+    platamp[none] = np.max(stable[none], axis = 1) - baseline[none]
+    platamp[idx < 0] = np.nan
+    return idx, platamp, ISI
+
+def batch_soma_platamp_TTX(traces, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    """Plateau amplitude in soma of each run under TTX, see soma_platamp_TTX.
+
+    Return:
+    -----------
+    idx: time index of the amplitude measurement
+    platamp: plateau amplitude (mV)
+    """
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    above = stable > (baseline + 15)[:, np.newaxis]
+    first = np.argmax(above, axis = 1)
+    last = stable.shape[1] - 1 - np.argmax(above[:, ::-1], axis = 1)
+    idx = np.where(_row_counts(above) <= _min_above(dt),
+                   np.argmax(stable, axis = 1),
+                   (0.75*last + 0.25*first).astype(int))
+    platamp = stable[np.arange(len(traces)), idx] - baseline
+    return idx + i0, platamp
+
+def batch_soma_platdur_TTX(traces, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """Plateau duration in soma of each run under TTX, see soma_platdur_TTX."""
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    idx, amp = batch_soma_platamp_TTX(traces, dt, baseline_win, start)
+    return dt * _row_counts(stable > (baseline + amp/2.0)[:, np.newaxis])
+
+def batch_dend_plat(traces, idx, dt = 0.025,
+        baseline_win = BASELINE_WIN, start = START):
+    """Plateau amplitude and duration in the dendrite, see dend_plat.
+
+    idx has one time index per run (eg. from batch_soma_plat); runs with
+    idx -1 get nan.
+    """
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    idx = np.asarray(idx)
+    platamp = traces[np.arange(len(traces)), idx] - baseline
+    platamp[idx < 0] = np.nan
+    threshold = platamp*0.5
+    platdur = dt * _row_counts(stable > (baseline + threshold)[:, np.newaxis])
+    platdur[idx < 0] = np.nan
+    return platamp, platdur
+
+batch_TTX_dend_plat = batch_dend_plat
+
+def batch_single_spike(traces, dt = 0.025, baseline_win = BASELINE_WIN, start = START):
+    """Peak amplitude (from baseline) and peak time (ms) of each run (or of
+    each recording site of one run), see single_spike."""
+    traces, baseline, stable, i0 = _batch_baseline_stable(traces, dt, baseline_win, start)
+    peak = np.argmax(stable, axis = 1)
+    peak_v = stable[np.arange(len(stable)), peak] - baseline
+    return peak_v, (peak + i0) * dt
+
+def batch_features(soma, dend = None, TTX = False, dt = 0.025,
+                   baseline_win = BASELINE_WIN, start = START):
+    """All the features of a sweep in columns.
+
+    Parameters:
+    -----------
+    soma: (n_runs x n_samples) somatic voltage traces
+    dend: (n_runs x n_samples) voltage traces at the input site (optional);
+        the dendritic plateau is measured at the time index of the somatic one
+    TTX: bool
+        Use the TTX measurements (no spikes)
+    dt: the sampling interval (ms)
+    baseline_win, start: the analysis windows (ms), see BASELINE_WIN and START
+
+    Return:
+    -----------
+    features: dict of arrays with one entry per run
+        'spike_num', 'ISI', 'soma_idx', 'soma_platamp', 'soma_platdur'
+        and 'dend_platamp', 'dend_platdur' if dend is given. soma_platdur is
+        meas_platdur (soma_platdur_TTX with TTX).
+    """
+    soma = np.asarray(soma)
+    if soma.ndim == 1:
+        soma = soma[np.newaxis, :]
+    features = {}
+    if TTX:
+        features['spike_num'] = np.zeros(len(soma), dtype = int)
+        features['ISI'] = np.zeros(len(soma))
+        idx, platamp = batch_soma_platamp_TTX(soma, dt, baseline_win, start)
+        features['soma_platdur'] = batch_soma_platdur_TTX(soma, dt, baseline_win, start)
+    else:
+        features['spike_num'] = batch_spike_count(soma)
+        idx, platamp, features['ISI'] = batch_soma_plat(soma, dt, baseline_win, start)
+        features['soma_platdur'] = batch_meas_platdur(soma, 10, dt, baseline_win, start)
+    features['soma_idx'] = idx
+    features['soma_platamp'] = platamp
+    if dend is not None:
+        features['dend_platamp'], features['dend_platdur'] = \
+            batch_dend_plat(dend, idx, dt, baseline_win, start)
+    return features
+
 #######################################
 # Color
 #######################################
@@ -0,0 +1,108 @@
+"""
+Benchmark of the start-up time of the simulation entry points.
+
+Every worker process of a sweep (simworker, jobqueue, the pools of the
+simulation files) starts by importing a simulation file, so its import
+time is paid once per process. The simulation files import only NEURON,
+numpy and the cell; matplotlib, pandas, seaborn and h5py are loaded by the
+functions that use them (see utils.LazyModule).
+
+Each module is imported in a fresh interpreter, n times, and the median
+import time is printed with the heavy packages it loaded:
+
+    python bench_startup.py [-n 5] [--save bench_startup.json] [--check] [module ...]
+
+Run it from the folder with the compiled mechanisms. --save appends the
+timings to a json history, --check exits with 1 if a module fails to import
+or a simulation entry point loads a heavy package.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+
+# Simulation entry points: NEURON, numpy and the cell only
+ENTRY_POINTS = ['CA229', 'Fig2_bAP_exp', 'Fig3_exp_dms', 'Fig3_exp_major',
+                'Fig5_exp_DMS', 'Fig5_exp_major', 'simworker', 'jobqueue']
+# References: the floor of the entry points, and the analysis side
+REFERENCES = ['numpy', 'neuron', 'analysis_utils', 'utils', 'sweepstore']
+HEAVY = ['matplotlib', 'pandas', 'seaborn', 'h5py', 'scipy', 'neuron.gui']
+
+CHILD = """import sys, time, json
+start_time = time.time()
+import %s
+runtime = time.time() - start_time
+print(json.dumps([runtime, [name for name in %r if name in sys.modules]]))"""
+
+######################################################
+
+def import_time(module, repeat = 5):
+    """Median import time (s) of module in a fresh interpreter, and the
+    heavy packages it loads."""
+    times = []
+    for i in range(repeat):
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output([sys.executable, '-c', CHILD % (module, HEAVY)],
+                                             stderr = devnull)
+        # NEURON prints its banner on stdout: the result is the last line
+        runtime, heavy = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(runtime)
+    return float(np.median(times)), heavy
+
+def bench(modules, repeat = 5):
+    """Import times of modules: {module: {'runtime', 'heavy'}}, or
+    {'failed': True} for a module that cannot be imported."""
+    results = {}
+    print("%-16s %10s  %s" % ('module', 'import (s)', 'heavy packages'))
+    for module in modules:
+        try:
+            runtime, heavy = import_time(module, repeat)
+        except subprocess.CalledProcessError:
+            results[module] = {'failed': True}
+            print("%-16s %10s" % (module, 'failed'))
+            continue
+        results[module] = {'runtime': runtime, 'heavy': heavy}
+        print("%-16s %10.3f  %s" % (module, runtime, ', '.join(heavy)))
+    return results
+
+def save(results, path):
+    """Append the timings to the json history at path."""
+    history = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            history = json.load(f)
+    history.append({'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'python': sys.version.split()[0], 'results': results})
+    with open(path, 'w') as f:
+        json.dump(history, f, indent = 1)
+
+######################################################
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    repeat = 5
+    path = None
+    if '-n' in argv:
+        repeat = int(argv.pop(argv.index('-n') + 1))
+        argv.remove('-n')
+    if '--save' in argv:
+        path = argv.pop(argv.index('--save') + 1)
+        argv.remove('--save')
+    check = '--check' in argv
+    modules = [arg for arg in argv if not arg.startswith('--')] or ENTRY_POINTS + REFERENCES
+
+    results = bench(modules, repeat)
+    if path:
+        save(results, path)
+    failed = [module for module in modules if results[module].get('failed')]
+    slow = [module for module in ENTRY_POINTS if results.get(module, {}).get('heavy')]
+    if failed:
+        print("Modules failing to import: %s" % ', '.join(failed))
+    if slow:
+        print("Entry points loading heavy packages: %s" % ', '.join(slow))
+    if check and (failed or slow):
+        sys.exit(1)
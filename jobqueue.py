@@ -0,0 +1,474 @@
+"""
+Sweep queue on a shared file system.
+
+The grid points of a sweep are written as job files into a queue directory;
+any number of worker processes, on any node that sees the directory, claim
+and run them. There is no central service: every state change is an atomic
+rename between the state directories
+
+    <queue>/pending/<id>.json           waiting to be run
+    <queue>/claimed/<id>@<claim>.json   being run (the file's mtime is the
+                                        heartbeat)
+    <queue>/done/<id>.json              finished
+    <queue>/failed/<id>.json            failed max_attempts times
+
+and only one worker wins the rename of a pending job. The claimed file is
+named after the claim (a token unique to the worker and the attempt), so a
+worker only ever touches, completes or fails its own claim. A worker
+touches its claimed job every few seconds while it runs, from a separate
+process (h.run() holds the GIL for the whole simulation, so a thread would
+not beat); a claimed job whose heartbeat is older than the lease (the
+worker died, or its node went down) is put back to pending by the next
+worker looking for work. The late worker finds its claim gone: its
+heartbeat stops, its writes to the sweep store and the ledger fail (the
+claim is checked before each of them) and its result is dropped. The lease
+has to be a few heartbeat intervals (lease / 5) longer than the longest
+stall of a worker (eg. a paused job or an overloaded node), not longer than
+a simulation. Failed jobs are retried until max_attempts.
+
+Submit the grid from a simulation file and start workers:
+
+    python Fig5_exp_major.py --submit queue/Fig5_major
+    python jobqueue.py work queue/Fig5_major      # on each node, as many as wanted
+    python jobqueue.py status queue/Fig5_major
+
+A job is a dict: a function of a simulation file and its arguments
+{'script': 'Fig5_exp_major', 'func': 'Glu_Stim', 'args': [...],
+'kwargs': {...}, 'store': 'Fig5/Major/sweep.h5', 'ledger': ...} (the run
+is appended to the sweep store and marked in the ledger if they are given),
+or a command line {'command': [...]}, eg. one NetPyNE batch simulation.
+
+Only the queue itself is safe on any shared file system. The outputs of
+the jobs are not: every run is registered in runs.db and marked in the
+ledger (SQLite), and appended to the sweep store (HDF5 under an fcntl
+lock), and all of them rely on file locks. Keep them on a file system with
+working POSIX locks across the nodes (eg. NFSv4, or NFSv3 with lockd,
+Lustre mounted with flock), or on a local disk with all the workers on that
+node. The workers warn about stores on a network file system (see
+check_locks).
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import importlib
+import subprocess
+import traceback
+import multiprocessing
+
+STATES = ['pending', 'claimed', 'done', 'failed']
+
+######################################################
+
+class JobQueue:
+    """
+    Directory-backed job queue with leases, heartbeats and retries.
+
+    Parameters:
+    -----------
+    path: string
+        The queue directory (on a file system shared by the workers)
+    lease: float
+        Seconds without a heartbeat after which a claimed job is given to
+        another worker
+    max_attempts: int
+        Number of times a job is run before it is moved to failed
+    """
+
+    def __init__(self, path, lease = 300, max_attempts = 3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for state in STATES + ['tmp']:
+            directory = os.path.join(path, state)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Made by another worker at the same time
+                    pass
+
+    #############
+    def submit(self, job):
+        """Add a job (dict) to the queue.
+
+        The job id is a hash of the job, so submitting the same grid point
+        again (eg. after a restart of the submitting script) does nothing.
+
+        Return:
+        -----------
+        job_id: string
+        """
+        job_id = job_hash(job)
+        if self._find(job_id):
+            return job_id
+        record = {'id': job_id, 'job': job, 'attempts': 0, 'errors': [],
+                  'submitted': time.time()}
+        self._write(record, 'pending')
+        return job_id
+
+    def claim(self, worker = None):
+        """Claim the next pending job (after reclaiming expired leases).
+
+        Return:
+        -----------
+        record: dict with the job ('job'), its id and attempts, or None if
+            there is no pending job.
+        """
+        self.reclaim()
+        worker = worker or worker_id()
+        for name in sorted(os.listdir(os.path.join(self.path, 'pending'))):
+            claim = "%s-%s" % (re.sub(r'[^A-Za-z0-9]+', '-', worker), uuid.uuid4().hex[:8])
+            source = os.path.join(self.path, 'pending', name)
+            target = os.path.join(self.path, 'claimed', "%s@%s.json" % (name[:-len('.json')], claim))
+            try:
+                os.rename(source, target)
+                # The rename keeps the mtime of the pending file: the first beat
+                os.utime(target, None)
+            except OSError:
+                # Claimed by another worker first
+                continue
+            record = self._read(target)
+            record['worker'] = worker
+            record['claim'] = claim
+            record['claimed'] = time.time()
+            # Rewriting the file also starts its heartbeat
+            self._write(record, 'claimed')
+            return record
+        return None
+
+    def heartbeat(self, record):
+        """Extend the lease of a claimed job; False if the claim was lost
+        (the job was reclaimed and may run on another worker)."""
+        try:
+            os.utime(self._file(record, 'claimed'), None)
+            return True
+        except OSError:
+            return False
+
+    def complete(self, record, result = None):
+        """Mark a claimed job as done; False (and nothing done) if the claim
+        was lost."""
+        if not self._release(record):
+            return False
+        record['result'] = result
+        record['finished'] = time.time()
+        self._write(record, 'done')
+        return True
+
+    def fail(self, record, error):
+        """Put a claimed job back to pending, or to failed after max_attempts;
+        False (and nothing done) if the claim was lost."""
+        if not self._release(record):
+            return False
+        self._retry(record, error)
+        return True
+
+    def reclaim(self):
+        """Put the claimed jobs whose lease expired back to pending."""
+        claimed = os.path.join(self.path, 'claimed')
+        now = time.time()
+        for name in os.listdir(claimed):
+            path = os.path.join(claimed, name)
+            try:
+                if now - os.path.getmtime(path) < self.lease:
+                    continue
+                # Only one worker wins the rename, the others skip the job
+                moving = os.path.join(self.path, 'tmp', 'reclaim-' + worker_id() + '-' + name)
+                os.rename(path, moving)
+            except OSError:
+                continue
+            record = self._read(moving)
+            record.pop('claim', None)
+            self._retry(record, "Lease expired (worker %s)" % record.get('worker'))
+            os.remove(moving)
+
+    def requeue_failed(self):
+        """Give the failed jobs max_attempts new attempts."""
+        count = 0
+        for name in os.listdir(os.path.join(self.path, 'failed')):
+            record = self._read(os.path.join(self.path, 'failed', name))
+            record['attempts'] = 0
+            self._write(record, 'pending')
+            self._remove(record, 'failed')
+            count += 1
+        return count
+
+    def counts(self):
+        """Number of jobs in each state."""
+        return dict((state, len(os.listdir(os.path.join(self.path, state))))
+                    for state in STATES)
+
+    #############
+    def _retry(self, record, error):
+        record['attempts'] = record.get('attempts', 0) + 1
+        record['errors'] = record.get('errors', []) + [error]
+        state = 'pending' if record['attempts'] < self.max_attempts else 'failed'
+        self._write(record, state)
+
+    def _release(self, record):
+        """Take a claimed job off claimed/, if the claim is still ours."""
+        released = os.path.join(self.path, 'tmp', 'release-' + record['claim'] + '.json')
+        try:
+            # Atomic: fails if the job was reclaimed in the meantime
+            os.rename(self._file(record, 'claimed'), released)
+        except OSError:
+            return False
+        os.remove(released)
+        return True
+
+    def _find(self, job_id):
+        """The state of a job, or None if it is not in the queue."""
+        for state in ['pending', 'done', 'failed']:
+            if os.path.exists(os.path.join(self.path, state, job_id + '.json')):
+                return state
+        # Only the claimed jobs (one per worker) are listed
+        claimed = os.listdir(os.path.join(self.path, 'claimed'))
+        if any(name.startswith(job_id + '@') for name in claimed):
+            return 'claimed'
+        return None
+
+    def _file(self, record, state):
+        if state == 'claimed':
+            return os.path.join(self.path, state, "%s@%s.json" % (record['id'], record['claim']))
+        return os.path.join(self.path, state, record['id'] + '.json')
+
+    def _read(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, record, state):
+        """Write a job file atomically (readers never see a partial file)."""
+        tmp = os.path.join(self.path, 'tmp', "%s-%s.json" % (record['id'], uuid.uuid4().hex))
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.rename(tmp, self._file(record, state))
+
+    def _remove(self, record, state):
+        try:
+            os.remove(self._file(record, state))
+        except OSError:
+            pass
+
+######################################################
+
+class Heartbeat:
+    """Touch a claimed job every interval seconds while it runs.
+
+    The beats come from a separate process, so they go on while the job
+    holds the GIL (h.run()). They stop when the claim is lost (lost is
+    True): the job has been given to another worker, and the result of
+    this one is dropped.
+    """
+
+    def __init__(self, queue, record, interval = None):
+        self.interval = interval or max(queue.lease / 5.0, 1)
+        self.stopped = multiprocessing.Event()
+        self.process = multiprocessing.Process(target = _beat,
+            args = (queue._file(record, 'claimed'), self.interval, self.stopped))
+        self.process.daemon = True
+
+    @property
+    def lost(self):
+        return self.process.exitcode == 1
+
+    def __enter__(self):
+        self.process.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.process.join()
+
+def _beat(path, interval, stopped):
+    """Heartbeat process: touch path until stopped, exit 1 if it is gone."""
+    while not stopped.wait(interval):
+        try:
+            os.utime(path, None)
+        except OSError:
+            sys.exit(1)
+
+class LostClaim(Exception):
+    """The claim of a running job was lost (see JobQueue.reclaim)."""
+    pass
+
+class Claimed(object):
+    """A sweep store or ledger of a queued job: its writes (methods) first
+    check that the job is still claimed, and extend its lease."""
+
+    def __init__(self, target, claimed, methods = ('append', 'mark')):
+        self.target = target
+        self.claimed = claimed
+        self.methods = methods
+
+    def __getattr__(self, name):
+        value = getattr(self.target, name)
+        if name not in self.methods:
+            return value
+        def write(*args, **kwargs):
+            if not self.claimed():
+                raise LostClaim("The claim of the job was lost, %s.%s not done"
+                                % (type(self.target).__name__, name))
+            return value(*args, **kwargs)
+        return write
+
+def work(queue, run = None, worker = None, poll = 10, verbose = True):
+    """Claim and run jobs until the queue is drained.
+
+    Parameters:
+    -----------
+    queue: JobQueue
+    run: function
+        run(job, claimed) runs one job (dict) and returns a json-able result
+        (default: run_job); claimed() is False once the claim is lost
+    worker: string
+        Name of the worker in the job files (default: host:pid)
+    poll: float
+        Seconds to wait while other workers still hold claimed jobs
+        (they may fail, or their lease may expire)
+
+    Return:
+    -----------
+    n_jobs: int
+        The number of jobs this worker completed.
+    """
+    run = run or run_job
+    worker = worker or worker_id()
+    n_jobs = 0
+    while True:
+        record = queue.claim(worker)
+        if record is None:
+            if queue.counts()['claimed'] == 0:
+                return n_jobs
+            time.sleep(poll)
+            continue
+        start_time = time.time()
+        try:
+            with Heartbeat(queue, record):
+                result = run(record['job'], lambda: queue.heartbeat(record))
+        except Exception:
+            if queue.fail(record, traceback.format_exc()):
+                if verbose:
+                    print("Job %s failed (attempt %d)" % (record['id'], record['attempts'] + 1))
+            elif verbose:
+                print("Job %s lost its lease, run dropped" % record['id'])
+            continue
+        if not queue.complete(record, result):
+            if verbose:
+                print("Job %s lost its lease, result dropped" % record['id'])
+            continue
+        n_jobs += 1
+        if verbose:
+            print("Job %s done in %.1f s" % (record['id'], time.time() - start_time))
+
+def run_job(job, claimed = None):
+    """Run one job: a function of a simulation file, or a command line.
+
+    With claimed (see work), the run is only appended to the sweep store and
+    marked in the ledger while the job is still claimed.
+    """
+    start_time = time.time()
+    if 'command' in job:
+        subprocess.check_call(job['command'], cwd = job.get('cwd'))
+    else:
+        check_locks([job.get('store'), job.get('ledger'), 'runs.db'])
+        module = importlib.import_module(job['script'])
+        kwargs = dict(job.get('kwargs', {}))
+        if job.get('store'):
+            import sweepstore as ss
+            kwargs['store'] = ss.SweepStore(job['store'])
+        if job.get('ledger'):
+            import ledger as lg
+            kwargs['ledger'] = lg.Ledger(job['ledger'])
+        if claimed is not None:
+            for name in ['store', 'ledger']:
+                if name in kwargs:
+                    kwargs[name] = Claimed(kwargs[name], claimed)
+        getattr(module, job['func'])(*job.get('args', []), **kwargs)
+    return {'runtime': time.time() - start_time}
+
+def submit_grid(path, script, func, jobs, **job):
+    """Put the grid points of a simulation file in the queue at path.
+
+    Parameters:
+    -----------
+    path: string
+        The queue directory
+    script, func: string
+        The simulation file and its function, eg. 'Fig5_exp_DMS', 'Glu_Stim'
+    jobs: iterable of argument tuples, one per grid point
+    job: other fields of every job, eg. kwargs = {'save': True},
+        store = 'Fig5/DMS/sweep.h5'
+
+    Return:
+    -----------
+    queue: JobQueue
+    """
+    queue = JobQueue(path)
+    for args in jobs:
+        spec = dict(job, script = script, func = func, args = list(args))
+        queue.submit(spec)
+    return queue
+
+######################################################
+# Helpers
+######################################################
+
+def job_hash(job):
+    """Id of a job: hash of its canonical json."""
+    return hashlib.sha1(json.dumps(job, sort_keys = True).encode()).hexdigest()[:20]
+
+def worker_id():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+# File systems whose locks are not reliable across nodes in general
+NETWORK_FS = ['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'fuse.sshfs', 'glusterfs', 'ceph']
+_checked = set()
+
+def check_locks(paths):
+    """Warn (once per path) about the stores of the jobs on a network file
+    system, where SQLite and HDF5 need working cross-node locks."""
+    for path in paths:
+        if not path or path in _checked:
+            continue
+        _checked.add(path)
+        fstype = filesystem(path)
+        if fstype in NETWORK_FS:
+            print("Warning: %s is on %s; the run index, ledger and sweep store need "
+                  "working file locks across the nodes (see jobqueue.py)" % (path, fstype))
+
+def filesystem(path):
+    """The file system type of path (from /proc/mounts), or None."""
+    path = os.path.realpath(os.path.dirname(os.path.abspath(path)))
+    try:
+        with open('/proc/mounts', 'r') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except IOError:
+        return None
+    best, fstype = '', None
+    for mount, kind in mounts:
+        mount = mount.replace('\\040', ' ')
+        if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) > len(best):
+            best, fstype = mount, kind
+    return fstype
+
+######################################################
+if __name__ == "__main__":
+    # python jobqueue.py work|status|requeue-failed <queue directory>
+    command, path = sys.argv[1], sys.argv[2]
+    queue = JobQueue(path)
+    if command == 'work':
+        start_time = time.time()
+        n_jobs = work(queue)
+        print("%d jobs done by %s" % (n_jobs, worker_id()))
+        print("--- %s seconds ---" % (time.time() - start_time))
+    elif command == 'requeue-failed':
+        print("%d failed jobs back in the queue" % queue.requeue_failed())
+    print(queue.counts())
@@ -55,6 +55,7 @@ cfg.saveFolder = 'batch_data'
 cfg.savePickle = False
 cfg.saveJson = True
 cfg.saveDataInclude = ['simData', 'simConfig', 'netParams', 'net']
+cfg.saveProfile = 'full' # 'traces' or 'features': only those, as .npz, and no plots (../slim.py)
 
 
 ###############################################################################
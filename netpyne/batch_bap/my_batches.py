@@ -12,14 +12,23 @@ from cfg import cfg
 from inspect import getsourcefile
 import sys
 
-try: 
+# Batches run with batch_utils (found in the eee/sim file tree) on the
+# cluster, or locally with ../local_batch.py without it (or with --local)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import local_batch
+import slim
+
+try:
 	import batch_utils
-except:
+except ImportError:
 	curpath = os.getcwd()
-	while os.path.split(curpath)[1] != "sim":
+	while os.path.split(curpath)[1] not in ("sim", ""):
 		curpath = os.path.split(curpath)[0]
 	sys.path.append(curpath)
-	import batch_utils
+	try:
+		import batch_utils
+	except ImportError:
+		batch_utils = None
 	
 batchoutputdir = "batch_data"
 if not os.path.exists(batchoutputdir):
@@ -71,10 +80,16 @@ if __name__ == '__main__':
 	import time
 	start = time.time()
 
-	# Run all batches
+	# Run all batches (local: -n N for at most N simulations at a time,
+	# --slim traces|features for the slim output, see ../slim.py, --pooled
+	# for one simulation per batch, see ../cellsweep.py)
 	for label, batch in batches.items():
 		print("Running batch with label: " + label)
-		batch_utils.run_batch(**batch)
+		if batch_utils is not None and "--local" not in sys.argv:
+			batch_utils.run_batch(**batch)
+		else:
+			local_batch.run_batch(processes = local_batch.processes_arg(),
+				profile = slim.profile_arg(), pooled = local_batch.pooled_arg(), **batch)
 
 	stop = time.time()
 	print
@@ -13,21 +13,21 @@ import numpy as np
 from neuron import h
 import sys
 
-# Find path to cells directory
+# Cached cell imports and array scaling (../cellparams.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cellparams as cp
+
+# Find path to cells directory (only needed by the reduced cell models
+# below); outside the eee/sim file tree, look next to the batch folder
 curpath = os.getcwd()
 while os.path.split(curpath)[1] != "sim":
     oldpath = curpath
     curpath = os.path.split(curpath)[0]
     if oldpath == curpath:
-        raise Exception("Couldn't find cells directory. Try running from within eee/sim file tree.")
+        curpath = os.path.dirname(os.getcwd())
+        break
 cellpath = os.path.join(curpath, "cells")
 
-try:
-    import batch_utils
-except:
-    sys.path.append(curpath)
-    import batch_utils
-
 try:
     from __main__ import cfg  # import SimConfig object with params from parent module
 except:
@@ -59,7 +59,7 @@ netParams.defaultThreshold = -20.0
 #cellRule = netParams.importCellParams(label='eee7', conds={'cellType': 'eee7', 'cellModel': 'HH_reduced'}, fileName=os.path.join(cellpath, 'eee7.py'), cellName='eee7')
 
 # Detailed EEE cell model
-cellRule = netParams.importCellParams(label='eeeD', conds={'cellType': 'eeeD', 'cellModel': 'PFC_full'}, fileName='CA229.py', cellName='MakeCA229')
+cellRule = cp.import_cell_params(netParams, label='eeeD', conds={'cellType': 'eeeD', 'cellModel': 'PFC_full'}, fileName='CA229.py', cellName='MakeCA229')
 
 # define section lists
 cellRule['secLists']['alldend'] = ['Bdend1', 'Bdend2', 'Adend1', 'Adend2', 'Adend3']
@@ -68,91 +68,46 @@ cellRule['secLists']['basaldend'] = ['Bdend1', 'Bdend2']
 cellRule['secLists']['stimheads'] = []
 cellRule['secLists']['stimnecks'] = []
 
-# apply values to parameters
-for cell_label, cell_params in netParams.cellParams.iteritems():
-
-    for secName,sec in cell_params['secs'].iteritems(): 
-        print(secName)
-        #sec['vinit'] = -80.0  # set vinit for all secs
-    
-        if hasattr(cfg, 'allNaScale') or hasattr(cfg, 'dendNaScale'):
-            if 'na' in sec['mechs']:
-                orig_na = sec['mechs']['na']['gbar']
-                if hasattr(cfg, 'dendNaScale') and ("basal" in secName or "apical" in secName):
-                    sec['mechs']['na']['gbar'] = list(np.array(orig_na, ndmin=1) * cfg.dendNaScale) 
-                    print("Scaling gbar Na in %s by %s" % (secName, str(cfg.dendNaScale)))
-                if hasattr(cfg, 'allNaScale'):
-                    sec['mechs']['na']['gbar'] = list(np.array(orig_na, ndmin=1) * cfg.allNaScale)
-                    print("Scaling Na in %s by %s" % (secName, str(cfg.allNaScale)))
-        
-        if hasattr(cfg, 'allKScale') or hasattr(cfg, 'dendKScale'):
-            
-            if 'kv' in sec['mechs']:
-                orig_kv = sec['mechs']['kv']['gbar']
-                if hasattr(cfg, 'dendKScale') and ("basal" in secName or "apical" in secName):
-                    sec['mechs']['kv']['gbar'] = list(np.array(orig_kv, ndmin=1) * cfg.dendKScale)
-                    print("Scaling gbar kv in %s by %s" % (secName, str(cfg.dendKScale)))
-                if hasattr(cfg, 'allKScale'):
-                    sec['mechs']['kv']['gbar'] = list(np.array(orig_kv, ndmin=1) * cfg.allKScale)
-                    print("Scaling gbar kv in %s by %s" % (secName, str(cfg.allKScale)))
-
-            if 'kap' in sec['mechs']:
-                orig_kap = sec['mechs']['kap']['gkabar']
-                if hasattr(cfg, 'dendKScale') and ("basal" in secName or "apical" in secName):
-                    sec['mechs']['kap']['gkabar'] = list(np.array(orig_kap, ndmin=1) * cfg.dendKScale)
-                    print("Scaling gkabar kap in %s by %s" % (secName, str(cfg.dendKScale)))
-                if hasattr(cfg, 'allKScale'):
-                    sec['mechs']['kap']['gkabar'] = list(np.array(orig_kap, ndmin=1) * cfg.allKScale)
-                    print("Scaling gbar kap in %s by %s" % (secName, str(cfg.allKScale)))
-
-            if 'kad' in sec['mechs']:
-                orig_kad = sec['mechs']['kad']['gkabar']
-                if hasattr(cfg, 'dendKScale') and ("basal" in secName or "apical" in secName):
-                    sec['mechs']['kad']['gkabar'] = list(np.array(orig_kad, ndmin=1) * cfg.dendKScale)
-                    print("Scaling gkabar kad in %s by %s" % (secName, str(cfg.dendKScale)))
-                if hasattr(cfg, 'allKScale'):
-                    sec['mechs']['kad']['gkabar'] = list(np.array(orig_kad, ndmin=1) * cfg.allKScale)
-                    print("Scaling gbar kad in %s by %s" % (secName, str(cfg.allKScale)))
-
-            if 'kBK' in sec['mechs']:
-                orig_kBK = sec['mechs']['kBK']['gpeak']
-                if hasattr(cfg, 'dendKScale') and ("basal" in secName or "apical" in secName):
-                    sec['mechs']['kBK']['gpeak'] = list(np.array(orig_kBK, ndmin=1) * cfg.dendKScale)
-                    print("Scaling gpeak kBK in %s by %s" % (secName, str(cfg.dendKScale)))
-                if hasattr(cfg, 'allKScale'):
-                    sec['mechs']['kBK']['gpeak'] = list(np.array(orig_kBK, ndmin=1) * cfg.allKScale)
-                    print("Scaling gpeak kBK in %s by %s" % (secName, str(cfg.allKScale)))
-            
-
-        if hasattr(cfg, 'ihScale'):
-            if 'ih' in sec['mechs']:
-                sec['mechs']['ih']['gbar'] = cfg.ihScale * sec['mechs']['ih']['gbar']
-
-        if hasattr(cfg, 'RmScale'):
-            if "neck" not in secName and "head" not in secName:
-                sec['mechs']['pas']['g'] = (1.0/cfg.RmScale) * sec['mechs']['pas']['g']
-
-        if hasattr(cfg, 'e_pas'):
-            if 'pas' in sec['mechs']:
-                sec['mechs']['pas']['e'] = cfg.e_pas
-
-        if "soma" in secName:
-            if hasattr(cfg, 'gpasSomaScale'):
-                orig_gpas = sec['mechs']['pas']['g']
-                sec['mechs']['pas']['g'] = cfg.gpasSomaScale * orig_gpas
-
-        if hasattr(cfg, 'dendRaScale'):
-            if "dend" in secName:
-                orig_ra = sec['geom']['Ra']
-                sec['geom']['Ra'] = cfg.dendRaScale * sec['geom']['Ra']
-
-        if hasattr(cfg, 'dendRmScale'):
-            if "dend" in secName:
-                orig_gpas = sec['mechs']['pas']['g']
-                sec['mechs']['pas']['g'] = (1/cfg.dendRmScale) * orig_gpas
-                
-
-
+# apply values to parameters (one array operation per parameter over all
+# the sections, see ../cellparams.py)
+for cell_label, cell_params in netParams.cellParams.items():
+    secs = cp.section_names(cell_params)
+    dend = cp.section_mask(secs, include = ["basal", "apical"])
+
+    if hasattr(cfg, 'allNaScale') or hasattr(cfg, 'dendNaScale'):
+        factors = cp.scale_factors(dend, getattr(cfg, 'dendNaScale', None), getattr(cfg, 'allNaScale', None))
+        cp.scale_param(cell_params, ('mechs', 'na', 'gbar'), factors)
+        print("Scaling gbar Na in %s by %s" % (cell_label, str(sorted(set(factors.tolist())))))
+
+    if hasattr(cfg, 'allKScale') or hasattr(cfg, 'dendKScale'):
+        factors = cp.scale_factors(dend, getattr(cfg, 'dendKScale', None), getattr(cfg, 'allKScale', None))
+        for path in [('mechs', 'kv', 'gbar'), ('mechs', 'kap', 'gkabar'),
+                     ('mechs', 'kad', 'gkabar'), ('mechs', 'kBK', 'gpeak')]:
+            cp.scale_param(cell_params, path, factors)
+        print("Scaling gbar K in %s by %s" % (cell_label, str(sorted(set(factors.tolist())))))
+
+    if hasattr(cfg, 'ihScale'):
+        cp.scale_param(cell_params, ('mechs', 'ih', 'gbar'), np.full(len(secs), cfg.ihScale))
+
+    if hasattr(cfg, 'RmScale'):
+        # not in the spines
+        spineless = cp.section_mask(secs, exclude = ["neck", "head"])
+        cp.scale_param(cell_params, ('mechs', 'pas', 'g'), np.where(spineless, 1.0/cfg.RmScale, 1.0))
+
+    if hasattr(cfg, 'e_pas'):
+        cp.set_param(cell_params, ('mechs', 'pas', 'e'), cfg.e_pas)
+
+    if hasattr(cfg, 'gpasSomaScale'):
+        soma = cp.section_mask(secs, include = ["soma"])
+        cp.scale_param(cell_params, ('mechs', 'pas', 'g'), np.where(soma, cfg.gpasSomaScale, 1.0))
+
+    if hasattr(cfg, 'dendRaScale'):
+        cp.scale_param(cell_params, ('geom', 'Ra'),
+                       np.where(cp.section_mask(secs, include = ["dend"]), cfg.dendRaScale, 1.0))
+
+    if hasattr(cfg, 'dendRmScale'):
+        cp.scale_param(cell_params, ('mechs', 'pas', 'g'),
+                       np.where(cp.section_mask(secs, include = ["dend"]), 1.0/cfg.dendRmScale, 1.0))
 
 ###############################################################################
 # Population parameters
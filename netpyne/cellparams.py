@@ -0,0 +1,162 @@
+"""
+cellparams.py
+Cached cell imports and array scaling of the cell parameters for the EEE batches
+contact: penggao.1987@gmail.com
+
+netParams.importCellParams builds the whole cell in NEURON (CA229.py,
+CA229simp.py) to read its sections, and every batch job used to do it
+again. import_cell_params does it once: the imported cellParams are pickled
+in cell_cache/ under a hash of the cell file, the cell function, the rule
+label and conditions, the mod files and the NetPyNE version, and later jobs
+load them from there. Delete cell_cache/ to force a new import.
+
+The cfg scaling factors are applied with scale_param: the values of one
+mechanism parameter in all the sections are gathered into one array,
+multiplied by one factor per section and written back, eg.
+
+    secs = section_names(cellRule)
+    dend = section_mask(secs, include = ['basal', 'apical'])
+    scale_param(cellRule, ('mechs', 'na', 'gbar'),
+                scale_factors(dend, getattr(cfg, 'dendNaScale', None),
+                              getattr(cfg, 'allNaScale', None)))
+"""
+
+import os
+import glob
+import json
+import pickle
+import hashlib
+import numpy as np
+
+CACHE_DIR = 'cell_cache'
+
+###############################################################################
+# Cached import
+###############################################################################
+
+def import_cell_params(netParams, label, conds, fileName, cellName,
+                       cacheDir = CACHE_DIR, **kwargs):
+    """netParams.importCellParams, loaded from the cache when the cell has
+    been imported before (same arguments and sources).
+
+    Return:
+    -----------
+    cellRule: the cell rule in netParams.cellParams[label]
+    """
+    key = source_hash(fileName, cellName, label, conds, kwargs)
+    path = os.path.join(cacheDir, "%s_%s.pkl" % (label, key[:16]))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            netParams.addCellParams(label, pickle.load(f))
+        return netParams.cellParams[label]
+
+    cellRule = netParams.importCellParams(label = label, conds = conds,
+                                          fileName = fileName, cellName = cellName,
+                                          **kwargs)
+    params = cellRule.todict() if hasattr(cellRule, 'todict') else dict(cellRule)
+    if not os.path.exists(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            # Made by another job at the same time
+            pass
+    # Written under a temporary name: jobs running at the same time never
+    # read a partial file
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(params, f, 2)
+    os.rename(tmp, path)
+    return cellRule
+
+def source_hash(fileName, cellName, label, conds, kwargs = None):
+    """SHA-1 of everything the imported cell parameters depend on."""
+    sha = hashlib.sha1()
+    with open(os.path.realpath(fileName), 'rb') as f:
+        sha.update(f.read())
+    sha.update(json.dumps([cellName, label, conds, kwargs or {}],
+                          sort_keys = True, default = repr).encode())
+    # Default values of the mechanism parameters come from the mod files
+    for mod in sorted(glob.glob('*.mod') + glob.glob(os.path.join('mod', '*.mod'))):
+        with open(mod, 'rb') as f:
+            sha.update(f.read())
+    try:
+        import netpyne
+        sha.update(str(netpyne.__version__).encode())
+    except (ImportError, AttributeError):
+        pass
+    return sha.hexdigest()
+
+###############################################################################
+# Array scaling
+###############################################################################
+
+def section_names(cell_params):
+    """The section names, in the order of the factor arrays."""
+    return list(cell_params['secs'].keys())
+
+def section_mask(names, include = None, exclude = None):
+    """Sections whose name contains one of include (all if None) and none
+    of exclude, as a boolean array."""
+    names = np.asarray(names, dtype = str)
+    mask = np.ones(len(names), dtype = bool)
+    if include is not None:
+        mask &= np.any([np.char.find(names, part) >= 0 for part in include], axis = 0)
+    for part in (exclude or []):
+        mask &= np.char.find(names, part) < 0
+    return mask
+
+def scale_factors(mask, part_scale = None, all_scale = None):
+    """One factor per section: all_scale for all the sections if given
+    (it overrides part_scale), else part_scale for the sections in mask."""
+    factors = np.ones(len(mask))
+    if all_scale is not None:
+        factors[:] = all_scale
+    elif part_scale is not None:
+        factors[mask] = part_scale
+    return factors
+
+def scale_param(cell_params, path, factors):
+    """Multiply a parameter of every section by its factor.
+
+    Parameters:
+    -----------
+    cell_params: the cell rule (its 'secs')
+    path: the keys of the parameter in a section, eg. ('mechs', 'na', 'gbar')
+        or ('geom', 'Ra'); sections without it are left out
+    factors: array with one factor per section (see section_names)
+
+    The values of all the sections (one number, or one per segment) are
+    scaled as one array; scalars stay scalars and lists stay lists.
+    """
+    secs, values, sizes = [], [], []
+    for i, sec in enumerate(cell_params['secs'].values()):
+        node = sec
+        for key in path[:-1]:
+            node = node.get(key) if hasattr(node, 'get') else None
+            if node is None:
+                break
+        if node is None or path[-1] not in node:
+            continue
+        value = np.array(node[path[-1]], dtype = float, ndmin = 1)
+        secs.append((i, node, np.ndim(node[path[-1]]) == 0))
+        values.append(value)
+        sizes.append(len(value))
+    if not secs:
+        return
+    index = np.array([i for i, node, scalar in secs])
+    scaled = np.concatenate(values) * np.repeat(np.asarray(factors, dtype = float)[index], sizes)
+    for (i, node, scalar), value in zip(secs, np.split(scaled, np.cumsum(sizes)[:-1])):
+        node[path[-1]] = float(value[0]) if scalar else value.tolist()
+
+def set_param(cell_params, path, value, mask = None):
+    """Set a parameter in every section that has it (in mask, if given)."""
+    for i, sec in enumerate(cell_params['secs'].values()):
+        if mask is not None and not mask[i]:
+            continue
+        node = sec
+        for key in path[:-1]:
+            node = node.get(key) if hasattr(node, 'get') else None
+            if node is None:
+                break
+        if node is not None and (len(path) == 1 or path[-1] in node):
+            node[path[-1]] = value
@@ -0,0 +1,234 @@
+"""
+cellsweep.py
+One-simulation sweeps of the EEE batches: the grid points as independent cells
+contact: penggao.1987@gmail.com
+
+Every grid point of a batch is a network of one cell (eeeD; eeeD and eeeS in
+batch_comp) with its own scaling and stimulus weight. Here the networks of
+all the points are put side by side in one NetPyNE network, with no
+connections between them, and the batch is one simulation:
+
+    python my_batches.py --local --pooled [--slim traces]
+
+netParams.py is run once per point with the cfg of the point (the cell
+import is cached, see cellparams.py), and merge adds its cell rules,
+populations, synaptic mechanisms and stimuli to the pooled network with the
+point number as suffix (eeeD -> eeeD_3, NetStimSyn -> NetStimSyn_3, ...).
+Points with the same cell rule share it. After the run, demux splits the
+recordings and the spikes by point and point_net the cells and populations,
+numbered as in a simulation of the point alone, and every point is saved as
+if it had been run alone (see local_batch.simulate_points).
+
+The parameters of the simulation itself (SHARED) cannot be swept this way.
+"""
+
+from collections import OrderedDict
+
+# cfg attributes that must be the same for all the points of a pooled sweep
+SHARED = ['duration', 'dt', 'hParams', 'cvode_active', 'seeds', 'recordStep',
+          'recordTraces']
+
+# Keys of conds that name a population or a cell type
+POP_KEYS = ['pop', 'popLabel']
+
+# simData entries with one value per spike: times and gids
+SPIKES = ['spkt', 'spkid']
+
+###############################################################################
+# Network
+###############################################################################
+
+def merge(netParams, part, suffix, rules = None):
+    """Add the network of one grid point (part) to netParams.
+
+    Parameters:
+    -----------
+    netParams: the pooled specs.NetParams
+    part: specs.NetParams of the point (netParams.py run with its cfg)
+    suffix: string added to all the labels of the point, eg. '_3'
+    rules: dict kept between the calls ({label: [labels in netParams]}),
+        so that the points with the same cell rule share it
+
+    Return:
+    -----------
+    pops: OrderedDict {population of part: its label in netParams}
+    """
+    rules = {} if rules is None else rules
+    cellTypes = {}
+    for label, rule in part.cellParams.items():
+        cellType = rule.get('conds', {}).get('cellType', label)
+        for shared in rules.setdefault(label, []):
+            if netParams.cellParams[shared] == _relabel(rule, shared):
+                cellTypes[cellType] = shared
+                break
+        else:
+            new = label + suffix
+            netParams.cellParams[new] = _relabel(rule, new)
+            rules[label].append(new)
+            cellTypes[cellType] = new
+
+    pops = OrderedDict((pop, pop + suffix) for pop in part.popParams)
+    for pop, params in part.popParams.items():
+        params = dict(params)
+        params['cellType'] = cellTypes.get(params.get('cellType'), params.get('cellType'))
+        netParams.popParams[pops[pop]] = params
+
+    synMechs = dict((name, name + suffix) for name in part.synMechParams)
+    for name, params in part.synMechParams.items():
+        netParams.synMechParams[synMechs[name]] = params
+    sources = dict((name, name + suffix) for name in part.stimSourceParams)
+    for name, params in part.stimSourceParams.items():
+        netParams.stimSourceParams[sources[name]] = params
+
+    for name, params in part.stimTargetParams.items():
+        params = dict(params)
+        params['source'] = sources.get(params['source'], params['source'])
+        params['conds'] = _rename_conds(params.get('conds', {}), pops)
+        if 'synMech' in params:
+            params['synMech'] = _rename(params['synMech'], synMechs)
+        netParams.stimTargetParams[name + suffix] = params
+    for name, params in part.connParams.items():
+        params = dict(params)
+        for conds in ['preConds', 'postConds']:
+            params[conds] = _rename_conds(params.get(conds, {}), pops)
+        if 'synMech' in params:
+            params['synMech'] = _rename(params['synMech'], synMechs)
+        netParams.connParams[name + suffix] = params
+    return pops
+
+def copy_settings(netParams, part):
+    """The network-wide settings of part (eg. defaultThreshold) in netParams."""
+    for key, value in vars(part).items():
+        if key.endswith('Params'):
+            continue
+        setattr(netParams, key, value)
+
+def check_shared(cfgs):
+    """Raise a ValueError if the points differ in a parameter of the simulation."""
+    differ = [name for name in SHARED
+              if any(getattr(cfg, name, None) != getattr(cfgs[0], name, None) for cfg in cfgs)]
+    if differ:
+        raise ValueError("Parameters %s cannot differ between the cells of one simulation" % differ)
+
+def record_cells(cfg, pops):
+    """recordCells of cfg with every population replaced by its cells in
+    all the points (pops: list of the merge outputs)."""
+    cells = []
+    for cell in getattr(cfg, 'recordCells', []):
+        if cell in pops[0]:
+            cells += [point[cell] for point in pops]
+        else:
+            cells.append(cell)
+    return cells
+
+###############################################################################
+# Results
+###############################################################################
+
+def cell_numbers(allCells, point):
+    """{gid in the pooled network: gid in a simulation of the point alone}
+    for the cells of one point (a merge output)."""
+    gids = {}
+    for cell in allCells:
+        gids.setdefault(cell['tags']['pop'], []).append(cell['gid'])
+    cells = []
+    for pop in point.values():
+        cells += sorted(gids.get(pop, []))
+    return dict((gid, i) for i, gid in enumerate(cells))
+
+def demux(simData, allCells, pops, duration = None):
+    """Split the recordings of the pooled simulation by grid point.
+
+    Parameters:
+    -----------
+    simData: sim.allSimData
+    allCells: sim.net.allCells (gid and population of every cell)
+    pops: list of the merge outputs, one per point
+    duration: float
+        cfg.duration (ms), to compute the avgRate of each point
+
+    Return:
+    -----------
+    points: list of simData dicts, one per point, with the cells numbered
+        as in a simulation of the point alone (cell_0, cell_1, ...): the
+        per-cell recordings and the spikes (spkt, spkid) of its cells, and
+        the other entries (eg. t) as they are
+    """
+    points = []
+    for point in pops:
+        numbers = cell_numbers(allCells, point)
+        names = dict(('cell_%d' % gid, 'cell_%d' % i) for gid, i in numbers.items())
+        data = {}
+        for key, value in simData.items():
+            if key in SPIKES:
+                continue
+            if isinstance(value, dict) and value and all(str(cell).startswith('cell_') for cell in value):
+                data[key] = dict((names[cell], trace) for cell, trace in value.items()
+                                 if cell in names)
+            else:
+                data[key] = value
+        if 'spkt' in simData:
+            spikes = [(spkt, numbers[int(spkid)])
+                      for spkt, spkid in zip(simData['spkt'], simData['spkid'])
+                      if int(spkid) in numbers]
+            data['spkt'] = [spkt for spkt, spkid in spikes]
+            data['spkid'] = [float(spkid) for spkt, spkid in spikes]
+            if 'avgRate' in simData and duration and numbers:
+                data['avgRate'] = len(spikes) / float(len(numbers)) / duration * 1e3
+        points.append(data)
+    return points
+
+def point_net(allCells, allPops, point):
+    """The cells and populations of one point (sim.net.allCells and
+    sim.net.allPops of a simulation of the point alone).
+
+    Return:
+    -----------
+    cells: list of cell dicts, gids and populations as in the point alone
+    pops: OrderedDict {population: its dict, with the new cellGids}
+    """
+    numbers = cell_numbers(allCells, point)
+    labels = dict((pooled, pop) for pop, pooled in point.items())
+    cells = []
+    for cell in allCells:
+        if cell['gid'] not in numbers:
+            continue
+        cell = dict(cell, gid = numbers[cell['gid']],
+                    tags = dict(cell['tags'], pop = labels[cell['tags']['pop']]))
+        if 'conns' in cell:
+            cell['conns'] = [dict(conn, preGid = numbers.get(conn.get('preGid'), conn.get('preGid')))
+                             for conn in cell['conns']]
+        cells.append(cell)
+    cells.sort(key = lambda cell: cell['gid'])
+    pops = OrderedDict()
+    for pooled, params in allPops.items():
+        if pooled in labels:
+            params = dict(params)
+            if 'cellGids' in params:
+                params['cellGids'] = [numbers[gid] for gid in params['cellGids']]
+            if 'tags' in params:
+                params['tags'] = dict(params['tags'], pop = labels[pooled])
+            pops[labels[pooled]] = params
+    return cells, pops
+
+###############################################################################
+# Helpers
+###############################################################################
+
+def _relabel(rule, cellType):
+    rule = dict(rule)
+    if 'conds' in rule:
+        rule['conds'] = dict(rule['conds'], cellType = cellType)
+    return rule
+
+def _rename(value, names):
+    if isinstance(value, (list, tuple)):
+        return [names.get(item, item) for item in value]
+    return names.get(value, value)
+
+def _rename_conds(conds, pops):
+    conds = dict(conds)
+    for key in POP_KEYS:
+        if key in conds:
+            conds[key] = _rename(conds[key], pops)
+    return conds
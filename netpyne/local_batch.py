@@ -0,0 +1,292 @@
+"""
+local_batch.py
+Local multiprocessing runner for the EEE batch folders
+contact: penggao.1987@gmail.com
+
+Runs the batches of my_batches.py (label, cfgFile, netParamsFile and an
+OrderedDict of parameter values) on one machine, without the cluster
+scripts (runmybatches, batch_utils):
+
+    cd batch_glutAmp
+    python my_batches.py [--local] [-n 8]
+
+(--local is only needed where batch_utils can be imported.)
+
+Every point of the parameter grid is one job, run in its own Python process
+(a fresh NEURON for each simulation), at most `processes` jobs at a time
+(default: all the cores). A job loads cfg.py, sets the parameters of its
+grid point, makes cfg available to netParams.py (from __main__ import cfg)
+and runs sim.createSimulateAnalyze. Outputs go to
+batch_data/<label>/<label>_<i>_<j>...; the output of each job is logged to
+<simLabel>.log and the batch is summarized in <label>_batch.json (grid
+point, return code, runtime and output files of every job). Jobs whose
+output already exists are skipped, so an interrupted batch can be run again.
+
+With a slim save profile (--slim traces|features, or cfg.saveProfile, see
+slim.py) the jobs save only their traces or features as .npz and make no
+plots; python slim.py batch_data/<label> --plot aggregates them.
+
+With --pooled the whole grid is one simulation, each point one independent
+cell (or pair of cells) of the network (see cellsweep.py); every point is
+still saved (sim.saveData, or its slim profile) and summarized as a job of
+its own. No per-point plots are made for the full profile.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import runpy
+import itertools
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+import slim
+import cellsweep
+
+###############################################################################
+# Batch (parent process)
+###############################################################################
+
+def grid(params):
+    """The points of the parameter grid: (indices, OrderedDict of values)."""
+    names = list(params.keys())
+    for idx in itertools.product(*[range(len(params[name])) for name in names]):
+        yield idx, OrderedDict((name, params[name][i]) for name, i in zip(names, idx))
+
+def run_batch(label, params, cfgFile = 'cfg.py', netParamsFile = 'netParams.py',
+              saveFolder = 'batch_data', processes = None, rerun = False, profile = None,
+              pooled = False, **kwargs):
+    """Run all the points of a batch, processes jobs at a time.
+
+    Parameters:
+    -----------
+    label: string
+        Name of the batch (output folder and prefix of the simLabels)
+    params: OrderedDict {cfg attribute: list of values}
+    cfgFile, netParamsFile: string
+        The files of the batch folder
+    saveFolder: string
+        The outputs go to saveFolder/label
+    processes: int
+        The most jobs at a time (default: number of cores)
+    rerun: bool
+        Run the jobs whose output already exists again
+    profile: string
+        Save profile of the jobs, 'full', 'traces' or 'features' (default:
+        cfg.saveProfile, see slim.py)
+    pooled: bool
+        Run all the points as one simulation (see cellsweep.py)
+    kwargs: the other entries of the batch dict (not used)
+
+    Return:
+    -----------
+    jobs: list of dict
+        One per grid point (see <label>_batch.json)
+    """
+    folder = os.path.abspath(os.path.join(saveFolder, label))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    specs = []
+    for idx, values in grid(params):
+        simLabel = label + ''.join('_%d' % i for i in idx)
+        spec = {'simLabel': simLabel, 'saveFolder': folder,
+                'cfgFile': os.path.abspath(cfgFile),
+                'netParamsFile': os.path.abspath(netParamsFile),
+                'params': [[name, value] for name, value in values.items()],
+                'rerun': rerun, 'profile': profile}
+        specs.append(spec)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    start = time.time()
+    if pooled:
+        jobs = run_pooled(label, specs)
+    else:
+        # The jobs run in child processes; the threads only wait for them
+        pool = ThreadPool(max(1, min(processes, len(specs))))
+        try:
+            jobs = pool.map(run_job, specs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = {'label': label, 'params': list(params.keys()),
+               'runtime': time.time() - start, 'jobs': jobs}
+    with open(os.path.join(folder, label + '_batch.json'), 'w') as f:
+        json.dump(summary, f, indent = 1)
+    failed = [job['simLabel'] for job in jobs if job['returncode'] != 0]
+    print("Batch %s: %d jobs, %d failed %s (%.1f s)" % (label, len(jobs), len(failed),
+          failed if failed else '', summary['runtime']))
+    return jobs
+
+def run_job(spec):
+    """Run one grid point in its own process; the record of the job."""
+    folder = spec['saveFolder']
+    job = {'simLabel': spec['simLabel'], 'params': spec.get('params')}
+    done = finished(spec)
+    if done and not spec.get('rerun'):
+        job.update(returncode = 0, runtime = 0.0, skipped = True, outputs = done)
+        return job
+    path = os.path.join(folder, spec['simLabel'] + '_job.json')
+    with open(path, 'w') as f:
+        json.dump(spec, f)
+    start = time.time()
+    with open(os.path.join(folder, spec['simLabel'] + '.log'), 'w') as log:
+        returncode = subprocess.call([sys.executable, os.path.abspath(__file__), path],
+                                     stdout = log, stderr = subprocess.STDOUT,
+                                     cwd = os.path.dirname(spec['cfgFile']))
+    job.update(returncode = returncode, runtime = time.time() - start,
+               skipped = False, outputs = outputs(folder, spec['simLabel']))
+    return job
+
+def run_pooled(label, specs):
+    """Run the points of specs without output as one job (one simulation)."""
+    todo = [spec for spec in specs if spec['rerun'] or not finished(spec)]
+    pooled = {'returncode': 0, 'runtime': 0.0}
+    if todo:
+        spec = dict(todo[0], simLabel = label + '_pooled', params = None,
+                    points = [[point['simLabel'], point['params']] for point in todo])
+        pooled = run_job(spec)
+    jobs = []
+    for spec in specs:
+        job = {'simLabel': spec['simLabel'], 'params': spec['params'],
+               'outputs': outputs(spec['saveFolder'], spec['simLabel'])}
+        if spec in todo:
+            job.update(returncode = pooled['returncode'], runtime = pooled['runtime'],
+                       skipped = False, pooled = label + '_pooled')
+        else:
+            job.update(returncode = 0, runtime = 0.0, skipped = True)
+        jobs.append(job)
+    return jobs
+
+def finished(spec):
+    """The outputs of a job if it has been run (with its save profile)."""
+    done = outputs(spec['saveFolder'], spec['simLabel'])
+    profile = spec.get('profile')
+    if profile not in (None, 'full') and "%s_%s.npz" % (spec['simLabel'], profile) not in done:
+        # Only the full output of an earlier run
+        return []
+    return done
+
+def outputs(folder, simLabel):
+    """The output files of a job (not its log and job files)."""
+    return sorted(os.path.basename(path)
+                  for path in glob.glob(os.path.join(folder, simLabel + '*'))
+                  if not path.endswith(('.log', '_job.json'))
+                  and os.path.basename(path)[len(simLabel):][:1] in ('.', '_'))
+
+def pooled_arg(argv = None):
+    """Run the batches as one simulation each (--pooled on the command line)."""
+    argv = sys.argv if argv is None else argv
+    return '--pooled' in argv
+
+def processes_arg(argv = None):
+    """The number of jobs at a time from the command line (-n N), or None."""
+    argv = sys.argv if argv is None else argv
+    for flag in ['-n', '--processes']:
+        if flag in argv:
+            return int(argv[argv.index(flag) + 1])
+    return None
+
+###############################################################################
+# Job (child process)
+###############################################################################
+
+def set_param(cfg, name, value):
+    """Set one parameter of cfg; a list/tuple name is a path into cfg,
+    eg. ['NetStimSyn', 'weight']."""
+    if isinstance(name, (list, tuple)):
+        container = getattr(cfg, name[0])
+        for key in name[1:-1]:
+            container = container[key]
+        container[name[-1]] = value
+    else:
+        setattr(cfg, name, value)
+
+def load_cfg(spec, simLabel, params):
+    """cfg.py with the parameters of one grid point."""
+    cfg = runpy.run_path(spec['cfgFile'])['cfg']
+    for name, value in params:
+        set_param(cfg, name, value)
+    cfg.simLabel = simLabel
+    cfg.saveFolder = spec['saveFolder']
+    slim.apply_profile(cfg, spec.get('profile') or getattr(cfg, 'saveProfile', 'full'))
+    return cfg
+
+def load_netParams(spec, cfg):
+    """netParams.py built with cfg."""
+    # netParams.py takes cfg from __main__
+    sys.modules['__main__'].cfg = cfg
+    return runpy.run_path(spec['netParamsFile'])['netParams']
+
+def simulate(spec):
+    """Run the simulation of one job spec (see run_batch)."""
+    from netpyne import sim
+    cfg = load_cfg(spec, spec['simLabel'], spec['params'])
+    netParams = load_netParams(spec, cfg)
+    if cfg.saveProfile == 'full':
+        sim.createSimulateAnalyze(netParams = netParams, simConfig = cfg)
+    else:
+        # No json output and no plots: the traces / features only
+        sim.create(netParams = netParams, simConfig = cfg)
+        sim.simulate()
+        slim.save(sim.allSimData, cfg)
+
+def simulate_points(spec):
+    """Run the points of a pooled job spec as one simulation and save each
+    point as its own job would (see cellsweep.py)."""
+    from netpyne import sim, specs
+    netParams = specs.NetParams()
+    cfgs, parts, pops, rules = [], [], [], {}
+    for i, (simLabel, params) in enumerate(spec['points']):
+        cfg = load_cfg(spec, simLabel, params)
+        part = load_netParams(spec, cfg)
+        if i == 0:
+            cellsweep.copy_settings(netParams, part)
+        pops.append(cellsweep.merge(netParams, part, '_%d' % i, rules))
+        cfgs.append(cfg)
+        parts.append(part)
+    cellsweep.check_shared(cfgs)
+
+    cfg = load_cfg(spec, spec['simLabel'], spec['points'][0][1])
+    cfg.recordCells = cellsweep.record_cells(cfg, pops)
+    cfg.saveJson = cfg.savePickle = False
+    cfg.analysis = {}
+    print("%d points, %d cell rules, %d cells" % (len(cfgs), len(netParams.cellParams),
+          sum(params.get('numCells', 1) for params in netParams.popParams.values())))
+    sim.create(netParams = netParams, simConfig = cfg)
+    sim.simulate()
+
+    points = cellsweep.demux(sim.allSimData, sim.net.allCells, pops, cfg.duration)
+    for point, part, simData, pooled in zip(cfgs, parts, points, pops):
+        if point.saveProfile == 'full':
+            cells, netPops = cellsweep.point_net(sim.net.allCells, sim.net.allPops, pooled)
+            save_data(sim, point, part, simData, cells, netPops)
+        else:
+            slim.save(simData, point)
+
+def save_data(sim, cfg, netParams, simData, cells, pops):
+    """Save one point of a pooled simulation with sim.saveData, as the
+    simulation of the point alone would (same files, same content)."""
+    from netpyne import specs
+    pooled = (sim.cfg, sim.net.params, sim.net.allCells, sim.net.allPops, sim.allSimData)
+    try:
+        # setSimCfg sets the output file name from simLabel and saveFolder
+        sim.setSimCfg(cfg)
+        sim.net.params = netParams
+        sim.net.allCells, sim.net.allPops = cells, pops
+        sim.allSimData = specs.Dict(simData)
+        sim.saveData()
+    finally:
+        sim.cfg, sim.net.params, sim.net.allCells, sim.net.allPops, sim.allSimData = pooled
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r') as f:
+        spec = json.load(f)
+    if 'points' in spec:
+        simulate_points(spec)
+    else:
+        simulate(spec)
@@ -0,0 +1,234 @@
+"""
+slim.py
+Slim output profile of the EEE batch simulations
+contact: penggao.1987@gmail.com
+
+With the default 'full' profile a batch job saves the whole NetPyNE output
+(saveDataInclude ['simData', 'simConfig', 'netParams', 'net'], which holds
+every section of the detailed cell) as json and plots its traces. The slim
+profiles skip both and save only what the batch analysis uses, as one
+binary numpy file per job:
+
+    'traces'     <simLabel>_traces.npz     the time and the recorded traces
+                                           (float32, one row per cell)
+    'features'   <simLabel>_features.npz   baseline, peak, time above the
+                                           baseline and threshold crossings
+                                           of every trace (trace_features)
+
+Set cfg.saveProfile in cfg.py, or run the batch with ../local_batch.py:
+
+    python my_batches.py --local --slim traces
+
+The plots are made afterwards for the whole batch, from the saved files:
+
+    python ../slim.py batch_data/<label> [--plot]
+
+writes <label>_features.csv (one row per job, trace and cell, with the
+parameters of the job) and, with --plot, <label>_<trace>.png.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+
+PROFILES = ['full', 'traces', 'features']
+
+ABOVE_THRESHOLD = 10.0  # mV above baseline (the threshold of analysis_utils.meas_platdur)
+SPIKE_THRESHOLD = -20.0 # mV, netParams.defaultThreshold
+
+###############################################################################
+# Job side
+###############################################################################
+
+def apply_profile(cfg, profile):
+    """Turn off the json output and the per-job plots for a slim profile."""
+    if profile not in PROFILES:
+        raise ValueError("Unknown save profile %s (one of %s)" % (profile, PROFILES))
+    cfg.saveProfile = profile
+    if profile != 'full':
+        cfg.saveJson = False
+        cfg.savePickle = False
+        cfg.saveDataInclude = []
+        cfg.analysis = {}
+    return cfg
+
+def save(simData, cfg, profile = None):
+    """Save the traces or features of a finished job (sim.allSimData).
+
+    Return:
+    -----------
+    fileName: string
+        The file written (None for the 'full' profile)
+    """
+    profile = profile or getattr(cfg, 'saveProfile', 'full')
+    if profile == 'full':
+        return None
+    t, traces = collect_traces(simData, cfg)
+    fileName = os.path.join(cfg.saveFolder, "%s_%s.npz" % (cfg.simLabel, profile))
+    if profile == 'traces':
+        arrays = dict((name, trace.astype(np.float32)) for name, trace in traces.items())
+        arrays['t'] = t
+    else:
+        arrays = {}
+        for name, trace in traces.items():
+            for feature, values in trace_features(trace, t, getattr(cfg, 'synTime', 100.0)).items():
+                arrays[name + '/' + feature] = values
+    np.savez_compressed(fileName, **arrays)
+    return fileName
+
+def collect_traces(simData, cfg):
+    """The time and the recorded traces ({name: n_cells x n_samples})."""
+    traces = {}
+    for name in cfg.recordTraces:
+        if name not in simData:
+            continue
+        cells = sorted(simData[name].keys(), key = lambda cell: int(cell.split('_')[-1]))
+        traces[name] = np.array([np.asarray(simData[name][cell]) for cell in cells])
+    if 't' in simData:
+        t = np.asarray(simData['t'])
+    else:
+        n_samples = max([trace.shape[1] for trace in traces.values()] or [0])
+        t = np.arange(n_samples) * cfg.recordStep
+    return t, traces
+
+def trace_features(trace, t, synTime = 100.0):
+    """Features of the traces (rows) of one recording, measured as arrays.
+
+    These are quick measures relative to the stimulus time of the batch,
+    not the features of the paper (analysis_utils.batch_features, which
+    uses fixed windows: baseline 100-150 ms, plateau from 150 ms, spikes
+    as crossings of 0 mV up and back down).
+
+    Return:
+    -----------
+    features: dict of arrays, one entry per row
+        'baseline' mean voltage before synTime, 'peak' maximum after synTime
+        (nan if the recording ends before synTime), 'time_above' time (ms)
+        more than ABOVE_THRESHOLD above baseline after synTime, in total
+        (not only the plateau), 'crossings' upward crossings of
+        SPIKE_THRESHOLD after synTime
+    """
+    trace = np.atleast_2d(trace)
+    t = t[:trace.shape[1]]
+    before = t < synTime
+    baseline = trace[:, before].mean(axis = 1) if before.any() else trace[:, 0]
+    after = trace[:, ~before]
+    dt = t[1] - t[0] if len(t) > 1 else 0.0
+    if after.shape[1] == 0:
+        return {'baseline': baseline, 'peak': np.full(len(trace), np.nan),
+                'time_above': np.zeros(len(trace)),
+                'crossings': np.zeros(len(trace), dtype = int)}
+    above = after > SPIKE_THRESHOLD
+    return {'baseline': baseline,
+            'peak': after.max(axis = 1),
+            'time_above': (after > (baseline + ABOVE_THRESHOLD)[:, None]).sum(axis = 1) * dt,
+            'crossings': (above[:, 1:] & ~above[:, :-1]).sum(axis = 1)}
+
+def profile_arg(argv = None):
+    """The save profile from the command line (--slim traces|features), or None."""
+    argv = sys.argv if argv is None else argv
+    if '--slim' in argv:
+        return argv[argv.index('--slim') + 1]
+    return None
+
+###############################################################################
+# Aggregate step
+###############################################################################
+
+def load_batch(folder):
+    """The jobs of a batch (<label>_batch.json) with their slim outputs.
+
+    Return:
+    -----------
+    jobs: list of dict
+        simLabel, params and 'traces' / 'features' (dict of arrays) if saved
+    """
+    label = os.path.basename(os.path.normpath(folder))
+    with open(os.path.join(folder, label + '_batch.json'), 'r') as f:
+        jobs = json.load(f)['jobs']
+    for job in jobs:
+        for profile in PROFILES[1:]:
+            path = os.path.join(folder, "%s_%s.npz" % (job['simLabel'], profile))
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    job[profile] = dict((key, data[key]) for key in data.files)
+    return jobs
+
+def features_table(jobs, synTime = 100.0):
+    """One row per job, trace and cell: the parameters and features
+    (measured from the traces for the 'traces' profile)."""
+    rows = []
+    for job in jobs:
+        if 'features' in job:
+            features = {}
+            for key, values in job['features'].items():
+                name, feature = key.rsplit('/', 1)
+                features.setdefault(name, {})[feature] = values
+        elif 'traces' in job:
+            t = job['traces']['t']
+            features = dict((name, trace_features(trace, t, synTime))
+                            for name, trace in job['traces'].items() if name != 't')
+        else:
+            continue
+        for name in sorted(features):
+            n_cells = len(list(features[name].values())[0])
+            for cell in range(n_cells):
+                row = [('simLabel', job['simLabel']), ('trace', name), ('cell', cell)]
+                row += [(str(param), value) for param, value in job['params']]
+                row += [(feature, float(values[cell]))
+                        for feature, values in sorted(features[name].items())]
+                rows.append(row)
+    return rows
+
+def write_csv(rows, fileName):
+    import csv
+    columns = []
+    for row in rows:
+        columns += [key for key, value in row if key not in columns]
+    with open(fileName, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            row = dict(row)
+            writer.writerow([row.get(column, '') for column in columns])
+
+def plot_traces(jobs, folder):
+    """One figure per recorded trace with the traces of all the jobs."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    label = os.path.basename(os.path.normpath(folder))
+    jobs = [job for job in jobs if 'traces' in job]
+    names = sorted(set(name for job in jobs for name in job['traces'] if name != 't'))
+    fileNames = []
+    for name in names:
+        fig, ax = plt.subplots(figsize = (10, 8))
+        colors = plt.cm.viridis(np.linspace(0, 1, max(len(jobs), 2)))
+        for color, job in zip(colors, jobs):
+            t = job['traces']['t']
+            for trace in np.atleast_2d(job['traces'].get(name, [])):
+                ax.plot(t[:len(trace)], trace, color = color, linewidth = 1,
+                        label = ', '.join("%s=%s" % (param, value) for param, value in job['params']))
+        ax.set_xlabel('Time (ms)')
+        ax.set_ylabel(name + ' (mV)')
+        ax.legend(fontsize = 'small', frameon = False)
+        fileName = os.path.join(folder, "%s_%s.png" % (label, name))
+        fig.savefig(fileName)
+        plt.close(fig)
+        fileNames.append(fileName)
+    return fileNames
+
+def aggregate(folder, plot = False, synTime = 100.0):
+    """Features table (and plots) of a finished slim batch."""
+    label = os.path.basename(os.path.normpath(folder))
+    jobs = load_batch(folder)
+    rows = features_table(jobs, synTime)
+    write_csv(rows, os.path.join(folder, label + '_features.csv'))
+    fileNames = plot_traces(jobs, folder) if plot else []
+    print("Batch %s: %d rows in %s_features.csv, %d figures" % (label, len(rows), label, len(fileNames)))
+    return rows
+
+if __name__ == '__main__':
+    # python slim.py batch_data/<label> [--plot]
+    aggregate(sys.argv[1], plot = '--plot' in sys.argv)
@@ -0,0 +1,274 @@
+"""
+Streaming simulate -> featurize -> summarize pipeline.
+
+Instead of saving the full traces of every run, crawling the result
+directory afterwards and building the results table in one go, each run is
+passed on as soon as it is simulated: its features are measured and its
+row is appended to the summary table. Only the rows of the current part are
+held in memory whatever the size of the sweep, and the table can be read
+(utils.loadtable(path, key = 'point')) while the sweep is still running.
+
+    runs = pipeline.simulate(Glu_Stim, jobs, save = False, key = point_key)
+    rows = pipeline.featurize(runs, dend = 'basal/voltage_input',
+                              columns = pipeline.FIG5_COLUMNS, rule = pipeline.fig5_platdur)
+    pipeline.summarize(rows, 'Fig5/DMS/results.parquet', key = 'point')
+
+The stages are generators, so nothing runs until summarize consumes them.
+The raw traces are only kept if the simulation function saves them (eg.
+Glu_Stim with a sweep store); with save = False they are dropped once the
+features are measured.
+
+The summary table is a directory of Parquet files (one per flush, every
+flush_every rows or flush_seconds, whichever comes first); new parts are
+added next to the parts of earlier sweeps. With FIG5_COLUMNS and
+fig5_platdur the rows are those of the per-branch tables of Fig5_ana_*.py.
+The ledger key of each run (the 'point' column, see ledger.py) identifies
+its grid point: a point run again (eg. with --verify) replaces its row.
+The replaced rows are removed from the earlier parts when the writer is
+closed; until then (or if the sweep stops before), read the table with
+utils.loadtable(path, key = 'point'), which keeps the last row of each point.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import time
+import numpy as np
+import analysis_utils as ana
+import utils as ut
+
+# Columns of the Fig 5 result tables (Fig5_ana_*.results_table): the
+# '/'-joined names of the run parameters and features, and their column
+FIG5_COLUMNS = [('TTX', 'TTX'), ('Bnum', 'Bnum'), ('Loc', 'Loc'),
+    ('SynAMPA/num', 'AMPA_num'), ('SynAMPA/locs', 'AMPA_locs'),
+    ('SynAMPA/weight', 'AMPA_weight'), ('SynNMDA/num', 'NMDA_num'),
+    ('SynNMDA/locs', 'NMDA_locs'), ('SynNMDA/weight', 'NMDA_weight'),
+    ('spike_num', 'spike_num'), ('soma_platamp', 'soma_platamp'),
+    ('soma_platdur', 'soma_platdur'), ('dend_platamp', 'dend_platamp'),
+    ('dend_platdur', 'dend_platdur'), ('point', 'point')]
+
+def fig5_platdur(features, TTX):
+    """The plateau duration of the Fig 5 tables: without TTX it is the
+    duration measured at the input site (dend_platdur)."""
+    if not TTX:
+        features['soma_platdur'] = features['dend_platdur']
+    return features
+
+######################################################
+
+def simulate(func, jobs, key = None, **kwargs):
+    """Run func for each job and yield its result (the data dict of the run).
+
+    Parameters:
+    -----------
+    func: function
+        eg. Glu_Stim; has to return the data dict of the run
+    jobs: iterable of argument tuples, one per run
+    key: function
+        Ledger key of the arguments of a job (eg. ledger.point_key of
+        sweep_point), added to the run as 'point'
+    kwargs: passed to every call (eg. store, saver, save)
+    """
+    for args in jobs:
+        data = func(*args, **kwargs)
+        if key is not None:
+            # A copy: the run itself is the one passed to the saver
+            data = dict(data, point = key(*args))
+        yield data
+
+def featurize(runs, soma = 'soma/voltage', dend = None, cache = None,
+              columns = None, rule = None):
+    """Measure the features of each run and yield its summary row.
+
+    Parameters:
+    -----------
+    runs: iterable of data dicts (see simulate)
+    soma, dend: string
+        '/'-joined names of the somatic and dendritic traces under
+        data['recording'] (dend is optional)
+    cache: featurecache.FeatureCache (optional)
+    columns: list of (name, column)
+        Only these parameters and features, under these column names
+        (eg. FIG5_COLUMNS); default: all of them under their own names
+    rule: function
+        rule(features, TTX) adjusts the features of a run (eg. fig5_platdur)
+
+    Return (yield):
+    -----------
+    row: dict
+        The scalar and list parameters of the run ('/'-joined names, the
+        recordings left out) and the features of analysis_utils.batch_features.
+        The TTX measurements are used for runs with data['TTX'] True.
+    """
+    for data in runs:
+        recording = data['recording']
+        soma_v = np.asarray(_get(recording, soma))[np.newaxis, :]
+        dend_v = None
+        if dend is not None:
+            dend_v = np.asarray(_get(recording, dend))[np.newaxis, :]
+        TTX = bool(data.get('TTX', False))
+        dt = ut.get_dt(data)
+        if cache is None:
+            features = ana.batch_features(soma_v, dend_v, TTX = TTX, dt = dt)
+        else:
+            features = cache.batch_features(soma_v, dend_v, TTX = TTX, dt = dt)
+        if rule is not None:
+            features = rule(features, TTX)
+        row = {}
+        _flatten(data, '', row)
+        for name, values in features.items():
+            row[name] = values[0].item()
+        if columns is not None:
+            row = dict((column, row[name]) for name, column in columns if name in row)
+        # Drop the run (and its traces) before the next one is simulated
+        del data, recording, soma_v, dend_v
+        yield row
+
+def summarize(rows, path, flush_every = 1000, flush_seconds = 300,
+              verbose = False, key = None):
+    """Append rows to the summary table at path.
+
+    Parameters:
+    -----------
+    rows: iterable of dicts (see featurize)
+    path: string
+        The table, a directory of Parquet files (read it with
+        utils.loadtable(path, key))
+    flush_every: int
+        Maximum number of rows per part
+    flush_seconds: float
+        The rows held longer than this are written at the next row, so a
+        slow sweep is still readable from the table while it runs.
+    key: string
+        Column identifying a run (eg. 'point'): the rows of earlier parts
+        with the key of a new row are removed when the writer is closed.
+
+    Return:
+    -----------
+    n_rows: int
+        The number of rows written.
+    """
+    writer = TableWriter(path, flush_every, key, flush_seconds)
+    for row in rows:
+        writer.append(row)
+        if verbose:
+            print("Run %d summarized" % writer.n_rows)
+    writer.close()
+    return writer.n_rows
+
+######################################################
+
+class TableWriter:
+    """
+    Append rows to a Parquet table directory, flush_every rows per file
+    (or fewer, if the first row held is more than flush_seconds old).
+
+    Each part is written under a hidden name and renamed when complete, so
+    readers never see a partial file. With a key column, the rows of the
+    earlier parts replaced by new rows (same key) are removed from their
+    part when the writer is closed; utils.loadtable(path, key) drops them
+    on read in the meantime.
+    """
+
+    def __init__(self, path, flush_every = 1000, key = None, flush_seconds = None):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.key = key
+        self.rows = []
+        self.n_rows = 0
+        self.held_since = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+        parts = self._parts()
+        self.part = max([int(name[5:10]) for name in parts] or [-1]) + 1
+        # Parts holding each key of the earlier parts (more than one if a
+        # sweep stopped before closing its writer), and the keys replaced in
+        # each part
+        self.keys = {}
+        self.replaced = {}
+        if key is not None:
+            import pandas as pd
+            for name in parts:
+                table = pd.read_parquet(os.path.join(path, name))
+                if key in table:
+                    for value in table[key]:
+                        self.keys.setdefault(value, []).append(name)
+            # Rows left by a sweep that stopped before closing its writer:
+            # only the last part of each key is kept when this one is closed
+            for value, names in self.keys.items():
+                for name in names[:-1]:
+                    if name != names[-1]:
+                        self.replaced.setdefault(name, set()).add(value)
+
+    def _parts(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if name.startswith('part-') and name.endswith('.parquet'))
+
+    def append(self, row):
+        if self.key is not None and row.get(self.key) in self.keys:
+            for name in self.keys[row[self.key]]:
+                self.replaced.setdefault(name, set()).add(row[self.key])
+        if not self.rows:
+            self.held_since = time.time()
+        self.rows.append(row)
+        self.n_rows += 1
+        if len(self.rows) >= self.flush_every or (self.flush_seconds is not None
+                and time.time() - self.held_since >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pandas as pd
+        name = "part-%05d.parquet" % self.part
+        tmp = os.path.join(self.path, '.' + name)
+        pd.DataFrame(self.rows).to_parquet(tmp, index = False)
+        os.rename(tmp, os.path.join(self.path, name))
+        self.part += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if not self.replaced:
+            return
+        import pandas as pd
+        for name, keys in self.replaced.items():
+            path = os.path.join(self.path, name)
+            table = pd.read_parquet(path)
+            table = table[~table[self.key].isin(keys)]
+            if len(table):
+                tmp = os.path.join(self.path, '.' + name)
+                table.to_parquet(tmp, index = False)
+                os.rename(tmp, path)
+            else:
+                os.remove(path)
+        self.replaced = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+######################################################
+# Helpers
+######################################################
+
+def _get(recording, name):
+    for key in name.split('/'):
+        recording = recording[key]
+    return recording
+
+def _flatten(data, prefix, row):
+    for key, value in data.items():
+        name = prefix + str(key)
+        if name == 'recording':
+            continue
+        if isinstance(value, dict):
+            _flatten(value, name + '/', row)
+        elif hasattr(value, 'tolist'):
+            # numpy scalars
+            row[name] = value.tolist()
+        else:
+            row[name] = value
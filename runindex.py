@@ -0,0 +1,238 @@
+"""
+Index of all the simulation runs in a SQLite database.
+
+Every run saved by the simulation files is registered with its full
+parameter set, condition, code version, runtime and where its traces are
+stored (a .npz/.json file, or a sweep store and row). The analysis and
+plotting files select runs by parameter predicates on the index instead of
+parsing file names or walking the result directories, eg.
+
+    index = RunIndex()
+    runs = index.select(script = 'Fig3_exp_dms', condition = 'N',
+                        where = {'SynNMDA/weight': ('>=', 0.2)})
+
+Parameter names are the '/'-joined keys of the data dict built in the
+simulation files, eg. 'SynAMPA/num' or 'Bnum'.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import json
+import sqlite3
+import subprocess
+import time
+import utils as ut
+
+OPERATORS = ['=', '!=', '<', '<=', '>', '>=']
+
+######################################################
+
+class RunIndex:
+    """
+    SQLite-backed index of simulation runs.
+
+    Tables:
+        runs:       one row per run (script, condition, version, runtime,
+                    location, row, created and all parameters as json)
+        run_params: one row per scalar parameter, indexed on (name, value)
+                    so that parameter predicates do not scan the runs
+    """
+
+    def __init__(self, path = 'runs.db'):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout = 60)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                script TEXT, condition TEXT, version TEXT, runtime REAL,
+                location TEXT, row INTEGER, created TEXT, params TEXT)""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS run_params (
+                run_id INTEGER, name TEXT, value)""")
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS run_params_name_value
+                ON run_params (name, value)""")
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS runs_location
+                ON runs (location)""")
+
+    #############
+    def add(self, data, location, script = None, condition = None,
+            runtime = None, row = None):
+        """Register one run.
+
+        Parameters:
+        -----------
+        data: dict
+            Nested dict of the run as built in the simulation files. The
+            'recording' entry is left out; all the other values are indexed.
+        location: string
+            Path of the saved run (or of the sweep store holding it)
+        script: string
+            Name of the simulation file, eg. 'Fig5_exp_DMS'
+        condition: string
+            eg. 'N', 'TTX', 'Control', '4AP'
+        runtime: float
+            Simulation wall time (s)
+        row: int
+            Row of the run in a sweep store (None for one file per run)
+
+        Return:
+        -----------
+        run_id: int
+        """
+        params = {}
+        _flatten(data, '', params)
+        with self.conn:
+            cursor = self.conn.execute(
+                """INSERT INTO runs (script, condition, version, runtime,
+                location, row, created, params) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (script, condition, code_version(), runtime,
+                 os.path.normpath(location), row,
+                 time.strftime("%Y-%m-%d %H:%M:%S"), json.dumps(params)))
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO run_params (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in params.items()
+                 if isinstance(value, (bool, int, float, str))])
+        return run_id
+
+    #############
+    def select(self, script = None, condition = None, under = None,
+               where = None, **kwargs):
+        """Select runs by their metadata and parameters.
+
+        Parameters:
+        -----------
+        script, condition: string
+            Only runs of this simulation file / condition
+        under: string
+            Only runs saved in this directory (or below it)
+        where: dict
+            Parameter predicates {name: value}. The value can be a scalar
+            (equality), a list (any of the values) or a tuple
+            (operator, value) with operator in =, !=, <, <=, >, >=
+        kwargs:
+            More equality predicates for parameters with plain names
+
+        Return:
+        -----------
+        runs: list of dict
+            One dict per run with the columns of the runs table; 'params'
+            is decoded to a dict.
+        """
+        predicates = dict(where or {})
+        predicates.update(kwargs)
+        clauses = []
+        args = []
+        if script is not None:
+            clauses.append("script = ?")
+            args.append(script)
+        if condition is not None:
+            clauses.append("condition = ?")
+            args.append(condition)
+        if under is not None:
+            # A prefix comparison: '_' and '%' of LIKE are common in the paths
+            prefix = os.path.join(os.path.normpath(under), '')
+            clauses.append("(location = ? OR substr(location, 1, ?) = ?)")
+            args += [prefix[:-1], len(prefix), prefix]
+        for name, value in predicates.items():
+            if isinstance(value, tuple):
+                op, value = value
+                if op not in OPERATORS:
+                    raise ValueError("Unknown operator '%s' for %s" % (op, name))
+                values = [value]
+                test = "value %s ?" % op
+            elif isinstance(value, list):
+                values = value
+                test = "value IN (%s)" % ', '.join('?' * len(value))
+            else:
+                values = [value]
+                test = "value = ?"
+            clauses.append("id IN (SELECT run_id FROM run_params "
+                           "WHERE name = ? AND %s)" % test)
+            args += [name] + values
+        query = "SELECT * FROM runs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY id"
+        runs = []
+        for record in self.conn.execute(query, args):
+            run = dict(record)
+            run['params'] = json.loads(run['params'])
+            runs.append(run)
+        return runs
+
+    def locations(self, **kwargs):
+        """Paths of the runs matching select(**kwargs), without duplicates."""
+        paths = []
+        for run in self.select(**kwargs):
+            if run['location'] not in paths:
+                paths.append(run['location'])
+        return paths
+
+    def close(self):
+        self.conn.close()
+
+######################################################
+# Helpers
+######################################################
+
+def _flatten(data, prefix, params):
+    for key, value in data.items():
+        name = prefix + str(key)
+        if name == 'recording':
+            continue
+        if isinstance(value, dict):
+            _flatten(value, name + '/', params)
+        elif hasattr(value, 'tolist'):
+            # numpy scalars and arrays
+            params[name] = value.tolist()
+        else:
+            params[name] = value
+
+_version = []
+
+def code_version():
+    """Git commit of the code (with '-dirty' for local changes)."""
+    if not _version:
+        try:
+            here = os.path.dirname(os.path.abspath(__file__))
+            version = subprocess.check_output(
+                ['git', 'describe', '--always', '--dirty'], cwd = here,
+                stderr = subprocess.STDOUT).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            version = 'unknown'
+        _version.append(version)
+    return _version[0]
+
+def register(data, location, path = 'runs.db', **kwargs):
+    """Add one run to the index at path (see RunIndex.add for kwargs)."""
+    index = RunIndex(path)
+    run_id = index.add(data, location, **kwargs)
+    index.close()
+    return run_id
+
+def saved_runs(path_to_json, index = None, **kwargs):
+    """Paths of the runs saved in path_to_json.
+
+    The runs of the index (selected with kwargs, see RunIndex.select) whose
+    files still exist, then the run files of the directory that the index
+    does not know about (saved before the index existed; kwargs cannot
+    select them).
+    """
+    if index is None:
+        index = RunIndex()
+    indexed = index.locations(under = path_to_json, **kwargs)
+    # Runs deleted since they were registered are left out
+    paths = [path for path in indexed if os.path.exists(path)]
+    if not os.path.isdir(path_to_json):
+        return paths
+    indexed = set(index.locations(under = path_to_json) if kwargs else indexed)
+    for js in sorted(ut.list_runs(path_to_json)):
+        path = os.path.join(path_to_json, js)
+        if os.path.normpath(path) not in indexed:
+            paths.append(path)
+    return paths
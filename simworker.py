@@ -0,0 +1,238 @@
+"""
+Long-lived simulation worker with a local job API.
+
+Every simulation script pays for starting Python, importing NEURON,
+loading the mechanisms and stdrun.hoc and building CA229 before its first
+run. The worker does this once and then runs jobs sent over a local socket
+on the same prebuilt cell: the channel densities changed by a job (TTX,
+4-AP) are restored from a snapshot after each run.
+
+Start the worker (in the model directory, after compile.py):
+
+    python simworker.py [--address simworker.sock]
+
+and send jobs from any script or interactive session:
+
+    with Client() as worker:
+        row = worker.run('Fig5_exp_DMS', 'Glu_Stim',
+                         (34, True, 12, 12, 0.02, 10, 0.9, 0.9, [0.2, 0.3], 0.5))
+
+A job names the simulation file and function (Fig5_exp_DMS.Glu_Stim,
+Fig5_exp_major.Glu_Stim or Fig2_bAP_exp.bAP), its arguments and what to
+send back:
+    'features'  the summary row of the run (see pipeline.featurize; for
+                bAP the peak amplitude and latency at every recording site)
+    'data'      the parameters and all the traces
+    'store'     the run is appended to the sweep store job['store'] and
+                registered in the run index; the reply is the trace
+                handle {'store': path, 'row': run id}
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import sys
+import time
+import importlib
+import traceback
+from multiprocessing.connection import Listener, Client as _connect
+import numpy as np
+
+ADDRESS = 'simworker.sock'
+AUTHKEY = os.environ.get('EEE_WORKER_KEY', 'EEE_Detailed_Cell').encode()
+
+# The functions a worker runs, and the channels they may change
+JOBS = {
+    ('Fig5_exp_DMS', 'Glu_Stim'): ['gbar_na'],
+    ('Fig5_exp_major', 'Glu_Stim'): ['gbar_na'],
+    ('Fig2_bAP_exp', 'bAP'): ['gbar_na', 'gkabar_kap', 'gkabar_kad'],
+}
+
+######################################################
+
+class Worker:
+    """
+    Runs jobs on one prebuilt CA229 cell.
+
+    The NEURON state shared by all the jobs (mechanisms, stdrun.hoc, the
+    cell) is set up once in __init__; run() restores the channel densities
+    after each job, so every job starts from the same cell.
+    """
+
+    def __init__(self):
+        from neuron import h
+        import CA229 as de
+        h.load_file('stdrun.hoc')
+        self.h = h
+        self.cell = de.CA229()
+        names = sorted(set(name for names in JOBS.values() for name in names))
+        self.snapshot = self.cell.snapshot(names)
+        # Somatic voltage of the last control bAP of each branch (for TTX)
+        self.bAP_soma = {}
+
+    def run(self, job):
+        """Run one job (a dict, see the module docstring) and return the reply."""
+        script, func = job['script'], job['func']
+        if (script, func) not in JOBS:
+            raise ValueError("Unknown job %s.%s" % (script, func))
+        args = list(job.get('args', ()))
+        kwargs = dict(job.get('kwargs', {}))
+        output = job.get('output', 'features')
+        module = importlib.import_module(script)
+
+        if func == 'bAP':
+            kwargs = _bAP_kwargs(args, kwargs)
+            if kwargs.get('TTX') and 'vec' not in kwargs:
+                kwargs['vec'] = self.bAP_soma[kwargs.get('Bnum', 34)]
+        start_time = time.time()
+        try:
+            data = getattr(module, func)(*args, save = False, Cell = self.cell, **kwargs)
+        finally:
+            self.cell.restore(self.snapshot)
+        runtime = time.time() - start_time
+        if func == 'bAP' and not kwargs.get('TTX') and not kwargs.get('Atype'):
+            self.bAP_soma[kwargs.get('Bnum', 34)] = np.array(data['recording']['soma']['voltage'])
+
+        if output == 'data':
+            return _plain(data)
+        if output == 'store':
+            import sweepstore as ss
+            import runindex as ri
+            store = ss.SweepStore(job['store'])
+            row = store.append(data)
+            ri.register(data, store.path, script = script, condition = job.get('condition'),
+                        runtime = runtime, row = row)
+            return {'store': store.path, 'row': row}
+        if func == 'bAP':
+            return _bAP_features(data)
+        import pipeline
+        return next(pipeline.featurize([data], dend = 'basal/voltage_input'))
+
+    def serve(self, address = ADDRESS, authkey = AUTHKEY, verbose = True):
+        """Answer jobs from local clients until a 'shutdown' message."""
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        listener = Listener(address, authkey = authkey)
+        if verbose:
+            print("Worker ready on %s" % (address,))
+        try:
+            while True:
+                conn = listener.accept()
+                try:
+                    if not self._session(conn, verbose):
+                        break
+                finally:
+                    conn.close()
+        finally:
+            listener.close()
+
+    def _session(self, conn, verbose):
+        """Jobs of one client; False when the worker is asked to stop."""
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                return True
+            if job == 'shutdown':
+                conn.send({'ok': True, 'result': None})
+                return False
+            if job == 'ping':
+                conn.send({'ok': True, 'result': 'pong'})
+                continue
+            start_time = time.time()
+            try:
+                reply = {'ok': True, 'result': self.run(job)}
+            except Exception:
+                reply = {'ok': False, 'error': traceback.format_exc()}
+            conn.send(reply)
+            if verbose:
+                print("%s.%s: %s (%.2f s)" % (job.get('script'), job.get('func'),
+                      'done' if reply['ok'] else 'failed', time.time() - start_time))
+
+######################################################
+
+class Client:
+    """
+    Connection to a running worker.
+
+    Example:
+    -----------
+        with Client() as worker:
+            worker.ping()
+            handle = worker.run('Fig5_exp_DMS', 'Glu_Stim', args,
+                                output = 'store', store = 'Fig5/DMS/sweep.h5')
+    """
+
+    def __init__(self, address = ADDRESS, authkey = AUTHKEY):
+        self.conn = _connect(address, authkey = authkey)
+
+    def run(self, script, func, args = (), kwargs = None, output = 'features', **job):
+        """Run func of script on the worker and return the reply (see the
+        module docstring); an error in the job is raised as RuntimeError."""
+        job.update(script = script, func = func, args = list(args),
+                   kwargs = kwargs or {}, output = output)
+        return self._call(job)
+
+    def ping(self):
+        return self._call('ping')
+
+    def shutdown(self):
+        """Stop the worker."""
+        return self._call('shutdown')
+
+    def _call(self, message):
+        self.conn.send(message)
+        reply = self.conn.recv()
+        if not reply['ok']:
+            raise RuntimeError("Job failed on the worker:\n" + reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+######################################################
+# Helpers
+######################################################
+
+def _bAP_kwargs(args, kwargs):
+    """bAP arguments as keywords (the worker needs Bnum and TTX)."""
+    names = ['Bnum', 'TTX', 'Atype', 'vec']
+    for name, value in zip(names, args):
+        kwargs[name] = value
+    del args[:]
+    return kwargs
+
+def _plain(data):
+    """The run dict with plain dicts and arrays (no NEURON objects)."""
+    if isinstance(data, dict):
+        return dict((key, _plain(value)) for key, value in data.items())
+    if isinstance(data, np.ndarray):
+        return np.array(data)
+    return data
+
+def _bAP_features(data):
+    """Peak amplitude and latency (to the somatic peak) at every site."""
+    import analysis_utils as ana
+    import utils as ut
+    dt = ut.get_dt(data)
+    soma_v, soma_t = ana.batch_single_spike(data['recording']['soma']['voltage'], dt)
+    dend_v, dend_t = ana.batch_single_spike(data['recording']['dend']['voltage'], dt)
+    return {'Bnum': data['Bnum'], 'dist': list(data['dist']),
+            'Peak_amp': dend_v.tolist(), 'Peak_t': (dend_t - soma_t).tolist(),
+            'Soma_v': float(soma_v[0])}
+
+######################################################
+if __name__ == "__main__":
+    address = ADDRESS
+    if "--address" in sys.argv:
+        address = sys.argv[sys.argv.index("--address") + 1]
+    start_time = time.time()
+    worker = Worker()
+    print("--- Worker started in %s seconds ---" % (time.time() - start_time))
+    worker.serve(address)
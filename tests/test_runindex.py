@@ -0,0 +1,57 @@
+"""
+Tests of the run index (runindex.py): python -m pytest tests
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import runindex as ri
+
+class SavedRunsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = ri.RunIndex(os.path.join(self.directory, 'runs.db'))
+        self.runs = os.path.join(self.directory, 'a_b')
+        os.makedirs(self.runs)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def save(self, name, condition = 'N', register = True):
+        path = os.path.join(self.runs, name)
+        open(path, 'w').close()
+        if register:
+            self.index.add({'x': 1}, path, condition = condition)
+        return path
+
+    def test_deleted_run_is_left_out(self):
+        kept = self.save('r1.json')
+        deleted = self.save('r2.npz')
+        os.remove(deleted)
+        self.assertEqual(ri.saved_runs(self.runs, self.index), [kept])
+
+    def test_unindexed_runs_are_added(self):
+        indexed = self.save('r1.json')
+        old = self.save('old.json', register = False)
+        self.assertEqual(ri.saved_runs(self.runs, self.index), [indexed, old])
+        other = self.save('r2.json', condition = 'TTX')
+        self.assertEqual(ri.saved_runs(self.runs, self.index, condition = 'TTX'),
+                         [other, old])
+
+    def test_under_is_a_prefix(self):
+        path = os.path.join(self.directory, 'axb', 'r.json')
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        self.index.add({'x': 1}, path)
+        self.assertEqual(self.index.locations(under = self.runs), [])
+
+if __name__ == '__main__':
+    unittest.main()
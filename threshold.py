@@ -0,0 +1,204 @@
+"""
+Adaptive search of the plateau / spike threshold.
+
+The simulation files find the input strength at which a plateau (or a
+spike) appears with dense weight grids around the threshold. Here the
+threshold is located by bisection (or safeguarded secant steps) on the
+input weight or on the pool size: each step runs one simulation in the
+bracket [low, high] and keeps the half that still contains the threshold,
+so a threshold to 0.01 in weight takes about 7 runs instead of a grid of
+tens. The searches of different branches / locations are independent and
+run in parallel, one per worker process:
+
+    grid = [(34, False, 12, 12, 0.9, 0.9, loc, DenLoc), ...]   # Glu_Stim args
+    table = search('Fig5_exp_major', grid, input = 'weight', low = 0.0, high = 1.5)
+
+The threshold is the smallest input found with the feature at or above the
+level of the criterion (the input is assumed to increase the feature):
+
+    'plateau'   somatic depolarization 10 mV above baseline for >= 50 ms,
+                in both conditions (the soma_platdur of batch_features
+                without TTX; under TTX batch_features gives the duration
+                above half the plateau amplitude instead, which is not used)
+    'spike'     spike_num >= 1 (without TTX only: there are no spikes under TTX)
+
+The --threshold searches of the simulation files use 'plateau': Fig3_exp_*
+for both conditions, Fig5_exp_* without TTX.
+
+Author: Peng Penny Gao
+penggao.1987@gmail.com
+"""
+import json
+import importlib
+import functools
+import multiprocessing as mp
+import numpy as np
+import analysis_utils as ana
+import utils as ut
+
+# feature, level
+CRITERIA = {
+    'plateau': ('platdur_10mV', 50.0),
+    'spike': ('spike_num', 1),
+}
+
+# Positions of TTX, the pool sizes and the weights in the arguments of Glu_Stim
+INPUTS = {
+    'Fig3_exp_dms': {'TTX': 0, 'pool': (1, 2), 'weight': (5, 6)},
+    'Fig3_exp_major': {'TTX': 0, 'pool': (1, 2), 'weight': (3, 4)},
+    'Fig5_exp_DMS': {'TTX': 1, 'pool': (2, 3), 'weight': (6, 7)},
+    'Fig5_exp_major': {'TTX': 1, 'pool': (2, 3), 'weight': (4, 5)},
+}
+
+######################################################
+
+def find_threshold(evaluate, low, high, level, tol = 0.01, max_runs = 12,
+                   method = 'bisect', integer = False):
+    """Smallest x in [low, high] with evaluate(x) >= level.
+
+    Parameters:
+    -----------
+    evaluate: function
+        The feature (float) of one simulation with input x; assumed to
+        increase with x
+    low, high: the bracket of the search
+    level: the feature level of the threshold
+    tol: width of the final bracket (1 for integer inputs)
+    max_runs: the most simulations of the search
+    method: 'bisect' or 'secant'
+        secant: the next input is interpolated between the bracket ends
+        from their features (regula falsi, kept 10% away from the ends so
+        that the bracket keeps shrinking), fewer runs for smooth features
+    integer: the input is an integer (eg. a pool size)
+
+    Return:
+    -----------
+    threshold: float
+        The smallest input found at or above level (low if it is already
+        above, nan if high is still below)
+    runs: list of (x, feature), in the order they were run
+    """
+    if integer:
+        low, high, tol = int(low), int(high), max(int(tol), 1)
+    runs = []
+    f_low = evaluate(low)
+    runs.append((low, f_low))
+    if f_low >= level:
+        return low, runs
+    f_high = evaluate(high)
+    runs.append((high, f_high))
+    if f_high < level:
+        return np.nan, runs
+    while high - low > tol and len(runs) < max_runs:
+        if method == 'secant' and f_high > f_low:
+            x = low + (level - f_low) * (high - low) / float(f_high - f_low)
+            x = min(max(x, low + 0.1 * (high - low)), high - 0.1 * (high - low))
+        else:
+            x = (low + high) / 2.0
+        if integer:
+            x = min(max(int(round(x)), low + 1), high - 1)
+        f = evaluate(x)
+        runs.append((x, f))
+        if f >= level:
+            high, f_high = x, f
+        else:
+            low, f_low = x, f
+    return high, runs
+
+def glu_stim_feature(script, args, input, x, criterion = 'plateau'):
+    """Feature of the criterion for one simulation of script.Glu_Stim.
+
+    Parameters:
+    -----------
+    script: string
+        The simulation file, eg. 'Fig5_exp_DMS' (see INPUTS)
+    args: tuple
+        The arguments of Glu_Stim
+    input: 'weight' or 'pool' (both pools set to x), or a function
+        input(args, x) returning the arguments for input x (eg. for inputs
+        that set the weight and the pool size together)
+    x: the input
+    """
+    module = importlib.import_module(script)
+    args = set_input(script, args, input, x)
+    result = module.Glu_Stim(*args, save = False)
+    # Fig3_exp_dms.Glu_Stim is a class, the run is its data attribute
+    data = getattr(result, 'data', result)
+    TTX = bool(args[INPUTS[script]['TTX']])
+    soma = np.asarray(data['recording']['soma']['voltage'])
+    dt = ut.get_dt(data)
+    features = ana.batch_features(soma, TTX = TTX, dt = dt)
+    # The same plateau measure in both conditions (see CRITERIA)
+    features['platdur_10mV'] = ana.batch_meas_platdur(soma, 10, dt)
+    return float(features[CRITERIA[criterion][0]][0])
+
+def set_input(script, args, input, x):
+    """The arguments of Glu_Stim with the input set to x."""
+    args = list(args)
+    if callable(input):
+        return list(input(args, x))
+    for i in INPUTS[script][input]:
+        args[i] = x
+    return args
+
+def _search_one(args, script, input, criterion, low, high, tol, max_runs, method):
+    evaluate = functools.partial(glu_stim_feature, script, args, input,
+                                 criterion = criterion)
+    integer = input == 'pool'
+    threshold, runs = find_threshold(evaluate, low, high,
+                                     CRITERIA[criterion][1], tol, max_runs,
+                                     method, integer)
+    return {'threshold': threshold, 'n_runs': len(runs),
+            'inputs': [x for x, f in runs], 'features': [f for x, f in runs]}
+
+def search(script, grid, input = 'weight', criterion = 'plateau', low = 0.0,
+           high = 1.5, tol = 0.01, max_runs = 12, method = 'bisect',
+           point = None, processes = None):
+    """Threshold of each point of grid, the points searched in parallel.
+
+    Parameters:
+    -----------
+    script: string
+        The simulation file, eg. 'Fig5_exp_major'
+    grid: list of argument tuples of Glu_Stim, one per branch / location;
+        the input searched is replaced in each (see glu_stim_feature)
+    input, criterion: see glu_stim_feature and CRITERIA
+    low, high, tol, max_runs, method: see find_threshold
+    point: function
+        Named parameters (dict) of an argument tuple, eg. sweep_point of
+        the Fig 5 files (default: the arguments as one json column 'args')
+    processes: number of worker processes (default: number of cores)
+
+    Return:
+    -----------
+    table: pandas.DataFrame
+        One row per grid point: its parameters (at the threshold), the
+        threshold, the number of runs and the inputs and features of the runs.
+    """
+    import pandas as pd
+    grid = [tuple(args) for args in grid]
+    one = functools.partial(_search_one, script = script, input = input,
+                            criterion = criterion, low = low, high = high,
+                            tol = tol, max_runs = max_runs, method = method)
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = min(processes, len(grid))
+    if processes <= 1:
+        rows = [one(args) for args in grid]
+    else:
+        # One search per task: every search builds its own cells
+        pool = mp.Pool(processes)
+        try:
+            rows = pool.map(one, grid, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    for args, row in zip(grid, rows):
+        # The parameters at the threshold
+        if np.isfinite(row['threshold']):
+            args = set_input(script, args, input, row['threshold'])
+        if point is None:
+            row['args'] = json.dumps(list(args))
+        else:
+            row.update(point(*args))
+    return pd.DataFrame(rows)
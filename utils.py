@@ -5,10 +5,41 @@ Author: Peng Penny Gao
 penggao.1987@gmail.com
 """
 import os
-import matplotlib.pyplot as plt
 import json
 import datetime
 import time
+import signal
+import traceback
+import multiprocessing
+import numpy as np
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:  # python 2.7
+    from multiprocessing.queues import SimpleQueue
+import importlib
+
+######################################################
+
+class LazyModule:
+    """A module imported at its first use.
+
+    The simulation files and their workers import only NEURON, numpy and
+    the cell; matplotlib, pandas and h5py (seconds of start-up time) are
+    loaded by the functions that use them:
+
+        plt = LazyModule('matplotlib.pyplot')
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+plt = LazyModule('matplotlib.pyplot')
 
 ######################################################
 
@@ -71,6 +102,70 @@ class Vividict(dict):
 
 ######################################################
 
+def pack_time(t_vec, tol = 1e-3):
+    """ Compact form of a recorded time vector for saving.
+
+    Fixed-step runs record t = t0, t0 + dt, t0 + 2dt, ..., so only t0, dt and
+    the number of samples are stored. Variable-step (CVODE) runs keep the
+    explicit time points.
+
+    Parameters:
+    -----------
+    t_vec: h.Vector or list
+        The recorded time points.
+
+    tol: float (default = 1e-3)
+        Largest deviation from the uniform grid allowed, as a fraction of dt.
+
+    Return:
+    -----------
+    time: dict or list
+        {'t0': t0, 'dt': dt, 'n': n} for a uniform grid, otherwise the list
+        of time points.
+    """
+    t = np.asarray(t_vec, dtype = float)
+    n = len(t)
+    if n < 2:
+        return list(t)
+    dt = (t[-1] - t[0]) / (n - 1)
+    grid = t[0] + dt * np.arange(n)
+    if dt > 0 and np.max(np.abs(t - grid)) <= tol * dt:
+        return {'t0': float(t[0]), 'dt': float(dt), 'n': n}
+    return list(t)
+
+def get_time(data):
+    """ Time points (ms) of a saved run.
+
+    Rebuilt from t0, dt and n when the run was saved on a uniform grid,
+    otherwise the stored time points. Older files with an explicit time
+    list are read the same way.
+    """
+    time = data['recording']['time']
+    if isinstance(time, dict):
+        return time['t0'] + time['dt'] * np.arange(time['n'])
+    return np.asarray(time)
+
+def get_dt(data):
+    """ Sampling interval (ms) of a saved run.
+
+    The stored dt is (t_end - t0) / (n - 1) and carries the round-off of the
+    accumulated simulation time, so it is rounded to 1e-9 ms (eg. 0.025).
+    Variable-step (CVODE) runs have no sampling interval: a ValueError is
+    raised, resample their traces first (analysis_utils.resample).
+    """
+    time = data['recording']['time']
+    if isinstance(time, dict):
+        dt = time['dt']
+    else:
+        steps = np.diff(np.asarray(time, dtype = float))
+        dt = np.median(steps)
+        if not np.allclose(steps, dt, rtol = 1e-6, atol = 1e-9):
+            raise ValueError("Variable time steps (%g to %g ms): resample the traces "
+                             "with analysis_utils.resample" % (steps.min(), steps.max()))
+    return round(float(dt), 9)
+
+######################################################
+
 def savejson(data, path, directory, ext = 'json', verbose = False):
     """ Save data to json for analysis. """
     # timestr = time.strftime("%m_%d")
@@ -91,10 +186,293 @@ def savejson(data, path, directory, ext = 'json', verbose = False):
 
     # Save data to json
 
-    jsondata = json.dumps(data)
+    jsondata = json.dumps(data, default = _tolist)
     fd = open(savepath, 'w')
     fd.write(jsondata)
     fd.close()
 
     if verbose:
         print ("Done")
+
+def _tolist(value):
+    """ Let json encode recordings that are kept as numpy arrays. """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+######################################################
+# Binary results
+######################################################
+
+class VectorView(np.ndarray):
+    """ ndarray sharing memory with an h.Vector, which it keeps alive. """
+    pass
+
+class _VectorOwner(object):
+    """ Exposes the samples of an h.Vector to numpy and owns the Vector.
+
+    It is the base of the arrays made by vec2np: numpy collapses the base
+    chain of views (np.asarray(view), view[10:], ...) to this object, so
+    every array of the samples keeps the Vector alive.
+    """
+    def __init__(self, vec, array):
+        self.vector = vec
+        self._interface = dict(array.__array_interface__)
+
+    @property
+    def __array_interface__(self):
+        return self._interface
+
+def vec2np(vec):
+    """ NumPy view of a recorded h.Vector, without copying the samples.
+
+    The view shares memory with the Vector, and the Vector is owned by the
+    base of the view, so the samples stay valid as long as any array made
+    from it exists (eg. np.asarray(view)). The Vector is taken off the
+    record list, so a later h.init() or h.run() cannot resize it or record
+    into it.
+    """
+    vec.play_remove()
+    if hasattr(vec, 'as_numpy'):
+        array = vec.as_numpy()
+    else:
+        # Older NEURON versions only expose the array interface
+        array = np.asarray(vec)
+    view = np.asarray(_VectorOwner(vec, array)).view(VectorView)
+    view.vector = vec
+    return view
+
+def _split_arrays(data, prefix, arrays):
+    """ Move the numpy arrays out of a nested dict.
+
+    Returns a copy of data without the arrays; each array is put in arrays
+    under its '/'-joined key path (eg. 'recording/soma/voltage').
+    """
+    meta = {}
+    for key, value in data.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            meta[key] = _split_arrays(value, name + '/', arrays)
+        elif isinstance(value, np.ndarray):
+            arrays[name] = value
+        else:
+            meta[key] = value
+    return meta
+
+def saverun(data, path, directory, ext = 'npz', verbose = False):
+    """ Save the results of one run in binary form.
+
+    The recordings (numpy arrays, eg. from vec2np) are written straight into
+    an uncompressed .npz archive, one member per trace. Everything else
+    (parameters, the time axis, ...) is stored as json in the '__meta__'
+    member. Use loadrun to read it back.
+
+    Return:
+    -----------
+    savepath: string
+        The path of the saved file.
+    """
+    filename = "%s.%s" % (os.path.split(path)[1], ext)
+    if directory == '':
+        directory = '.'
+
+    # If the directory does not exist, create it
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    savepath = os.path.join(directory, filename)
+
+    if verbose:
+        print ("Saving data to '%s'..." % savepath)
+
+    arrays = {}
+    meta = _split_arrays(data, '', arrays)
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    # np.savez takes a file object so that the extension is not changed
+    with open(savepath, 'wb') as fd:
+        np.savez(fd, **arrays)
+
+    if verbose:
+        print ("Done")
+    return savepath
+
+def loadrun(filepath):
+    """ Load the results of one run saved by saverun or savejson.
+
+    Return:
+    -----------
+    data: dict
+        Nested dict as it was saved. Recordings from binary files are numpy
+        arrays, recordings from json files are lists.
+    """
+    if filepath.endswith('.json'):
+        with open(filepath) as json_file:
+            return json.load(json_file)
+
+    with np.load(filepath, allow_pickle = False) as archive:
+        data = json.loads(str(archive['__meta__']))
+        for name in archive.files:
+            if name == '__meta__':
+                continue
+            keys = name.split('/')
+            node = data
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = archive[name]
+    return data
+
+def list_runs(directory, ext = ('.npz', '.json')):
+    """ File names of the saved runs (binary or json) in a directory.
+    The manifests of the results tables (*.manifest.json) are left out. """
+    return [item for item in os.listdir(directory)
+            if item.endswith(ext) and not item.endswith('.manifest.json')]
+
+######################################################
+# Results tables
+######################################################
+
+def savetable(df, path, verbose = False):
+    """ Save a table of analysis results as Parquet.
+
+    The columns keep their types (bool, int, float, string and lists such
+    as the synapse locations), so loadtable gives back the same table
+    without re-parsing text. Needs pyarrow (or fastparquet).
+
+    Parameters:
+    -----------
+    df: pandas.DataFrame
+    path: string
+        File path, eg. 'Fig5/DMS/B34/total_results.parquet'
+    """
+    directory = os.path.dirname(path)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    if verbose:
+        print("Saving table to '%s'..." % path)
+    df.to_parquet(path, index = False)
+
+def loadtable(path, key = None):
+    """ Read a table saved by savetable, or a table directory written by
+    pipeline.TableWriter.
+
+    Results analysed before the tables were saved as Parquet are read from
+    the .csv file with the same name.
+
+    Parameters:
+    -----------
+    path: string
+    key: string
+        Column identifying a run (eg. 'point') in a table directory: only the
+        last row of each key is kept, in the order the parts were written,
+        so the rows replaced by a sweep that did not close its writer are
+        dropped.
+    """
+    # pandas is only needed by the analysis files
+    import pandas as pd
+    csv = os.path.splitext(path)[0] + '.csv'
+    if not os.path.exists(path) and os.path.exists(csv):
+        return pd.read_csv(csv, index_col = 0)
+    if key is None or not os.path.isdir(path):
+        return pd.read_parquet(path)
+    parts = sorted(name for name in os.listdir(path)
+                   if name.startswith('part-') and name.endswith('.parquet'))
+    if not parts:
+        return pd.read_parquet(path)
+    table = pd.concat([pd.read_parquet(os.path.join(path, name)) for name in parts],
+                      ignore_index = True)
+    if key not in table:
+        return table
+    return table.drop_duplicates(subset = key, keep = 'last').reset_index(drop = True)
+
+######################################################
+# Background saving
+######################################################
+
+class AsyncSaver:
+    """
+    Save results in a writer process while the next simulation runs.
+
+    put() hands a save call (eg. ut.saverun and its arguments) over to the
+    writer process, which runs the calls one at a time in the order they were
+    put. A process, not a thread: h.run() holds the GIL for the whole
+    simulation, so a writer thread would not run until it ends. put() pickles
+    the call and sends it to the writer before it returns, so the data can be
+    changed (or its Vectors recorded into again) afterwards; func has to be a
+    module-level function and the arguments picklable (a SweepStore or
+    Ledger is its path). put() blocks while maxsize calls are waiting, so a
+    slow disk cannot pile up unsaved runs.
+
+    An error in a save call is raised (as RuntimeError, with the original
+    traceback) from the next put() or from close().
+
+    Example:
+    -----------
+        with ut.AsyncSaver() as saver:
+            for w in weight:
+                ...
+                saver.put(ut.saverun, data, title, directory)
+    """
+
+    def __init__(self, maxsize = 4):
+        self.queue = SimpleQueue()
+        self.results = SimpleQueue()
+        self.slots = multiprocessing.Semaphore(maxsize)
+        self.errors = []
+        self.process = multiprocessing.Process(target = _save_calls,
+            args = (self.queue, self.results, self.slots))
+        self.process.daemon = True
+        self.process.start()
+
+    def put(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to run in the writer process."""
+        self.check()
+        while not self.slots.acquire(True, 1.0):
+            if not self.process.is_alive():
+                raise RuntimeError("The writer process of AsyncSaver has stopped")
+        try:
+            self.queue.put((func, args, kwargs))
+        except Exception:
+            self.slots.release()
+            raise
+
+    def check(self):
+        """Raise the first error of the writer process, if any."""
+        while not self.results.empty():
+            self.errors.append(self.results.get())
+        if self.errors:
+            raise RuntimeError("Saving in the background failed:\n" + self.errors[0])
+
+    def close(self):
+        """Wait until everything queued is saved and stop the writer process."""
+        if self.process.is_alive():
+            self.queue.put(None)
+            self.process.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # Save what is queued, but keep the error that ended the block
+        try:
+            self.close()
+        except Exception:
+            traceback.print_exc()
+
+def _save_calls(calls, results, slots):
+    """Writer process of AsyncSaver: run the save calls until None."""
+    # Ctrl-C stops the simulation; the runs already queued are still saved
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        item = calls.get()
+        if item is None:
+            break
+        func, args, kwargs = item
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            results.put(traceback.format_exc())
+        slots.release()